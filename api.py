@@ -1,8 +1,11 @@
 """Backend API for use on Social News scraping site"""
-from flask import Flask, current_app, request
+from itertools import chain, islice
+from os import environ
+from flask import Flask, current_app, request, make_response, stream_with_context
 from dotenv import load_dotenv
+import psycopg2
+from psycopg2 import errors
 from stories_functions import (
-get_db_connection,
 load_all_stories,
 update_stories,
 make_new_story,
@@ -11,61 +14,145 @@ add_votes,
 delete_story,
 sort_stories,
 find_specific_story,
-count_votes)
-from news_scaper import get_html, parse_stories_bs
-
+search_stories_page,
+load_stories_page,
+stream_stories,
+apply_story_batch,
+STREAM_BATCH_SIZE)
+from story_batch import parse_batch, report_batch, BatchError, in_id_range
+from scrape_jobs import enqueue_scrape_job, find_scrape_job, get_scrape_workers
+from db_pool import (
+get_db_connection,
+get_read_replica_connection,
+read_from_replica,
+release_db_connection,
+PoolTimeoutError,
+get_pool,
+get_replica_pools,
+get_replica_health)
+from replicas import stick_to_primary, max_lag
+from response_cache import get_stories_cache, make_etag
+from vote_buffer import get_vote_buffer, write_behind_enabled
+from trending import get_trending_refresher
+from assets import FIRST_PAGE, read_page, render_stories_page, find_asset
+from live_updates import get_story_listener, event_stream, heartbeat_seconds
+from metrics import instrument_app, render_metrics, CONTENT_TYPE
+from story_json import StoryJSONProvider
+
+
+MAX_PAGE_SIZE = 100
+POOL_RETRY_AFTER = 1
 
 app = Flask(__name__)
+app.json = StoryJSONProvider(app)
+app.teardown_appcontext(release_db_connection)
+instrument_app(app)
 load_dotenv()
 
 
+@app.after_request
+def remember_writes(response):
+    """Keeps a client that has just written reading from the primary"""
+    return stick_to_primary(response, request.method)
+
+
+@app.errorhandler(PoolTimeoutError)
+def pool_exhausted(err: PoolTimeoutError):
+    """Tells the client to retry shortly when no database connection came free in time"""
+    return {"error": True, "message": str(err)}, 503, {"Retry-After": str(POOL_RETRY_AFTER)}
+
+
 @app.route("/", methods=["GET"])
 def index():
-    """Gets stories page from html static file"""
-    return current_app.send_static_file("index.html")
+    """Gets the stories page with its first page of stories already in it,
+    so they show without waiting for a GET /stories request"""
+    stories_cache = get_stories_cache()
+    cache_key = stories_cache.key(("page", "index"))
+    cached = stories_cache.get(cache_key)
+
+    if cached is None:
+        try:
+            stories, next_cursor = load_stories_page(
+                get_read_replica_connection() or get_db_connection(), *FIRST_PAGE, None)
+        except (psycopg2.Error, PoolTimeoutError):
+            # without them the page loads its stories itself
+            return current_app.response_class(read_page("index.html"), mimetype="text/html")
+
+        body = render_stories_page(
+            read_page("index.html"), stories, next_cursor, current_app.json.dumps).encode()
+        if read_from_replica() and stories_cache.changed_within(max_lag()):
+            etag = make_etag(body)
+        else:
+            etag = stories_cache.put(cache_key, body)
+    else:
+        body, etag = cached
+
+    response = current_app.response_class(body, mimetype="text/html")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+@app.route("/assets/<path:filename>", methods=["GET"])
+def asset(filename: str):
+    """Endpoint serves a built asset, precompressed when the client accepts it"""
+    found = find_asset(filename, request.headers.get("Accept-Encoding", ""))
+    if found is None:
+        return {"error": "There is no asset with this name"}, 404
+
+    content, mimetype, headers = found
+    return current_app.response_class(content, mimetype=mimetype, headers=headers)
 
 
 @app.route("/add", methods=["GET"])
 def addstory():
     """Endpoint allows user to add story of their choice"""
-    return current_app.send_static_file("./addstory/index.html")
+    return current_app.response_class(read_page("addstory/index.html"), mimetype="text/html")
 
 
 @app.route("/scrape", methods=["GET", "POST"])
 def scrape():
-    """Endpoint allows user to view or make post request to scrape website"""
-    db_connection = get_db_connection()
-
+    """Endpoint allows user to view or make post request to scrape website.
+    Scraping happens in the background; the response gives the job to follow"""
     if request.method == 'POST':
-        current_stories = load_all_stories(db_connection)
         data = request.json
-        url = data["url"]
+        urls = data.get("urls") or [data.get("url")]
 
-        if "bbc.co.uk" not in url:
+        if not all(isinstance(url, str) and "bbc.co.uk" in url for url in urls):
             return {
                 "error": True,
                 "message":
                 "Can only scrape from BBC homepage or BBC Topic pages at this moment in time"
             }, 400
 
-        html = get_html(url)
-        new_scrape_stories = parse_stories_bs(url, html)
+        job_id = enqueue_scrape_job(get_db_connection(), urls)
+
+        scrape_workers = get_scrape_workers()
+        scrape_workers.start()
+        scrape_workers.notify()
+
+        return {
+            "success": "Scrape queued",
+            "job_id": job_id,
+            "status_url": f"/scrape/jobs/{job_id}"
+        }, 202
+
+    return current_app.response_class(read_page("scrape/index.html"), mimetype="text/html")
 
-        for story in new_scrape_stories:
-            new_story = make_new_story(story, current_stories)
-            current_stories.append(new_story)
 
-        update_stories(current_stories)
-        return {"success": "Scraped stories added"}, 201
+@app.route("/scrape/jobs/<int:job_id>", methods=["GET"])
+def scrape_job_status(job_id: int) -> dict:
+    """Endpoint reports the progress, story counts and timings of a scrape job"""
+    job = find_scrape_job(get_db_connection(), job_id)
+    if job is None:
+        return {"error": "There is no scrape job with this id"}, 404
 
-    return current_app.send_static_file("./scrape/index.html")
+    return dict(job), 200
 
 
 @app.route("/stories", methods=["GET", "POST"])
 def get_stories() -> list:
     """Endpoint allows user to create new stories, or filter current stories"""
-    db_connection = get_db_connection()
-
     if request.method == 'POST':
         new_story_info = request.json
 
@@ -75,37 +162,175 @@ def get_stories() -> list:
         if "title" not in new_story_info:
             return {"error": "missing title"}, 400
 
-        make_new_story(db_connection, new_story_info["url"], new_story_info["title"])
+        story_id = make_new_story(get_db_connection(), new_story_info["url"], new_story_info["title"])
+        if story_id is None:
+            return {"error": "Another story already has this url"}, 409
 
         return {"success": "New story added"}, 201
 
-    if request.method == 'GET':
+    args = request.args.to_dict()
+    if args.get("sort") == "trending":
+        get_trending_refresher()
+
+    if args.get("stream"):
+        return stream_all_stories(args)
+
+    stories_cache = get_stories_cache()
+    cache_key = stories_cache.key(*sorted(args.items()))
+    cached = stories_cache.get(cache_key)
+
+    if cached is None:
+        response = make_response(list_stories(args))
+        if response.status_code != 200:
+            return response
+        if read_from_replica() and stories_cache.changed_within(max_lag()):
+            # a replica may not have the latest write yet, so this is not cached for the new version
+            etag = make_etag(response.get_data())
+        else:
+            etag = stories_cache.put(cache_key, response.get_data())
+    else:
+        body, etag = cached
+        response = current_app.response_class(body, mimetype="application/json")
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+def list_stories(args: dict):
+    """Loads the stories for a GET /stories request from the database, or a replica"""
+    db_connection = get_read_replica_connection() or get_db_connection()
+    search = args.get('search')
+    sort = args.get('sort')
+    order = args.get('order')
+    prefix = args.get('prefix') in ("true", "1")
+
+    if "limit" in args:
+        return get_stories_page(db_connection, args)
+
+    if search:
+        stories = find_specific_story(db_connection, search, prefix)
+    elif sort in {"title", "score", "created", "modified", "trending"}:
+        stories = sort_stories(db_connection, sort, order)
+    else:
         stories = load_all_stories(db_connection)
-        args = request.args.to_dict()
-        search = args.get('search')
-        sort = args.get('sort')
-        order = args.get('order')
 
-        if stories:
+    if stories:
+        return stories, 200
+
+    return [{"error": True, "message": "No stories were found"}], 404
 
-            if search:
-                return find_specific_story(db_connection, search), 200
 
-            if sort in {"title", "score", "created", "modified"}:
-                return sort_stories(db_connection, sort, order), 200
+def stream_all_stories(args: dict):
+    """Streams every story from a server-side cursor as a JSON array, or as
+    one JSON object per line with stream=ndjson, without loading the table"""
+    if "search" in args or "limit" in args:
+        return {
+            "error": True,
+            "message": "stream cannot be combined with search or limit"
+        }, 400
 
-            return stories, 200
+    batch_size = int(environ.get("STREAM_BATCH_SIZE", STREAM_BATCH_SIZE))
+    rows = stream_stories(get_read_replica_connection() or get_db_connection(),
+                          args.get("sort"), args.get("order"), batch_size)
 
+    first = next(rows, None)
+    if first is None:
         return [{"error": True, "message": "No stories were found"}], 404
 
+    ndjson = args["stream"] == "ndjson"
+    body = encode_rows(chain([first], rows), ndjson, batch_size)
+    return current_app.response_class(
+        stream_with_context(body),
+        mimetype="application/x-ndjson" if ndjson else "application/json")
+
+
+def encode_rows(rows, ndjson: bool, batch_size: int):
+    """Serializes rows with the app's JSON provider, so dates and decimals match
+    the other endpoints, yielding one chunk per batch_size rows"""
+    opening = "["
+    while batch := list(islice(rows, batch_size)):
+        encoded = current_app.json.encode_rows(batch, separators=(",", ":"))
+        if ndjson:
+            yield "".join(row + "\n" for row in encoded)
+        else:
+            yield opening + ",".join(encoded)
+            opening = ","
+
+    if not ndjson:
+        yield "]" if opening == "," else "[]"
+
+
+def get_stories_page(db_connection, args: dict) -> dict:
+    """Returns one page of stories and the cursor for the following page"""
+    try:
+        limit = int(args["limit"])
+    except ValueError:
+        return {"error": True, "message": "limit must be a whole number"}, 400
+
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return {
+            "error": True,
+            "message": f"limit must be between 1 and {MAX_PAGE_SIZE}"
+        }, 400
+
+    try:
+        if args.get("search"):
+            prefix = args.get("prefix") in ("true", "1")
+            stories, next_cursor = search_stories_page(
+                db_connection, args["search"], prefix, limit, args.get("cursor"))
+        else:
+            stories, next_cursor = load_stories_page(
+                db_connection, args.get("sort"), args.get("order"), limit, args.get("cursor"))
+    except ValueError as err:
+        return {"error": True, "message": str(err)}, 400
+
+    return {"stories": stories, "next_cursor": next_cursor}, 200
+
+
+@app.route("/stories/batch", methods=["POST"])
+def batch_stories() -> dict:
+    """Endpoint applies many creates, edits, votes and deletes in one
+    transaction, reporting the outcome of each as story_batch describes"""
+    try:
+        plan, results = parse_batch(request.json)
+    except BatchError as err:
+        return {"error": True, "message": str(err)}, 400
+
+    try:
+        written = apply_story_batch(get_db_connection(), plan)
+    except errors.UniqueViolation:
+        return {"error": "Another story already has this url"}, 409
+
+    return report_batch(plan, results, written), 200
+
+
+@app.route("/stories/stream", methods=["GET"])
+def story_changes():
+    """Endpoint sends stories as they are added, edited, deleted or voted on,
+    as Server-Sent Events, so pages can patch themselves without reloading"""
+    return current_app.response_class(
+        event_stream(get_story_listener(), heartbeat_seconds()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/stories/stream/stats", methods=["GET"])
+def story_changes_stats() -> dict:
+    """Endpoint reports how many clients are following story changes"""
+    return get_story_listener().stats(), 200
+
 
 @app.route("/stories/<int:story_id>", methods=["PATCH", "DELETE"])
 def edit_stories(story_id: int) -> dict:
     """Endpoint allows user to delete story of their choice"""
+    if not in_id_range(story_id):
+        return {"error": "There is no story with this id"}, 404
+
     db_connection = get_db_connection()
 
     story = find_story_with_id(db_connection, story_id)
-    if story == []:
+    if story is None:
         return {"error": "There is no story with this id"}, 404
 
     if request.method == 'PATCH':
@@ -117,11 +342,15 @@ def edit_stories(story_id: int) -> dict:
         if "title" not in edited_story_info:
             return {"error": "missing title"}, 400
 
-        update_stories(db_connection,
-                       edited_story_info["url"],
-                       edited_story_info["title"],
-                       story_id
-                       )
+        try:
+            update_stories(db_connection,
+                           edited_story_info["url"],
+                           edited_story_info["title"],
+                           story_id
+                           )
+        except errors.UniqueViolation:
+            db_connection.rollback()
+            return {"error": "Another story already has this url"}, 409
 
         return {"success": "Story updated"}, 201
 
@@ -134,23 +363,56 @@ def edit_stories(story_id: int) -> dict:
 @app.route("/stories/<int:story_id>/votes", methods=["POST"])
 def vote(story_id: int) -> dict:
     """Endpoint allows user to vote story of their choice"""
-    db_connection = get_db_connection()
-
     data = request.json
-    direction = data["direction"]
+    direction = data.get("direction")
+    if direction not in ("up", "down"):
+        return {"error": True, "message": "Direction must be up or down"}, 400
+
+    if not in_id_range(story_id):
+        return {"error": "There is no story with this id"}, 404
+
+    if write_behind_enabled():
+        get_vote_buffer().add(story_id, direction)
+        return {"success": "vote queued"}, 202
+
+    db_connection = get_db_connection()
+    if add_votes(db_connection, direction, story_id) is None:
+        if find_story_with_id(db_connection, story_id) is None:
+            return {"error": "There is no story with this id"}, 404
 
-    votes = count_votes(db_connection, story_id)
-    score = votes[0].get('score')
-    if not score and direction == "down":
         return {
             "error": True,
             "message": "Can't downvote for a story with points of 0"
         }, 400
 
-    add_votes(db_connection, direction, story_id)
-
     return {"success": "user voted"}, 200
 
 
+@app.route("/pool/stats", methods=["GET"])
+def pool_stats() -> dict:
+    """Endpoint reports database connection pool usage for monitoring,
+    and how reads are split between replicas when there are any"""
+    stats = get_pool().stats()
+    replica_pools = get_replica_pools()
+    if replica_pools:
+        stats["replica_pools"] = [pool.stats() for pool in replica_pools]
+        stats["read_routing"] = get_replica_health().stats()
+    return stats, 200
+
+
+@app.route("/trending/stats", methods=["GET"])
+def trending_stats() -> dict:
+    """Endpoint reports how often the trending ranking is refreshed and what it costs"""
+    return get_trending_refresher().stats(), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Endpoint exposes request, query and scrape metrics in Prometheus text format"""
+    return current_app.response_class(render_metrics(), content_type=CONTENT_TYPE)
+
+
 if __name__ == "__main__":
+    get_scrape_workers().start()
+    get_trending_refresher()
     app.run(debug=True, host="0.0.0.0", port=5000)
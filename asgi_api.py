@@ -0,0 +1,481 @@
+"""Async (ASGI) version of the stories API, serving the same routes and JSON as api.py.
+
+Requests wait on Postgres through an asyncpg pool and scrape jobs fetch
+pages with an async HTTP client, so one process can hold thousands of
+open connections without a thread for each. Serve it with an ASGI server:
+
+    hypercorn asgi_api:app
+"""
+from os import environ
+import asyncpg
+from quart import Quart, current_app, request, make_response, g
+from dotenv import load_dotenv
+
+from async_stories_functions import (
+load_all_stories,
+update_stories,
+make_new_story,
+find_story_with_id,
+add_votes,
+delete_story,
+sort_stories,
+find_specific_story,
+search_stories_page,
+load_stories_page,
+stream_stories,
+apply_story_batch)
+from story_batch import parse_batch, report_batch, BatchError, in_id_range
+from async_scrape_jobs import enqueue_scrape_job, find_scrape_job, make_scrape_workers
+from async_db_pool import (
+get_async_pool,
+close_async_pool,
+get_read_replica_pool,
+get_replica_health,
+replica_pool_stats,
+pool_stats as async_pool_stats)
+from db_pool import PoolTimeoutError
+from stories_functions import STREAM_BATCH_SIZE
+from replicas import stick_to_primary, reads_pinned_to_primary, max_lag
+from response_cache import get_stories_cache, make_etag
+from vote_buffer import get_vote_buffer, write_behind_enabled
+from trending import get_trending_refresher
+from assets import FIRST_PAGE, read_page, render_stories_page, find_asset
+from live_updates import heartbeat_seconds
+from async_live_updates import get_story_listener, stop_story_listener, event_stream
+from metrics import instrument_app, render_metrics, CONTENT_TYPE
+from story_json import StoryJSONProvider
+
+
+MAX_PAGE_SIZE = 100
+POOL_RETRY_AFTER = 1
+
+app = Quart(__name__)
+app.json = StoryJSONProvider(app)
+instrument_app(app, request, g)
+load_dotenv()
+
+_scrape_workers = None
+
+
+async def get_db_pool() -> asyncpg.Pool:
+    """The asyncpg pool requests run their queries on"""
+    return await get_async_pool()
+
+
+async def get_read_pool() -> asyncpg.Pool:
+    """The pool for the current request's story reads: a replica's, or the primary's"""
+    replica_pool = await get_read_replica_pool(reads_pinned_to_primary(request.cookies))
+    g.read_from_replica = replica_pool is not None
+    return replica_pool or await get_db_pool()
+
+
+async def get_scrape_workers():
+    """Returns this process's async scrape workers, creating them on first use"""
+    global _scrape_workers
+
+    if _scrape_workers is None:
+        _scrape_workers = make_scrape_workers(await get_db_pool())
+    return _scrape_workers
+
+
+@app.before_serving
+async def start_background_workers():
+    """Starts the scrape workers and trending refresher alongside the server"""
+    (await get_scrape_workers()).start()
+    get_trending_refresher()
+
+
+@app.after_serving
+async def shutdown():
+    """Lets running scrape jobs finish and stops listening for story changes,
+    then closes the pool"""
+    if _scrape_workers is not None:
+        await _scrape_workers.stop()
+    await stop_story_listener()
+    await close_async_pool()
+
+
+@app.after_request
+async def remember_writes(response):
+    """Keeps a client that has just written reading from the primary"""
+    return stick_to_primary(response, request.method)
+
+
+@app.errorhandler(PoolTimeoutError)
+async def pool_exhausted(err: PoolTimeoutError):
+    """Tells the client to retry shortly when no database connection came free in time"""
+    return {"error": True, "message": str(err)}, 503, {"Retry-After": str(POOL_RETRY_AFTER)}
+
+
+@app.route("/", methods=["GET"])
+async def index():
+    """Gets the stories page with its first page of stories already in it,
+    so they show without waiting for a GET /stories request"""
+    stories_cache = get_stories_cache()
+    cache_key = stories_cache.key(("page", "index"))
+    cached = stories_cache.get(cache_key)
+
+    if cached is None:
+        try:
+            stories, next_cursor = await load_stories_page(
+                await get_read_pool(), *FIRST_PAGE, None)
+        except (asyncpg.PostgresError, OSError, PoolTimeoutError):
+            # without them the page loads its stories itself
+            return current_app.response_class(read_page("index.html"), mimetype="text/html")
+
+        body = render_stories_page(
+            read_page("index.html"), stories, next_cursor, current_app.json.dumps).encode()
+        if g.get("read_from_replica") and stories_cache.changed_within(max_lag()):
+            etag = make_etag(body)
+        else:
+            etag = stories_cache.put(cache_key, body)
+    else:
+        body, etag = cached
+
+    response = current_app.response_class(body, mimetype="text/html")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return await response.make_conditional(request)
+
+
+@app.route("/assets/<path:filename>", methods=["GET"])
+async def asset(filename: str):
+    """Endpoint serves a built asset, precompressed when the client accepts it"""
+    found = find_asset(filename, request.headers.get("Accept-Encoding", ""))
+    if found is None:
+        return {"error": "There is no asset with this name"}, 404
+
+    content, mimetype, headers = found
+    return current_app.response_class(content, mimetype=mimetype, headers=headers)
+
+
+@app.route("/add", methods=["GET"])
+async def addstory():
+    """Endpoint allows user to add story of their choice"""
+    return current_app.response_class(read_page("addstory/index.html"), mimetype="text/html")
+
+
+@app.route("/scrape", methods=["GET", "POST"])
+async def scrape():
+    """Endpoint allows user to view or make post request to scrape website.
+    Scraping happens in the background; the response gives the job to follow"""
+    if request.method == 'POST':
+        data = await request.get_json()
+        urls = data.get("urls") or [data.get("url")]
+
+        if not all(isinstance(url, str) and "bbc.co.uk" in url for url in urls):
+            return {
+                "error": True,
+                "message":
+                "Can only scrape from BBC homepage or BBC Topic pages at this moment in time"
+            }, 400
+
+        job_id = await enqueue_scrape_job(await get_db_pool(), urls)
+
+        scrape_workers = await get_scrape_workers()
+        scrape_workers.start()
+        scrape_workers.notify()
+
+        return {
+            "success": "Scrape queued",
+            "job_id": job_id,
+            "status_url": f"/scrape/jobs/{job_id}"
+        }, 202
+
+    return current_app.response_class(read_page("scrape/index.html"), mimetype="text/html")
+
+
+@app.route("/scrape/jobs/<int:job_id>", methods=["GET"])
+async def scrape_job_status(job_id: int) -> dict:
+    """Endpoint reports the progress, story counts and timings of a scrape job"""
+    job = await find_scrape_job(await get_db_pool(), job_id)
+    if job is None:
+        return {"error": "There is no scrape job with this id"}, 404
+
+    return dict(job), 200
+
+
+@app.route("/stories", methods=["GET", "POST"])
+async def get_stories() -> list:
+    """Endpoint allows user to create new stories, or filter current stories"""
+    if request.method == 'POST':
+        new_story_info = await request.get_json()
+
+        if "url" not in new_story_info:
+            return {"error": "missing url"}, 400
+
+        if "title" not in new_story_info:
+            return {"error": "missing title"}, 400
+
+        story_id = await make_new_story(await get_db_pool(), new_story_info["url"], new_story_info["title"])
+        if story_id is None:
+            return {"error": "Another story already has this url"}, 409
+
+        return {"success": "New story added"}, 201
+
+    args = request.args.to_dict()
+    if args.get("sort") == "trending":
+        get_trending_refresher()
+
+    if args.get("stream"):
+        return await stream_all_stories(args)
+
+    stories_cache = get_stories_cache()
+    cache_key = stories_cache.key(*sorted(args.items()))
+    cached = stories_cache.get(cache_key)
+
+    if cached is None:
+        response = await make_response(await list_stories(args))
+        if response.status_code != 200:
+            return response
+        if g.get("read_from_replica") and stories_cache.changed_within(max_lag()):
+            # a replica may not have the latest write yet, so this is not cached for the new version
+            etag = make_etag(await response.get_data())
+        else:
+            etag = stories_cache.put(cache_key, await response.get_data())
+    else:
+        body, etag = cached
+        response = current_app.response_class(body, mimetype="application/json")
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return await response.make_conditional(request)
+
+
+async def list_stories(args: dict):
+    """Loads the stories for a GET /stories request from the database, or a replica"""
+    pool = await get_read_pool()
+    search = args.get('search')
+    sort = args.get('sort')
+    order = args.get('order')
+    prefix = args.get('prefix') in ("true", "1")
+
+    if "limit" in args:
+        return await get_stories_page(pool, args)
+
+    if search:
+        stories = await find_specific_story(pool, search, prefix)
+    elif sort in {"title", "score", "created", "modified", "trending"}:
+        stories = await sort_stories(pool, sort, order)
+    else:
+        stories = await load_all_stories(pool)
+
+    if stories:
+        return stories, 200
+
+    return [{"error": True, "message": "No stories were found"}], 404
+
+
+async def stream_all_stories(args: dict):
+    """Streams every story from a server-side cursor as a JSON array, or as
+    one JSON object per line with stream=ndjson, without loading the table"""
+    if "search" in args or "limit" in args:
+        return {
+            "error": True,
+            "message": "stream cannot be combined with search or limit"
+        }, 400
+
+    batch_size = int(environ.get("STREAM_BATCH_SIZE", STREAM_BATCH_SIZE))
+    rows = stream_stories(await get_read_pool(), args.get("sort"), args.get("order"), batch_size)
+
+    first = await anext(rows, None)
+    if first is None:
+        return [{"error": True, "message": "No stories were found"}], 404
+
+    ndjson = args["stream"] == "ndjson"
+    return current_app.response_class(
+        encode_rows(prepend(first, rows), current_app.json, ndjson, batch_size),
+        mimetype="application/x-ndjson" if ndjson else "application/json")
+
+
+async def encode_rows(rows, provider, ndjson: bool, batch_size: int):
+    """Serializes rows with the app's JSON provider, like api.encode_rows,
+    yielding one chunk per batch_size rows. Runs after the request context
+    has gone, so the provider is looked up beforehand"""
+    opening = "["
+    async for batch in batched(rows, batch_size):
+        encoded = provider.encode_rows(batch, separators=(",", ":"))
+        if ndjson:
+            yield "".join(row + "\n" for row in encoded)
+        else:
+            yield opening + ",".join(encoded)
+            opening = ","
+
+    if not ndjson:
+        yield "]" if opening == "," else "[]"
+
+
+async def batched(rows, size: int):
+    """Lists of up to size rows from an async iterator"""
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+async def prepend(first: dict, rows):
+    """Puts back the row read ahead of an async iterator"""
+    yield first
+    async for row in rows:
+        yield row
+
+
+async def get_stories_page(pool: asyncpg.Pool, args: dict) -> dict:
+    """Returns one page of stories and the cursor for the following page"""
+    try:
+        limit = int(args["limit"])
+    except ValueError:
+        return {"error": True, "message": "limit must be a whole number"}, 400
+
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return {
+            "error": True,
+            "message": f"limit must be between 1 and {MAX_PAGE_SIZE}"
+        }, 400
+
+    try:
+        if args.get("search"):
+            prefix = args.get("prefix") in ("true", "1")
+            stories, next_cursor = await search_stories_page(
+                pool, args["search"], prefix, limit, args.get("cursor"))
+        else:
+            stories, next_cursor = await load_stories_page(
+                pool, args.get("sort"), args.get("order"), limit, args.get("cursor"))
+    except ValueError as err:
+        return {"error": True, "message": str(err)}, 400
+
+    return {"stories": stories, "next_cursor": next_cursor}, 200
+
+
+@app.route("/stories/batch", methods=["POST"])
+async def batch_stories() -> dict:
+    """Endpoint applies many creates, edits, votes and deletes in one
+    transaction, reporting the outcome of each as story_batch describes"""
+    try:
+        plan, results = parse_batch(await request.get_json())
+    except BatchError as err:
+        return {"error": True, "message": str(err)}, 400
+
+    try:
+        written = await apply_story_batch(await get_db_pool(), plan)
+    except asyncpg.UniqueViolationError:
+        return {"error": "Another story already has this url"}, 409
+
+    return report_batch(plan, results, written), 200
+
+
+@app.route("/stories/stream", methods=["GET"])
+async def story_changes():
+    """Endpoint sends stories as they are added, edited, deleted or voted on,
+    as Server-Sent Events, so pages can patch themselves without reloading"""
+    response = current_app.response_class(
+        event_stream(get_story_listener(), heartbeat_seconds()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.timeout = None
+    return response
+
+
+@app.route("/stories/stream/stats", methods=["GET"])
+async def story_changes_stats() -> dict:
+    """Endpoint reports how many clients are following story changes"""
+    return get_story_listener().stats(), 200
+
+
+@app.route("/stories/<int:story_id>", methods=["PATCH", "DELETE"])
+async def edit_stories(story_id: int) -> dict:
+    """Endpoint allows user to delete story of their choice"""
+    if not in_id_range(story_id):
+        return {"error": "There is no story with this id"}, 404
+
+    pool = await get_db_pool()
+
+    story = await find_story_with_id(pool, story_id)
+    if story is None:
+        return {"error": "There is no story with this id"}, 404
+
+    if request.method == 'PATCH':
+        edited_story_info = await request.get_json()
+
+        if "url" not in edited_story_info:
+            return {"error": "missing url"}, 400
+
+        if "title" not in edited_story_info:
+            return {"error": "missing title"}, 400
+
+        try:
+            await update_stories(pool,
+                                 edited_story_info["url"],
+                                 edited_story_info["title"],
+                                 story_id
+                                 )
+        except asyncpg.UniqueViolationError:
+            return {"error": "Another story already has this url"}, 409
+
+        return {"success": "Story updated"}, 201
+
+    if request.method == 'DELETE':
+        await delete_story(pool, story_id)
+
+    return {"success": "Story deleted"}, 200
+
+
+@app.route("/stories/<int:story_id>/votes", methods=["POST"])
+async def vote(story_id: int) -> dict:
+    """Endpoint allows user to vote story of their choice"""
+    data = await request.get_json()
+    direction = data.get("direction")
+    if direction not in ("up", "down"):
+        return {"error": True, "message": "Direction must be up or down"}, 400
+
+    if not in_id_range(story_id):
+        return {"error": "There is no story with this id"}, 404
+
+    if write_behind_enabled():
+        get_vote_buffer().add(story_id, direction)
+        return {"success": "vote queued"}, 202
+
+    pool = await get_db_pool()
+    if await add_votes(pool, direction, story_id) is None:
+        if await find_story_with_id(pool, story_id) is None:
+            return {"error": "There is no story with this id"}, 404
+
+        return {
+            "error": True,
+            "message": "Can't downvote for a story with points of 0"
+        }, 400
+
+    return {"success": "user voted"}, 200
+
+
+@app.route("/pool/stats", methods=["GET"])
+async def pool_stats() -> dict:
+    """Endpoint reports database connection pool usage for monitoring,
+    and how reads are split between replicas when there are any"""
+    stats = async_pool_stats(await get_db_pool())
+    replica_health = get_replica_health()
+    if replica_health is not None:
+        stats["replica_pools"] = replica_pool_stats()
+        stats["read_routing"] = replica_health.stats()
+    return stats, 200
+
+
+@app.route("/trending/stats", methods=["GET"])
+async def trending_stats() -> dict:
+    """Endpoint reports how often the trending ranking is refreshed and what it costs"""
+    return get_trending_refresher().stats(), 200
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    """Endpoint exposes request, query and scrape metrics in Prometheus text format"""
+    return current_app.response_class(render_metrics(), content_type=CONTENT_TYPE)
+
+
+if __name__ == "__main__":
+    app.run(debug=True, host="0.0.0.0", port=5000)
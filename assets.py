@@ -0,0 +1,153 @@
+"""Fingerprinted, precompressed static assets and the server-rendered stories page.
+
+build_assets.py copies each file in ASSETS to static/dist with a hash of its
+content in the name, next to gzip and (with the brotli package) brotli copies,
+and lists them in static/dist/manifest.json. Pages then link
+/assets/<fingerprinted name>, which is served in the best encoding the client
+accepts and cached for a year, since changed content gets a new name. Without
+a build, pages link the plain files in static/ as before.
+
+The stories page is sent with its first page of stories already in it, as
+markup for the first paint and as JSON index.js picks up instead of asking
+GET /stories again.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import re
+from functools import lru_cache
+from html import escape
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC = Path(__file__).parent / "static"
+DIST = STATIC / "dist"
+MANIFEST = "manifest.json"
+ASSETS = ("index.js", "index.css", "addstory/index.js", "scrape/index.js")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+ASSET_LINK = re.compile(r'(src|href)="\.\./static/([^"]+)"')
+
+# The stories page's default sort and order selects, and index.js's PAGE_SIZE
+FIRST_PAGE = ("title", "ascending", 20)
+STORY_BUTTONS = (("up", "⬆"), ("down", "⬇"), ("delete", "❌"), ("edit", "🖊️"))
+EMPTY_STORIES = '<div id="stories"></div>'
+
+
+def fingerprinted_name(name: str, content: bytes) -> str:
+    """The name an asset is served under, with a hash of its content before the extension"""
+    path = Path(name)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return str(path.with_name(f"{path.stem}.{digest}{path.suffix}"))
+
+
+def build(static_dir: Path = STATIC, dist_dir: Path = DIST) -> dict:
+    """Writes every asset's fingerprinted, gzipped and brotli copies to
+    dist_dir and returns the manifest of {name: fingerprinted name}. Copies
+    from earlier builds are kept for pages still linking them"""
+    manifest = {}
+    for name in ASSETS:
+        content = (static_dir / name).read_bytes()
+        fingerprinted = fingerprinted_name(name, content)
+        target = dist_dir / fingerprinted
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        target.write_bytes(content)
+        target.with_name(target.name + ".gz").write_bytes(gzip.compress(content, 9, mtime=0))
+        if brotli:
+            target.with_name(target.name + ".br").write_bytes(brotli.compress(content, quality=11))
+        manifest[name] = fingerprinted
+
+    (dist_dir / MANIFEST).write_text(json.dumps(manifest, indent=2), encoding="utf_8")
+    load_manifest.cache_clear()
+    return manifest
+
+
+@lru_cache(maxsize=1)
+def load_manifest() -> dict:
+    """The last build's manifest, or {} when there has not been one"""
+    try:
+        return json.loads((DIST / MANIFEST).read_text(encoding="utf_8"))
+    except FileNotFoundError:
+        return {}
+
+
+def asset_url(name: str) -> str:
+    """Where a page should load an asset from"""
+    fingerprinted = load_manifest().get(name)
+    return f"/assets/{fingerprinted}" if fingerprinted else f"/static/{name}"
+
+
+def link_assets(html: str) -> str:
+    """Points a page's ../static links at the built assets"""
+    return ASSET_LINK.sub(lambda link: f'{link[1]}="{asset_url(link[2])}"', html)
+
+
+def read_page(name: str) -> str:
+    """A page from static/, linking the built assets"""
+    return link_assets((STATIC / name).read_text(encoding="utf_8"))
+
+
+def accepted_encodings(accept_encoding: str) -> dict:
+    """{coding: q} from an Accept-Encoding header"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, *params = [piece.strip() for piece in part.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            accepted[coding.lower()] = quality
+    return accepted
+
+
+def find_asset(filename: str, accept_encoding: str) -> tuple:
+    """(content, mimetype, headers) for a built asset in the best encoding the
+    client accepts, or None if no build produced that file"""
+    if filename not in load_manifest().values():
+        return None
+
+    path = DIST / filename
+    headers = {"Cache-Control": IMMUTABLE, "Vary": "Accept-Encoding"}
+    accepted = accepted_encodings(accept_encoding)
+    for coding, suffix in ENCODINGS:
+        encoded = path.with_name(path.name + suffix)
+        if accepted.get(coding, accepted.get("*", 0)) > 0 and encoded.exists():
+            path = encoded
+            headers["Content-Encoding"] = coding
+            break
+
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    return path.read_bytes(), mimetype, headers
+
+
+def story_markup(story: dict) -> str:
+    """A story as index.js's createStoryElement builds it"""
+    story_id = int(story["id"])
+    buttons = "".join(f'<button id="{story_id}-{action}" class="vote-button">{label}</button>'
+                      for action, label in STORY_BUTTONS)
+    return (f'<div class="storyWrapper" data-id="{story_id}" data-score="{story["score"]}">'
+            f'<div class="voteWrapper">{buttons}</div>'
+            f'<div><a href="{escape(story["url"])}">{escape(story["title"])}</a>'
+            f'<span class="score">({story["score"]} points)</span></div></div>')
+
+
+def render_stories_page(html: str, stories: list[dict], next_cursor: str, dumps) -> str:
+    """The stories page with its first page of stories in it, given the app's
+    JSON dumps so the embedded stories match GET /stories"""
+    first_page = dumps({"stories": stories, "next_cursor": next_cursor}).replace("<", "\\u003c")
+    markup = "".join(story_markup(story) for story in stories)
+    return html.replace(
+        EMPTY_STORIES,
+        f'<div id="stories">{markup}</div>\n'
+        f'      <script id="first_page" type="application/json">{first_page}</script>', 1)
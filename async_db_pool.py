@@ -0,0 +1,167 @@
+"""Pool of asyncpg connections for the async serving mode, one checked out per statement.
+
+Story reads can use a pool per read replica instead, chosen by
+get_read_replica_pool as described in replicas.py.
+"""
+import asyncio
+from os import environ
+import asyncpg
+
+from db_pool import PoolTimeoutError
+from metrics import record_query
+from replicas import replica_dsns, make_replica_health, ReplicaHealth, LAG_QUERY
+
+
+def log_query(record) -> None:
+    """asyncpg query logger feeding each statement into the query metrics"""
+    record_query(record.query, record.args, record.elapsed, failed=record.exception is not None)
+
+
+async def instrument_connection(connection: asyncpg.Connection) -> None:
+    """Pool init hook, run on every new connection"""
+    connection.add_query_logger(log_query)
+
+
+def database_target(dsn: str = None) -> dict:
+    """asyncpg connection arguments for the primary, or for the database a
+    connection string names"""
+    if dsn:
+        return {"dsn": dsn}
+    return {
+        "user": environ["DATABASE_USERNAME"],
+        "password": environ["DATABASE_PASSWORD"],
+        "host": environ["DATABASE_IP"],
+        "port": environ["DATABASE_PORT"],
+        "database": environ["DATABASE_NAME"]
+    }
+
+
+class TimedPool(asyncpg.Pool):
+    """An asyncpg pool that stops waiting for a free connection after
+    acquire_timeout seconds and raises PoolTimeoutError, as the sync pool does.
+    pool.fetch, pool.execute and pool.acquire() all acquire through _acquire"""
+    __slots__ = ("acquire_timeout",)
+
+    async def _acquire(self, timeout):
+        timeout = self.acquire_timeout if timeout is None else timeout
+        try:
+            return await super()._acquire(timeout)
+        except asyncio.TimeoutError as err:
+            raise PoolTimeoutError(
+                f"No database connection free after {timeout} seconds") from err
+
+
+async def create_async_pool(dsn: str = None, connect=None) -> asyncpg.Pool:
+    """Opens a pool sized by the same environment settings as the sync pool,
+    to the primary or to the database a connection string names.
+    The arguments asyncpg.create_pool would default are given explicitly"""
+    pool = TimedPool(
+        **database_target(dsn),
+        min_size=int(environ.get("DATABASE_POOL_MIN_SIZE", 1)),
+        max_size=int(environ.get("DATABASE_POOL_MAX_SIZE", 10)),
+        max_queries=50000,
+        max_inactive_connection_lifetime=float(environ.get("DATABASE_POOL_MAX_IDLE", 300)),
+        connect=connect,
+        init=instrument_connection,
+        loop=None,
+        connection_class=asyncpg.Connection,
+        record_class=asyncpg.Record
+    )
+    pool.acquire_timeout = float(environ.get("DATABASE_POOL_TIMEOUT", 5))
+    return await pool
+
+
+_async_pool = None
+_async_pool_lock = asyncio.Lock()
+_replica_pools = None
+_replica_health = None
+
+
+async def get_async_pool() -> asyncpg.Pool:
+    """Returns the process-wide async pool, creating it on first use"""
+    global _async_pool
+
+    async with _async_pool_lock:
+        if _async_pool is None:
+            _async_pool = await create_async_pool()
+        return _async_pool
+
+
+def get_replica_health() -> ReplicaHealth:
+    """Returns the health tracking of this process's replica pools, None without replicas"""
+    global _replica_pools, _replica_health
+
+    if _replica_pools is None:
+        dsns = replica_dsns()
+        _replica_pools = [None] * len(dsns)
+        _replica_health = make_replica_health(len(dsns)) if dsns else None
+    return _replica_health
+
+
+async def replica_lag(pool: asyncpg.Pool) -> float:
+    """Seconds a replica's data is behind the primary, like stories_functions.replica_lag"""
+    lag = await pool.fetchval(LAG_QUERY)
+    return None if lag is None else float(lag)
+
+
+async def get_read_replica_pool(pinned_to_primary: bool = False) -> asyncpg.Pool:
+    """Returns the pool of the next usable replica for story reads, opening it
+    on first use and measuring its lag when due. Returns None when reads should
+    use the primary: there are no replicas, none is up to date, or the client
+    has just written"""
+    health = get_replica_health()
+    if health is None:
+        return None
+
+    if not pinned_to_primary:
+        dsns = replica_dsns()
+        for index in health.candidates():
+            try:
+                async with _async_pool_lock:
+                    if _replica_pools[index] is None:
+                        _replica_pools[index] = await create_async_pool(dsns[index])
+                pool = _replica_pools[index]
+
+                if health.lag_due(index):
+                    health.record_lag(index, await replica_lag(pool))
+            except (OSError, asyncpg.PostgresError, asyncio.TimeoutError, PoolTimeoutError):
+                health.mark_down(index)
+                continue
+
+            if health.within_lag(index):
+                health.record_read(True)
+                return pool
+
+    health.record_read(False)
+    return None
+
+
+def replica_pool_stats() -> list[dict]:
+    """Returns a snapshot of each replica pool opened so far"""
+    return [pool_stats(pool) for pool in _replica_pools or [] if pool is not None]
+
+
+async def close_async_pool() -> None:
+    """Closes every connection in the async pool and the replica pools"""
+    global _async_pool, _replica_pools
+
+    async with _async_pool_lock:
+        pool, _async_pool = _async_pool, None
+        replica_pools, _replica_pools = _replica_pools or [], None
+
+    for open_pool in [pool, *replica_pools]:
+        if open_pool is not None:
+            await open_pool.close()
+
+
+def pool_stats(pool: asyncpg.Pool) -> dict:
+    """Returns a snapshot of the async pool for monitoring"""
+    size = pool.get_size()
+    idle = pool.get_idle_size()
+    return {
+        "min_size": pool.get_min_size(),
+        "max_size": pool.get_max_size(),
+        "size": size,
+        "idle": idle,
+        "in_use": size - idle
+    }
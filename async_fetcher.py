@@ -0,0 +1,132 @@
+"""Concurrent page fetcher for the async serving mode.
+
+Behaves like fetcher.Fetcher (per-host limits, timeouts, retries with
+backoff, redirects and the page cache) but runs on the event loop with an
+httpx.AsyncClient, so fetching a batch of pages does not hold any threads.
+"""
+import asyncio
+import time
+import httpx
+
+from fetcher import FetchError, RETRY_STATUSES, MAX_REDIRECTS, USER_AGENT
+from metrics import timed_phase
+from page_cache import PageCache
+
+
+class AsyncFetcher:
+    """Fetches many pages at once with per-host limits, timeouts and retries"""
+
+    def __init__(self, per_host: int = 4, timeout: float = 10, deadline: float = 60,
+                 retries: int = 2, backoff: float = 0.5, cache: PageCache = None,
+                 transport: httpx.AsyncBaseTransport = None):
+        self.per_host = per_host
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+
+        self.client = httpx.AsyncClient(
+            timeout=timeout, follow_redirects=True, max_redirects=MAX_REDIRECTS,
+            headers={"User-Agent": USER_AGENT}, transport=transport)
+        self._host_limits = {}
+
+    async def fetch_all(self, urls: list[str], failures: dict = None):
+        """Yields (url, html) for each url as soon as it has been fetched.
+        With a cache, html is None when the page has not changed since it was
+        last fetched, and a changed page is only cached once the caller calls
+        cache.commit(url) after storing its stories. Urls that still fail after
+        retrying, or are unfinished when the deadline passes, are left out and
+        recorded in failures if given"""
+        failures = failures if failures is not None else {}
+        finish_by = time.monotonic() + self.deadline
+
+        tasks = {asyncio.ensure_future(self._fetch_for(url, finish_by)): url
+                 for url in dict.fromkeys(urls)}
+        try:
+            for next_done in asyncio.as_completed(
+                    tasks, timeout=max(0, finish_by - time.monotonic())):
+                url, html, error = await next_done
+                if error is None:
+                    yield url, html
+                else:
+                    failures[url] = error
+        except asyncio.TimeoutError:
+            for task, url in tasks.items():
+                if not task.done():
+                    failures[url] = FetchError("Deadline passed before the page was fetched")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def fetch(self, url: str, finish_by: float = None) -> str:
+        """Fetches one page, retrying connection errors and temporary server errors.
+        Returns None if the cache shows the page is unchanged"""
+        finish_by = finish_by or time.monotonic() + self.deadline
+        attempt = 0
+
+        with timed_phase("fetch"):
+            while True:
+                try:
+                    return await self._fetch_once(url, finish_by)
+                except FetchError as err:
+                    if not err.retryable or attempt >= self.retries:
+                        raise
+                    delay = self.backoff * 2 ** attempt
+                    if time.monotonic() + delay >= finish_by:
+                        raise
+                    attempt += 1
+                    await asyncio.sleep(delay)
+
+    async def close(self) -> None:
+        """Closes the connections kept open between batches"""
+        await self.client.aclose()
+
+    async def _fetch_for(self, url: str, finish_by: float) -> tuple:
+        """Fetches a url for fetch_all, returning the error rather than raising it"""
+        try:
+            return url, await self.fetch(url, finish_by), None
+        except FetchError as err:
+            return url, None, err
+
+    async def _fetch_once(self, url: str, finish_by: float) -> str:
+        """Requests a page within its host's concurrency limit and checks it against the cache.
+        The request times out at the deadline if that comes before the usual timeout"""
+        headers = self.cache.conditional_headers(url) if self.cache else {}
+
+        try:
+            async with self._host_limit(httpx.URL(url).host):
+                remaining = finish_by - time.monotonic()
+                if remaining <= 0:
+                    raise FetchError(f"Deadline passed waiting to fetch {url}")
+                response = await self.client.get(
+                    url, headers=headers, timeout=min(self.timeout, remaining))
+        except httpx.UnsupportedProtocol as err:
+            raise FetchError(f"{url} is not an http(s) url") from err
+        except httpx.TooManyRedirects as err:
+            raise FetchError(f"{url} redirected more than {MAX_REDIRECTS} times") from err
+        except httpx.HTTPError as err:
+            raise FetchError(f"{url}: {err!r}", retryable=True) from err
+
+        if response.status_code == 304 and self.cache:
+            self.cache.not_modified(url)
+            return None
+
+        if response.status_code in RETRY_STATUSES:
+            raise FetchError(f"{url} returned HTTP {response.status_code}", retryable=True)
+
+        if response.status_code >= 400:
+            raise FetchError(f"{url} returned HTTP {response.status_code}")
+
+        html = response.text
+        if self.cache and not self.cache.stage(
+                url, html, response.headers.get("ETag"), response.headers.get("Last-Modified")):
+            return None
+
+        return html
+
+    def _host_limit(self, host: str) -> asyncio.Semaphore:
+        """Semaphore capping concurrent requests to one host"""
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host)
+        return self._host_limits[host]
@@ -0,0 +1,163 @@
+"""Live story updates for the async app, as live_updates.py does for the sync one.
+
+The listener holds its own asyncpg connection outside the pool, LISTENing on
+the story_changes channel, and copies each notification to every
+subscriber's queue on the event loop.
+"""
+import asyncio
+from collections import deque
+from os import environ
+import asyncpg
+
+from async_db_pool import database_target
+from live_updates import CHANNEL, RETRY_MS, format_event, parse_notification
+
+
+class AsyncSubscription:
+    """Events waiting to be sent to one client, like live_updates.Subscription"""
+
+    def __init__(self, max_pending: int = 100):
+        self.max_pending = max_pending
+        self._events = deque()
+        self._ready = asyncio.Event()
+
+    def put(self, event: str, data: str) -> bool:
+        """Queues an event. If the client is too far behind, its queue is
+        replaced by a reset event and False is returned"""
+        overflowed = len(self._events) >= self.max_pending
+        if overflowed:
+            self._events.clear()
+            self._events.append(("reset", "{}"))
+        else:
+            self._events.append((event, data))
+        self._ready.set()
+        return not overflowed
+
+    async def get(self, timeout: float) -> tuple:
+        """Waits up to timeout seconds for the next (event, data), or returns None"""
+        if not self._events:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self._events.popleft()
+
+
+async def event_stream(listener, heartbeat: float):
+    """Subscribes to a listener and yields its events as Server-Sent Events,
+    like live_updates.event_stream"""
+    subscription = listener.subscribe()
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        while True:
+            next_event = await subscription.get(heartbeat)
+            yield ": keep-alive\n\n" if next_event is None else format_event(*next_event)
+    finally:
+        listener.unsubscribe(subscription)
+
+
+async def connect_listener() -> asyncpg.Connection:
+    """Opens the listener's own connection to the primary"""
+    return await asyncpg.connect(**database_target())
+
+
+class AsyncStoryChangeListener:
+    """One LISTEN connection per process, fanning notifications out to subscribers"""
+
+    def __init__(self, connect=connect_listener, max_pending: int = 100,
+                 reconnect_delay: float = 1.0):
+        self.connect = connect
+        self.max_pending = max_pending
+        self.reconnect_delay = reconnect_delay
+
+        self._subscribers = set()
+        self._task = None
+        self._stats = {"notifications": 0, "resets": 0, "reconnects": 0}
+
+    def subscribe(self) -> AsyncSubscription:
+        """Adds a subscriber, starting to listen if this is the first"""
+        subscription = AsyncSubscription(self.max_pending)
+        self._subscribers.add(subscription)
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+        return subscription
+
+    def unsubscribe(self, subscription: AsyncSubscription) -> None:
+        """Removes a subscriber"""
+        self._subscribers.discard(subscription)
+
+    def publish(self, event: str, data: str) -> None:
+        """Sends an event to every subscriber"""
+        self._stats["notifications"] += 1
+        for subscription in list(self._subscribers):
+            if not subscription.put(event, data):
+                self._stats["resets"] += 1
+
+    async def stop(self) -> None:
+        """Stops listening"""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        """Returns the subscriber count and notification counters"""
+        return {"subscribers": len(self._subscribers), **self._stats}
+
+    def _notified(self, connection, pid, channel, payload) -> None:
+        """asyncpg notification callback"""
+        try:
+            self.publish(*parse_notification(payload))
+        except ValueError as err:
+            print("Unreadable story change.", err)
+
+    async def _listen(self) -> None:
+        """Listens until stopped, reconnecting after the connection is lost.
+        Subscribers are reset after a reconnect since notifications may have
+        been missed"""
+        connected_before = False
+        while True:
+            connection = None
+            try:
+                connection = await self.connect()
+                lost = asyncio.Event()
+                connection.add_termination_listener(lambda closed: lost.set())
+                await connection.add_listener(CHANNEL, self._notified)
+
+                if connected_before:
+                    self.publish("reset", "{}")
+                connected_before = True
+
+                await lost.wait()
+                print("Lost the story change listener's connection.")
+            except (asyncpg.PostgresError, OSError) as err:
+                print("Error listening for story changes.", err)
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+
+            self._stats["reconnects"] += 1
+            await asyncio.sleep(self.reconnect_delay)
+
+
+_listener = None
+
+
+def get_story_listener() -> AsyncStoryChangeListener:
+    """Returns this process's story change listener, creating it on first use"""
+    global _listener
+
+    if _listener is None:
+        _listener = AsyncStoryChangeListener(
+            max_pending=int(environ.get("SSE_MAX_PENDING", 100)))
+    return _listener
+
+
+async def stop_story_listener() -> None:
+    """Stops the listener if one was started"""
+    if _listener is not None:
+        await _listener.stop()
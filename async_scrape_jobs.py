@@ -0,0 +1,260 @@
+"""Scrape jobs for the async serving mode, run as tasks on the event loop.
+
+Jobs share the scrape_jobs table with scrape_jobs.py, so sync and async
+workers can take jobs from the same queue. Pages are fetched with an
+AsyncFetcher and parsed in a thread so the loop keeps serving requests.
+"""
+import asyncio
+import time
+from os import environ
+import asyncpg
+
+from async_fetcher import AsyncFetcher
+from db_pool import PoolTimeoutError
+from ingest import unique_stories, merge_statement
+from metrics import timed_phase, timed_query
+from news_scaper import parse_stories_bs, default_backend
+from page_cache import PageCache
+from response_cache import invalidate_stories
+
+
+@timed_query
+async def enqueue_scrape_job(pool: asyncpg.Pool, urls: list[str]) -> int:
+    """Queues a job to scrape the given urls and returns its id"""
+    query = """INSERT INTO scrape_jobs (urls, status, created_at)
+            VALUES ($1, 'queued', current_timestamp) RETURNING id;"""
+    return await pool.fetchval(query, urls)
+
+
+@timed_query
+async def claim_scrape_job(pool: asyncpg.Pool, stale_after: float,
+                           max_attempts: int = 3) -> dict:
+    """Marks the oldest queued job as running and returns it, skipping jobs
+    other workers hold. Jobs left running past stale_after seconds are retried,
+    until they have been tried max_attempts times and are marked failed"""
+    query = """WITH abandoned AS (
+                UPDATE scrape_jobs
+                SET status = 'failed', finished_at = current_timestamp,
+                error = 'Gave up after ' || attempts || ' attempts that did not finish'
+                WHERE status = 'running' AND attempts >= $2::int
+                AND started_at < current_timestamp - $1::float8 * interval '1 second')
+            UPDATE scrape_jobs
+            SET status = 'running', started_at = current_timestamp, attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM scrape_jobs
+                WHERE status = 'queued'
+                OR (status = 'running' AND attempts < $2::int
+                    AND started_at < current_timestamp - $1::float8 * interval '1 second')
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1)
+            RETURNING *;"""
+    job = await pool.fetchrow(query, stale_after, max_attempts)
+    return dict(job) if job else None
+
+
+@timed_query
+async def finish_scrape_job(pool: asyncpg.Pool, job_id: int, results: dict) -> None:
+    """Records the outcome, counts and phase timings of a job"""
+    query = """UPDATE scrape_jobs
+            SET status = $1, stories_found = $2, stories_added = $3, stories_updated = $4,
+            stories_skipped = $5, stories_merged = $6, urls_failed = $7, urls_unchanged = $8,
+            fetch_ms = $9, parse_ms = $10, insert_ms = $11,
+            error = $12, finished_at = current_timestamp
+            WHERE id = $13;"""
+    await pool.execute(
+        query, results["status"], results["stories_found"], results["stories_added"],
+        results["stories_updated"], results["stories_skipped"], results["stories_merged"],
+        results["urls_failed"], results["urls_unchanged"], results["fetch_ms"],
+        results["parse_ms"], results["insert_ms"], results["error"], job_id)
+
+
+@timed_query
+async def find_scrape_job(pool: asyncpg.Pool, job_id: int) -> dict:
+    """Finds a scrape job with a specific id"""
+    row = await pool.fetchrow("SELECT * FROM scrape_jobs WHERE id = $1;", job_id)
+    return dict(row) if row else None
+
+
+@timed_query
+async def ingest_stories(pool: asyncpg.Pool, stories: list[dict]) -> dict:
+    """Writes a whole scrape result in one statement, merging near-duplicate
+    titles like ingest.ingest_stories. The rows are sent as arrays and
+    expanded with unnest, with each story's bands as an array literal"""
+    counts = {"inserted": 0, "updated": 0, "merged": 0, "skipped": 0}
+
+    rows, counts["merged"] = unique_stories(stories)
+
+    if rows:
+        query = merge_statement("""SELECT title, url, canonical_url, fingerprint, bands::int[]
+                FROM unnest($1::text[], $2::text[], $3::text[], $4::bigint[], $5::text[])
+                AS batch (title, url, canonical_url, fingerprint, bands)""")
+        written = await pool.fetchrow(
+            query,
+            [title for title, _, _, _, _ in rows],
+            [url for _, url, _, _, _ in rows],
+            [canonical_url for _, _, canonical_url, _, _ in rows],
+            [fingerprint for _, _, _, fingerprint, _ in rows],
+            ["{" + ",".join(map(str, bands)) + "}" for _, _, _, _, bands in rows])
+        invalidate_stories()
+
+        counts["inserted"] = written["inserted"]
+        counts["updated"] = written["updated"]
+        counts["merged"] += written["merged"]
+
+    counts["skipped"] = len(stories) - counts["inserted"] - counts["updated"] - counts["merged"]
+    return counts
+
+
+async def run_scrape_job(pool: asyncpg.Pool, job: dict, fetcher: AsyncFetcher) -> dict:
+    """Fetches every url in a job concurrently, parsing and upserting each page's
+    stories as it arrives and timing each phase, like scrape_jobs.run_scrape_job"""
+    results = {
+        "stories_found": 0,
+        "stories_added": 0,
+        "stories_updated": 0,
+        "stories_skipped": 0,
+        "stories_merged": 0,
+        "urls_failed": 0,
+        "urls_unchanged": 0,
+        "fetch_ms": 0.0,
+        "parse_ms": 0.0,
+        "insert_ms": 0.0,
+        "error": None
+    }
+    failures = {}
+
+    start = time.perf_counter()
+    async for url, html in fetcher.fetch_all(job["urls"], failures):
+        results["fetch_ms"] += (time.perf_counter() - start) * 1000
+
+        if html is None:
+            results["urls_unchanged"] += 1
+            start = time.perf_counter()
+            continue
+
+        start = time.perf_counter()
+        stories = await asyncio.to_thread(parse_stories_bs, url, html)
+        results["parse_ms"] += (time.perf_counter() - start) * 1000
+        results["stories_found"] += len(stories)
+
+        start = time.perf_counter()
+        with timed_phase("insert"):
+            counts = await ingest_stories(pool, stories)
+        if fetcher.cache:
+            fetcher.cache.commit(url)
+        results["stories_added"] += counts["inserted"]
+        results["stories_updated"] += counts["updated"]
+        results["stories_skipped"] += counts["skipped"]
+        results["stories_merged"] += counts["merged"]
+        results["insert_ms"] += (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+    results["fetch_ms"] += (time.perf_counter() - start) * 1000
+
+    results["urls_failed"] = len(failures)
+    if failures:
+        results["error"] = "; ".join(str(err) for err in failures.values())
+
+    failed_every_url = len(failures) == len(set(job["urls"]))
+    results["status"] = "failed" if failed_every_url else "done"
+
+    return results
+
+
+class AsyncScrapeWorkers:
+    """Bounded set of tasks that claim and run queued scrape jobs"""
+
+    def __init__(self, pool: asyncpg.Pool, workers: int = 2, poll_interval: float = 2.0,
+                 stale_after: float = 600.0, fetcher: AsyncFetcher = None,
+                 max_attempts: int = 3):
+        self.pool = pool
+        self.fetcher = fetcher or AsyncFetcher()
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+
+        self._tasks = []
+        self._wake = asyncio.Event()
+        self._stopping = asyncio.Event()
+
+    def start(self) -> None:
+        """Starts the worker tasks if they are not already running"""
+        if self._tasks:
+            return
+
+        self._stopping.clear()
+        self._tasks = [asyncio.create_task(self._work(), name=f"scrape-worker-{number}")
+                       for number in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Asks every worker to finish its current job and exit"""
+        tasks, self._tasks = self._tasks, []
+
+        self._stopping.set()
+        self._wake.set()
+        await asyncio.gather(*tasks)
+        await self.fetcher.close()
+
+    def notify(self) -> None:
+        """Wakes idle workers so a newly queued job starts straight away"""
+        self._wake.set()
+
+    async def _work(self) -> None:
+        """Claims and runs jobs until the workers are stopped"""
+        while not self._stopping.is_set():
+            try:
+                ran_job = await self._run_next_job()
+            except (asyncpg.PostgresError, OSError, asyncio.TimeoutError, PoolTimeoutError) as err:
+                print("Error running scrape job.", err)
+                ran_job = False
+
+            if not ran_job:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+
+    async def _run_next_job(self) -> bool:
+        """Runs one queued job, returning False if the queue was empty"""
+        job = await claim_scrape_job(self.pool, self.stale_after, self.max_attempts)
+        if job is None:
+            return False
+
+        try:
+            results = await run_scrape_job(self.pool, job, self.fetcher)
+        except Exception as err:  # pylint: disable=broad-except
+            results = {
+                "status": "failed", "stories_found": 0, "stories_added": 0,
+                "stories_updated": 0, "stories_skipped": 0, "stories_merged": 0,
+                "urls_failed": 0, "urls_unchanged": 0, "fetch_ms": None, "parse_ms": None,
+                "insert_ms": None, "error": str(err)
+            }
+
+        await finish_scrape_job(self.pool, job["id"], results)
+        return True
+
+
+def make_scrape_workers(pool: asyncpg.Pool) -> AsyncScrapeWorkers:
+    """Async scrape workers configured from the same environment settings as the sync ones"""
+    default_backend()  # a misspelt PARSER_BACKEND fails here, not on the first job
+    return AsyncScrapeWorkers(
+        pool,
+        workers=int(environ.get("SCRAPE_WORKERS", 2)),
+        poll_interval=float(environ.get("SCRAPE_POLL_INTERVAL", 2)),
+        stale_after=float(environ.get("SCRAPE_JOB_TIMEOUT", 600)),
+        max_attempts=int(environ.get("SCRAPE_JOB_MAX_ATTEMPTS", 3)),
+        fetcher=AsyncFetcher(
+            per_host=int(environ.get("FETCH_PER_HOST", 4)),
+            timeout=float(environ.get("FETCH_TIMEOUT", 10)),
+            deadline=float(environ.get("FETCH_DEADLINE", 60)),
+            cache=PageCache(
+                environ.get("PAGE_CACHE_DIR", ".page_cache"),
+                max_entries=int(environ.get("PAGE_CACHE_MAX_ENTRIES", 500)),
+                max_bytes=int(environ.get("PAGE_CACHE_MAX_BYTES", 50_000_000)),
+                ttl=float(environ.get("PAGE_CACHE_TTL", 86400))
+            )
+        )
+    )
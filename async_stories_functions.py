@@ -0,0 +1,277 @@
+"""asyncpg versions of the story queries, for the async serving mode.
+
+Each function mirrors the one of the same name in stories_functions and
+returns the same shapes, taking a pool instead of a connection.
+"""
+from datetime import datetime
+import asyncpg
+
+from ingest import canonicalize_url, title_fingerprint, fingerprint_bands
+from metrics import timed_query
+from response_cache import invalidate_stories
+from story_batch import create_statement, edit_statement, vote_statement, vote_tallies
+from story_records import from_asyncpg, record_class
+from stories_functions import (
+PAGE_SORT_KEYS,
+STORY_COLUMNS,
+STREAM_BATCH_SIZE,
+encode_cursor,
+decode_cursor,
+encode_search_cursor,
+decode_search_cursor,
+build_prefix_query,
+resolve_order,
+trending_settings)
+
+
+@timed_query
+async def load_all_stories(pool: asyncpg.Pool) -> list[dict[str]]:
+    """Returns all the story data from the database, as StoryRecords"""
+    rows = await pool.fetch(f"SELECT {STORY_COLUMNS} FROM stories;")
+    return from_asyncpg(rows)
+
+
+@timed_query
+async def update_stories(pool: asyncpg.Pool, url: str, title: str, story_id: int):
+    """Edits the content of a story"""
+    query = """UPDATE stories
+        SET title = $1, url = $2, canonical_url = $3, title_fingerprint = $4,
+        title_bands = $5, updated_at = current_timestamp
+        WHERE id = $6;"""
+    fingerprint = title_fingerprint(title)
+    await pool.execute(query, title, url, canonicalize_url(url), fingerprint,
+                       fingerprint_bands(fingerprint), story_id)
+    invalidate_stories()
+
+
+@timed_query
+async def make_new_story(pool: asyncpg.Pool, url: str, title: str) -> int:
+    """Creates a new story and adds this to database, returning its id, or
+    None if a story with the same canonical url already exists"""
+    query = """INSERT INTO stories (title, url, canonical_url, title_fingerprint, title_bands,
+        created_at, updated_at)
+        VALUES ($1, $2, $3, $4, $5, current_timestamp, current_timestamp)
+        ON CONFLICT (canonical_url) DO NOTHING
+        RETURNING id;"""
+    fingerprint = title_fingerprint(title)
+    story_id = await pool.fetchval(query, title, url, canonicalize_url(url), fingerprint,
+                                   fingerprint_bands(fingerprint))
+    invalidate_stories()
+    return story_id
+
+
+@timed_query
+async def find_story_with_id(pool: asyncpg.Pool, story_id: int) -> dict:
+    """Finds a story with specific id"""
+    row = await pool.fetchrow(f"SELECT {STORY_COLUMNS} FROM stories WHERE id = $1;",
+                              story_id)
+    return dict(row) if row else None
+
+
+@timed_query
+async def add_votes(pool: asyncpg.Pool, direction: str, story_id: int) -> int:
+    """Adds a new vote to story and updates its score counters and trending
+    rank in one atomic statement. Returns the new score, or None if no vote was added"""
+    query = """WITH counted AS (
+            UPDATE stories SET
+            upvotes = upvotes + ($1::text = 'up')::int,
+            downvotes = downvotes + ($1::text = 'down')::int,
+            score = score + CASE $1::text WHEN 'up' THEN 1 ELSE -1 END,
+            trending_score = trending_rank(
+                score + CASE $1::text WHEN 'up' THEN 1 ELSE -1 END, created_at, $3, $4)
+            WHERE id = $2 AND ($1::text = 'up' OR score > 0)
+            RETURNING id, score)
+            INSERT INTO votes(direction, created_at, updated_at, story_id)
+            SELECT $1::text, current_timestamp, current_timestamp, id FROM counted
+            RETURNING (SELECT score FROM counted);"""
+    settings = trending_settings()
+    score = await pool.fetchval(
+        query, direction, story_id, settings["gravity"], settings["age_offset"])
+
+    if score is None:
+        return None
+
+    invalidate_stories()
+    return score
+
+
+@timed_query
+async def delete_story(pool: asyncpg.Pool, story_id: int):
+    """Deletes a story given an id. Its votes and vote rollups go with it,
+    as their foreign keys cascade"""
+    await pool.execute("DELETE FROM stories WHERE id = $1;", story_id)
+    invalidate_stories()
+
+
+def bands_literal(bands: list[int]) -> str:
+    """A story's bands as an array literal, so a batch's bands fit in one text[]"""
+    return "{" + ",".join(map(str, bands)) + "}"
+
+
+@timed_query
+async def apply_story_batch(pool: asyncpg.Pool, plan: dict) -> dict:
+    """Writes a checked batch in one transaction like
+    stories_functions.apply_story_batch, sending each kind's rows as arrays"""
+    written = {"created": {}, "edited": {}, "voted": {}, "deleted": set()}
+    creates, edits = plan["create"], plan["edit"]
+    tallies = vote_tallies(plan["vote"])
+
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            if creates:
+                rows = await connection.fetch(
+                    create_statement("""SELECT title, url, canonical_url, fingerprint,
+                            bands::int[]
+                        FROM unnest($1::text[], $2::text[], $3::text[], $4::bigint[],
+                            $5::text[]) AS batch (title, url, canonical_url, fingerprint, bands)"""),
+                    [row[1] for row in creates], [row[2] for row in creates],
+                    [row[3] for row in creates], [row[4] for row in creates],
+                    [bands_literal(row[5]) for row in creates])
+                written["created"] = {row["canonical_url"]: row["id"] for row in rows}
+
+            if edits:
+                rows = await connection.fetch(
+                    edit_statement("""SELECT id, title, url, canonical_url, fingerprint,
+                            bands::int[]
+                        FROM unnest($1::int[], $2::text[], $3::text[], $4::text[],
+                            $5::bigint[], $6::text[])
+                        AS batch (id, title, url, canonical_url, fingerprint, bands)"""),
+                    [row[1] for row in edits], [row[2] for row in edits],
+                    [row[3] for row in edits], [row[4] for row in edits],
+                    [row[5] for row in edits], [bands_literal(row[6]) for row in edits])
+                written["edited"] = {row["id"]: (row["found"], row["updated"]) for row in rows}
+
+            if tallies:
+                settings = trending_settings()
+                rows = await connection.fetch(
+                    vote_statement("SELECT * FROM unnest($1::int[], $2::int[], $3::int[])",
+                                   "$4", "$5"),
+                    list(tallies), [ups for ups, _ in tallies.values()],
+                    [downs for _, downs in tallies.values()],
+                    settings["gravity"], settings["age_offset"])
+                written["voted"] = {row["id"]: (row["ups"], row["downs"], row["score"])
+                                    for row in rows}
+
+            if plan["delete"]:
+                rows = await connection.fetch(
+                    "DELETE FROM stories WHERE id = ANY($1::int[]) RETURNING id;",
+                    [story_id for _, story_id in plan["delete"]])
+                written["deleted"] = {row["id"] for row in rows}
+
+    invalidate_stories()
+    return written
+
+
+@timed_query
+async def sort_stories(pool: asyncpg.Pool, sort_type: str, order: str,
+                       limit: int = None) -> list[dict]:
+    """Sorts stories based on input from user and returns it"""
+    sort_order = 'ASC' if resolve_order(sort_type, order) == "ascending" else 'DESC'
+    sort_key = PAGE_SORT_KEYS.get(sort_type, "id")
+
+    rows = await pool.fetch(f"""SELECT {STORY_COLUMNS} FROM stories
+            ORDER BY {sort_key} {sort_order}, id {sort_order}
+            LIMIT $1;""", limit)
+    return from_asyncpg(rows)
+
+
+def cursor_sort_key(sort_type: str, sort_key):
+    """Converts the sort key from a decoded cursor to the column's type, which
+    asyncpg needs where psycopg2 lets Postgres cast"""
+    if sort_type in ("created", "modified"):
+        return datetime.fromisoformat(sort_key)
+    if sort_type == "trending":
+        return float(sort_key)
+    return sort_key
+
+
+@timed_query
+async def load_stories_page(pool: asyncpg.Pool, sort_type: str, order: str,
+                            limit: int, cursor: str = None) -> tuple[list[dict], str]:
+    """Loads one page of stories using keyset pagination, returning the
+    stories and a cursor for the next page (None on the last page)"""
+    sort_type = sort_type if sort_type in PAGE_SORT_KEYS else "id"
+    order = resolve_order(sort_type, order)
+    sort_key = PAGE_SORT_KEYS[sort_type]
+    sort_order, seek = ("ASC", ">") if order == "ascending" else ("DESC", "<")
+
+    where = ""
+    params = []
+    if cursor:
+        cursor_sort, cursor_order, last_key, last_id = decode_cursor(cursor)
+        if (cursor_sort, cursor_order) != (sort_type, order):
+            raise ValueError("Cursor does not match the requested sort")
+        where = f"WHERE ({sort_key}, id) {seek} ($1, $2)"
+        params = [cursor_sort_key(sort_type, last_key), last_id]
+
+    rows = await pool.fetch(f"""SELECT {STORY_COLUMNS}, {sort_key} AS sort_key FROM stories
+            {where}
+            ORDER BY {sort_key} {sort_order}, id {sort_order}
+            LIMIT ${len(params) + 1};""", *params, limit + 1)
+
+    stories = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = stories[-1]
+        next_cursor = encode_cursor(sort_type, order, last["sort_key"], last["id"])
+
+    for story in stories:
+        del story["sort_key"]
+
+    return stories, next_cursor
+
+
+@timed_query
+async def find_specific_story(pool: asyncpg.Pool, search: str, prefix: bool = False,
+                              limit: int = None, offset: int = 0) -> list[dict]:
+    """Finds stories matching a user search, most relevant first, through
+    the full-text and trigram indexes"""
+    if prefix:
+        terms = "to_tsquery('english', $1)"
+        search_terms = build_prefix_query(search)
+    else:
+        terms = "plainto_tsquery('english', $1)"
+        search_terms = search
+
+    query = f"""SELECT {STORY_COLUMNS} FROM stories, {terms} AS terms
+            WHERE to_tsvector('english', title) @@ terms
+            OR LOWER(title) LIKE $2
+            OR LOWER(title) % $3
+            ORDER BY ts_rank(to_tsvector('english', title), terms) DESC,
+            similarity(LOWER(title), $3) DESC, id
+            LIMIT $4 OFFSET $5;"""
+    rows = await pool.fetch(query, search_terms, f'%{search.lower()}%', search.lower(), limit,
+                            offset)
+    return from_asyncpg(rows)
+
+
+async def search_stories_page(pool: asyncpg.Pool, search: str, prefix: bool,
+                              limit: int, cursor: str = None) -> tuple[list[dict], str]:
+    """Loads one page of search results and a cursor for the next page"""
+    offset = decode_search_cursor(cursor, search) if cursor else 0
+    stories = await find_specific_story(pool, search, prefix, limit + 1, offset)
+
+    next_cursor = None
+    if len(stories) > limit:
+        stories = stories[:limit]
+        next_cursor = encode_search_cursor(search, offset + limit)
+
+    return stories, next_cursor
+
+
+async def stream_stories(pool: asyncpg.Pool, sort_type: str = None, order: str = None,
+                         batch_size: int = STREAM_BATCH_SIZE):
+    """Yields every story in the requested sort from a server-side cursor,
+    prefetching batch_size rows at a time"""
+    sort_order = 'ASC' if resolve_order(sort_type, order) == "ascending" else 'DESC'
+    sort_key = PAGE_SORT_KEYS.get(sort_type, "id")
+
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            query = f"""SELECT {STORY_COLUMNS} FROM stories
+                    ORDER BY {sort_key} {sort_order}, id {sort_order};"""
+            record = None
+            async for row in connection.cursor(query, prefetch=batch_size):
+                if record is None:
+                    record = record_class(tuple(row.keys()))
+                yield record(tuple(row))
@@ -0,0 +1,42 @@
+"""Fills in the canonical url of stories saved before urls were deduplicated"""
+from dotenv import load_dotenv
+from psycopg2 import extras
+from ingest import canonicalize_url
+from stories_functions import get_db_connection
+
+
+def backfill_canonical_urls(connection) -> tuple[int, int]:
+    """Sets canonical urls on stories that lack one, oldest first. Later stories
+    sharing a canonical url are left unset and counted as duplicates"""
+    cursor = connection.cursor()
+
+    cursor.execute("SELECT canonical_url FROM stories WHERE canonical_url IS NOT NULL;")
+    taken = {canonical_url for (canonical_url, ) in cursor.fetchall()}
+
+    cursor.execute("SELECT id, url FROM stories WHERE canonical_url IS NULL ORDER BY id;")
+    updates = []
+    duplicates = 0
+    for story_id, url in cursor.fetchall():
+        canonical_url = canonicalize_url(url)
+        if canonical_url in taken:
+            duplicates += 1
+            continue
+        taken.add(canonical_url)
+        updates.append((canonical_url, story_id))
+
+    extras.execute_values(cursor, """UPDATE stories SET canonical_url = data.canonical_url
+            FROM (VALUES %s) AS data (canonical_url, id)
+            WHERE stories.id = data.id;""", updates)
+
+    connection.commit()
+    cursor.close()
+
+    return len(updates), duplicates
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    db_connection = get_db_connection()
+    filled, duplicate_count = backfill_canonical_urls(db_connection)
+    db_connection.close()
+    print(f"Set canonical urls on {filled} stories, {duplicate_count} duplicates left unset")
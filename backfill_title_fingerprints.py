@@ -0,0 +1,36 @@
+"""Fills in the title fingerprint of stories saved before near-duplicate titles were merged"""
+from dotenv import load_dotenv
+from psycopg2 import extras
+from ingest import title_fingerprint, fingerprint_bands
+from stories_functions import get_db_connection
+
+
+def backfill_title_fingerprints(connection) -> int:
+    """Sets the fingerprint and bands of every story that lacks them"""
+    cursor = connection.cursor()
+
+    cursor.execute("SELECT id, title FROM stories WHERE title_fingerprint IS NULL ORDER BY id;")
+    updates = []
+    for story_id, title in cursor.fetchall():
+        fingerprint = title_fingerprint(title)
+        if fingerprint is not None:
+            updates.append((fingerprint, fingerprint_bands(fingerprint), story_id))
+
+    extras.execute_values(cursor, """UPDATE stories
+            SET title_fingerprint = data.fingerprint, title_bands = data.bands
+            FROM (VALUES %s) AS data (fingerprint, bands, id)
+            WHERE stories.id = data.id;""", updates,
+            template="(%s::bigint, %s::int[], %s)")
+
+    connection.commit()
+    cursor.close()
+
+    return len(updates)
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    db_connection = get_db_connection()
+    filled = backfill_title_fingerprints(db_connection)
+    db_connection.close()
+    print(f"Set title fingerprints on {filled} stories")
@@ -0,0 +1,341 @@
+"""Drives every API endpoint under concurrent load and records latency percentiles.
+
+Seeds a synthetic dataset in its own schema (built from social_news.sql) so
+real data is untouched, serves api.py on a local port with that schema as
+its search_path, and serves the saved pages in fixtures/ from a second
+local port for POST /scrape. Run from the repository root:
+
+    python -m benchmarks.bench_api --stories 100000 --votes 10000000 --concurrency 16
+
+Results are written as JSON with stable keys, so runs on two commits can be
+diffed directly or compared with --compare.
+"""
+import argparse
+import http.client
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from dotenv import load_dotenv
+
+ROOT = Path(__file__).parent.parent
+FIXTURES = ROOT / "fixtures"
+SCHEMA = "api_bench"
+SORTS = ["title", "score", "created", "modified"]
+SKIPPED_SCHEMA_STATEMENTS = ("DROP ", "CREATE DATABASE", "CREATE EXTENSION")
+
+WORDS = [
+    "election", "minister", "budget", "football", "storm", "climate", "police",
+    "hospital", "strike", "market", "energy", "housing", "school", "court",
+    "london", "scotland", "wales", "council", "festival", "music", "film",
+    "award", "league", "rail", "airport", "flood", "inflation", "bank",
+    "teachers", "nurses", "doctors", "parliament", "vote", "tax", "museum",
+    "theatre", "royal", "science", "space", "farmers", "prices", "jobs"
+]
+
+
+def schema_statements() -> list[str]:
+    """The tables and indexes from social_news.sql, without the statements
+    that drop or create databases, extensions or existing tables. Semicolons
+    inside $$ quoted function bodies do not end a statement"""
+    sql = (ROOT / "social_news.sql").read_text(encoding="utf_8")
+    statements = [""]
+    for number, part in enumerate(sql.split("$$")):
+        if number % 2:
+            statements[-1] += f"$${part}$$"
+            continue
+        first, *rest = part.split(";")
+        statements[-1] += first
+        statements.extend(rest)
+    statements = [statement.strip() for statement in statements]
+    return [statement for statement in statements
+            if statement and not statement.upper().startswith(SKIPPED_SCHEMA_STATEMENTS)]
+
+
+def seed(connection, stories: int, votes: int) -> None:
+    """Creates the benchmark schema and fills it with synthetic stories and votes"""
+    cursor = connection.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+    cursor.execute(f"CREATE SCHEMA {SCHEMA};")
+    cursor.execute(f"SET search_path TO {SCHEMA}, public;")
+    for statement in schema_statements():
+        cursor.execute(statement)
+
+    cursor.execute("""INSERT INTO stories (title, url, canonical_url, created_at, updated_at)
+            SELECT INITCAP(array_to_string(ARRAY(
+                    SELECT (%s::text[])[1 + floor(random() * %s)::int]
+                    FROM generate_series(1, 5 + i %% 6)), ' ')),
+                'https://www.bbc.co.uk/news/' || i,
+                'https://bbc.co.uk/news/' || i,
+                now() - i * interval '1 minute',
+                now() - (i %% 977) * interval '1 minute'
+            FROM generate_series(1, %s) AS i;""", (WORDS, len(WORDS), stories))
+    cursor.execute("""INSERT INTO votes (direction, created_at, updated_at, story_id)
+            SELECT CASE WHEN random() < 0.7 THEN 'up' ELSE 'down' END,
+                now(), now(), 1 + floor(random() * %s)::int
+            FROM generate_series(1, %s);""", (stories, votes))
+    cursor.execute("""UPDATE stories SET
+            upvotes = tallies.upvotes, downvotes = tallies.downvotes,
+            score = GREATEST(0, tallies.upvotes - tallies.downvotes)
+            FROM (SELECT story_id,
+                COUNT(*) FILTER (WHERE direction = 'up') AS upvotes,
+                COUNT(*) FILTER (WHERE direction = 'down') AS downvotes
+                FROM votes GROUP BY story_id) AS tallies
+            WHERE stories.id = tallies.story_id;""")
+    connection.commit()
+
+    connection.autocommit = True
+    cursor.execute("VACUUM ANALYZE stories;")
+    cursor.execute("VACUUM ANALYZE votes;")
+    connection.autocommit = False
+    cursor.close()
+
+
+def drop_schema(connection) -> None:
+    """Removes the benchmark schema and everything in it"""
+    cursor = connection.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+    connection.commit()
+    cursor.close()
+
+
+def serve(server) -> str:
+    """Runs a server on a daemon thread and returns its host:port"""
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return f"{host}:{port}"
+
+
+class QuietFixtureHandler(SimpleHTTPRequestHandler):
+    """Serves fixtures/ without logging each request"""
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+def fixture_urls(fixture_host: str, run: int) -> list[str]:
+    """Urls of every saved page, unique to this run so the page cache never skips them.
+    The query mentions bbc.co.uk, which is all POST /scrape checks for"""
+    return [f"http://{fixture_host}/{path.name}?site=bbc.co.uk&run={run}"
+            for path in sorted(FIXTURES.glob("*.html"))]
+
+
+def make_scenarios(stories: int, requests: int, fixture_host: str) -> dict:
+    """Request lists for each scenario, as (method, path, body) tuples"""
+    def story_id():
+        return random.randint(1, stories)
+
+    scenarios = {
+        "get_stories_all": [("GET", "/stories", None)] * max(1, requests // 50),
+        "get_stories_search": [
+            ("GET", f"/stories?search={random.choice(WORDS)}", None) for _ in range(requests)],
+        "get_stories_search_prefix": [
+            ("GET", f"/stories?search={random.choice(WORDS)[:4]}&prefix=true&limit=20", None)
+            for _ in range(requests)],
+    }
+    for sort in SORTS:
+        scenarios[f"get_stories_sort_{sort}"] = [
+            ("GET", f"/stories?sort={sort}&order={random.choice(['ascending', 'descending'])}",
+             None) for _ in range(max(1, requests // 50))]
+        scenarios[f"get_stories_page_{sort}"] = [
+            ("GET", f"/stories?sort={sort}&limit=20", None) for _ in range(requests)]
+
+    scenarios["post_stories"] = [
+        ("POST", "/stories", {"url": f"https://www.bbc.co.uk/news/bench-{n}",
+                              "title": f"Benchmark story {n}"}) for n in range(requests)]
+    scenarios["patch_stories"] = [
+        ("PATCH", f"/stories/{story}", {"url": f"https://www.bbc.co.uk/news/{story}",
+                                         "title": f"Edited story {story}"})
+        for story in (story_id() for _ in range(requests))]
+    scenarios["post_votes"] = [
+        ("POST", f"/stories/{story_id()}/votes", {"direction": random.choice(["up", "down"])})
+        for _ in range(requests)]
+    scenarios["post_scrape"] = [
+        ("POST", "/scrape", {"urls": fixture_urls(fixture_host, run)})
+        for run in range(max(1, requests // 20))]
+    scenarios["delete_stories"] = [
+        ("DELETE", f"/stories/{story}", None)
+        for story in random.sample(range(1, stories + 1), min(stories, requests))]
+
+    return scenarios
+
+
+def percentile(timings: list[float], percent: float) -> float:
+    """Nearest-rank percentile of sorted timings"""
+    return timings[max(0, math.ceil(percent / 100 * len(timings)) - 1)]
+
+
+def wait_for_job(connection, status_url: str, timeout: float = 120) -> str:
+    """Polls a scrape job until it is no longer queued or running"""
+    finish_by = time.monotonic() + timeout
+    while time.monotonic() < finish_by:
+        connection.request("GET", status_url)
+        status = json.loads(connection.getresponse().read())["status"]
+        if status not in ("queued", "running"):
+            return status
+        time.sleep(0.05)
+    return "timed out"
+
+
+def run_scenario(api_host: str, plan: list[tuple], concurrency: int) -> dict:
+    """Sends every request in the plan from a number of keep-alive clients and
+    summarises throughput, latency percentiles and response statuses"""
+    timings = []
+    statuses = {}
+    lock = threading.Lock()
+    remaining = iter(plan)
+
+    def client():
+        connection = http.client.HTTPConnection(api_host, timeout=300)
+        while True:
+            with lock:
+                item = next(remaining, None)
+            if item is None:
+                break
+
+            method, path, body = item
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            start = time.perf_counter()
+            connection.request(method, path, json.dumps(body) if body is not None else None,
+                               headers)
+            response = connection.getresponse()
+            payload = response.read()
+            status = str(response.status)
+            if path == "/scrape" and response.status == 202:
+                status += ":" + wait_for_job(connection, json.loads(payload)["status_url"])
+            elapsed = (time.perf_counter() - start) * 1000
+
+            with lock:
+                timings.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+        connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(min(concurrency, len(plan)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    timings.sort()
+    return {
+        "requests": len(timings),
+        "throughput_rps": round(len(timings) / wall, 1),
+        "p50_ms": round(percentile(timings, 50), 2),
+        "p95_ms": round(percentile(timings, 95), 2),
+        "p99_ms": round(percentile(timings, 99), 2),
+        "max_ms": round(timings[-1], 2),
+        "statuses": dict(sorted(statuses.items()))
+    }
+
+
+def git_commit() -> str:
+    """The commit being benchmarked, if this is a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous: dict, current: dict) -> None:
+    """Prints how each scenario's p95 latency and throughput moved since an earlier run"""
+    for name, summary in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        p95_change = (summary["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        rps_change = (summary["throughput_rps"] - before["throughput_rps"]) \
+            / before["throughput_rps"] * 100
+        print(f"{name:<28}p95 {p95_change:+7.1f}%   throughput {rps_change:+7.1f}%")
+
+
+def main():
+    """Seeds the schema, runs each scenario in turn and writes the results"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stories", type=int, default=100_000)
+    parser.add_argument("--votes", type=int, default=1_000_000)
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="requests per scenario; full-table reads and scrapes send fewer")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", nargs="*", help="only run scenarios with these names")
+    parser.add_argument("--output", default="bench_api.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--response-cache", action="store_true",
+                        help="leave the GET /stories response cache on")
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark schema")
+    args = parser.parse_args()
+
+    load_dotenv()
+    random.seed(0)
+    os.environ["PGOPTIONS"] = f"-c search_path={SCHEMA},public"
+    os.environ.setdefault("DATABASE_POOL_MAX_SIZE", str(args.concurrency + 4))
+    os.environ.setdefault("PAGE_CACHE_DIR", tempfile.mkdtemp(prefix="bench_page_cache_"))
+    if not args.response_cache:
+        os.environ["RESPONSE_CACHE_MAX_ENTRIES"] = "0"
+
+    # Imported after the environment is set, so the pool and caches pick it up
+    from werkzeug.serving import make_server  # pylint: disable=import-outside-toplevel
+    from api import app  # pylint: disable=import-outside-toplevel
+    from stories_functions import get_db_connection  # pylint: disable=import-outside-toplevel
+    from scrape_jobs import get_scrape_workers  # pylint: disable=import-outside-toplevel
+    from vote_buffer import get_vote_buffer, write_behind_enabled  # pylint: disable=import-outside-toplevel
+
+    connection = get_db_connection()
+    print(f"Seeding {args.stories} stories and {args.votes} votes...")
+    seed(connection, args.stories, args.votes)
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    api_host = serve(make_server("127.0.0.1", 0, app, threaded=True))
+    fixture_host = serve(ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(QuietFixtureHandler, directory=str(FIXTURES))))
+
+    scenarios = make_scenarios(args.stories, args.requests, fixture_host)
+    if args.scenarios:
+        scenarios = {name: plan for name, plan in scenarios.items() if name in args.scenarios}
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "stories": args.stories,
+            "votes": args.votes,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "response_cache": args.response_cache
+        },
+        "scenarios": {}
+    }
+    try:
+        for name, plan in scenarios.items():
+            summary = run_scenario(api_host, plan, args.concurrency)
+            results["scenarios"][name] = summary
+            print(f"{name:<28}rps={summary['throughput_rps']:<9}p50={summary['p50_ms']:<9}"
+                  f"p95={summary['p95_ms']:<9}p99={summary['p99_ms']:<9}{summary['statuses']}")
+    finally:
+        # Stop background writers first, so nothing falls through to public tables
+        get_scrape_workers().stop()
+        if write_behind_enabled():
+            get_vote_buffer().stop()
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n", encoding="utf_8")
+        print(f"Results written to {args.output}")
+        if not args.keep:
+            drop_schema(connection)
+        connection.close()
+
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text(encoding="utf_8")), results)
+
+
+if __name__ == "__main__":
+    main()
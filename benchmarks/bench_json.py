@@ -0,0 +1,95 @@
+"""Measures how fast story listings are turned into GET /stories JSON, old path against new.
+
+The old path builds a RealDictRow per fetched tuple, copies it into a dict and
+encodes the list with Flask's provider. The new one wraps each tuple in a
+StoryRecord and encodes the list a column at a time with StoryJSONProvider.
+Rows are synthetic, so no database is needed. Run from the repository root:
+
+    python -m benchmarks.bench_json --stories 100000
+
+Peak memory is measured with tracemalloc, so it counts the Python objects
+each path allocates on the way to the response body.
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from psycopg2.extras import RealDictRow
+
+from story_json import StoryJSONProvider
+from story_records import record_class
+
+COLUMNS = ("id", "title", "url", "created_at", "updated_at", "score", "upvotes", "downvotes")
+WORDS = ["election", "minister", "budget", "football", "storm", "climate", "police",
+         "hospital", "strike", "market", "energy", "housing", "school", "café"]
+
+
+def synthetic_rows(count: int) -> list[tuple]:
+    """Tuples shaped like story listing rows"""
+    random.seed(count)
+    start = datetime(2023, 1, 1)
+    rows = []
+    for story_id in range(1, count + 1):
+        created = start + timedelta(seconds=random.randrange(3 * 10 ** 7))
+        upvotes, downvotes = random.randrange(500), random.randrange(100)
+        url = f"https://www.bbc.co.uk/news/{story_id}"
+        rows.append((story_id, " ".join(random.sample(WORDS, 6)).capitalize(), url,
+                     created, created + timedelta(minutes=random.randrange(600)),
+                     upvotes - downvotes, upvotes, downvotes))
+    return rows
+
+
+def old_path(app: Flask, rows: list[tuple]) -> str:
+    """RealDictCursor rows copied into dicts, encoded by Flask's provider"""
+    stories = [dict(row) for row in (RealDictRow(zip(COLUMNS, row)) for row in rows)]
+    return DefaultJSONProvider(app).dumps(stories, separators=(",", ":"))
+
+
+def new_path(app: Flask, rows: list[tuple]) -> str:
+    """RecordCursor rows encoded a column at a time"""
+    record = record_class(COLUMNS)
+    return StoryJSONProvider(app).dumps(list(map(record, rows)), separators=(",", ":"))
+
+
+def measure(path, app: Flask, rows: list[tuple], rounds: int) -> dict:
+    """Times a path over every row for a number of rounds, then measures peak memory"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        body = path(app, rows)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    path(app, rows)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "rows_per_sec": round(rounds * len(rows) / elapsed),
+        "peak_mib": round(peak / 2 ** 20, 1),
+        "body": body
+    }
+
+
+def main():
+    """Prints throughput and peak memory for each path"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stories", type=int, default=100000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    rows = synthetic_rows(args.stories)
+    results = {name: measure(path, app, rows, args.rounds)
+               for name, path in (("old", old_path), ("new", new_path))}
+
+    print(f"{args.stories} stories, {len(results['old']['body']) / 2 ** 20:.1f} MiB of JSON, "
+          f"{args.rounds} rounds, identical output: {results['old']['body'] == results['new']['body']}")
+    for name, summary in results.items():
+        print(f"{name:<5}rows/sec={summary['rows_per_sec']:<10}peak_mib={summary['peak_mib']}")
+
+
+if __name__ == "__main__":
+    main()
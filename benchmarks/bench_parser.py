@@ -0,0 +1,72 @@
+"""Measures parse_stories_bs throughput and peak memory for each parser backend.
+
+Parses the saved BBC homepage and topic pages in fixtures/ repeatedly.
+Run from the repository root:
+
+    python -m benchmarks.bench_parser --rounds 20
+
+Peak memory is measured with tracemalloc, so it counts Python allocations
+(BeautifulSoup trees) but not memory held inside lxml or selectolax.
+"""
+import argparse
+import time
+import tracemalloc
+from pathlib import Path
+from bs4 import BeautifulSoup
+from news_scaper import parse_stories_bs, available_backends
+
+FIXTURES = Path(__file__).parent.parent / "fixtures"
+DOMAIN = "https://www.bbc.co.uk"
+
+
+def legacy_parse(html):
+    """The original parser: a full html.parser tree searched with soup.select"""
+    soup = BeautifulSoup(html, "html.parser")
+    anchors = soup.select(
+        "a.ssrcss-its5xf-PromoLink, a.ssrcss-1mrs5ns-PromoLink, a.gs-c-promo-heading")
+    return [{"url": DOMAIN + anchor.get('href'), "title": anchor.get_text()}
+            for anchor in anchors if anchor.get_text() and anchor.get('href')]
+
+
+def measure(parse, pages: list[str], rounds: int) -> dict:
+    """Times parse over every page for a number of rounds, then measures peak memory"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for html in pages:
+            parse(html)
+    elapsed = time.perf_counter() - start
+
+    peak = 0
+    for html in pages:
+        tracemalloc.start()
+        parse(html)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        "pages_per_sec": round(rounds * len(pages) / elapsed, 1),
+        "peak_kib": round(peak / 1024, 1)
+    }
+
+
+def main():
+    """Prints throughput and peak memory per backend"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    pages = [path.read_text(encoding="utf_8") for path in sorted(FIXTURES.glob("*.html"))]
+    size_kib = sum(len(html.encode("utf_8")) for html in pages) / 1024
+    print(f"{len(pages)} fixture pages, {size_kib:.0f} KiB in total, {args.rounds} rounds")
+
+    candidates = {"legacy full tree": legacy_parse}
+    for backend in available_backends():
+        candidates[backend] = lambda html, backend=backend: parse_stories_bs(DOMAIN, html, backend)
+
+    for name, parse in candidates.items():
+        summary = measure(parse, pages, args.rounds)
+        print(f"{name:<18}pages/sec={summary['pages_per_sec']:<10}peak_kib={summary['peak_kib']}")
+
+
+if __name__ == "__main__":
+    main()
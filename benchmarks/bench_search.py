@@ -0,0 +1,159 @@
+"""Compares title search latency of the indexed search against the old LIKE scan.
+
+Seeds a synthetic stories table in its own schema so real data is untouched.
+Run from the repository root against a database with pg_trgm available:
+
+    python -m benchmarks.bench_search --rows 1000000 --queries 200
+"""
+import argparse
+import random
+import statistics
+import time
+from dotenv import load_dotenv
+from stories_functions import get_db_connection, find_specific_story
+
+SCHEMA = "search_bench"
+# every path returns at most this many rows, so only the search itself is compared
+LIMIT = 100
+
+WORDS = [
+    "election", "minister", "budget", "football", "storm", "climate", "police",
+    "hospital", "strike", "market", "energy", "housing", "school", "court",
+    "ukraine", "israel", "gaza", "london", "scotland", "wales", "council",
+    "festival", "music", "film", "award", "chairman", "premier", "league",
+    "rail", "airport", "flood", "inflation", "interest", "rates", "bank",
+    "teachers", "nurses", "doctors", "pay", "deal", "talks", "summit",
+    "president", "prime", "sunak", "starmer", "parliament", "vote", "tax",
+    "museum", "gallery", "artist", "author", "novel", "theatre", "royal",
+    "king", "queen", "prince", "wedding", "science", "space", "rocket",
+    "whale", "forest", "farmers", "prices", "shops", "retail", "jobs",
+    "unemployment", "migrants", "border", "security", "cyber", "attack",
+    "hackers", "phone", "data", "privacy", "internet", "broadband", "chicago"
+]
+
+LEGACY_QUERY = """SELECT stories.*, SUM(CASE votes.direction WHEN 'up'
+        THEN 1 WHEN 'down' THEN -1 ELSE 0 END) AS score
+        FROM stories LEFT JOIN votes ON stories.id = votes.story_id
+        WHERE LOWER(title) LIKE %s
+        GROUP BY stories.id
+        LIMIT %s;"""
+
+
+def seed(connection, rows: int) -> None:
+    """Creates the benchmark schema and fills it with synthetic stories"""
+    cursor = connection.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+    cursor.execute(f"CREATE SCHEMA {SCHEMA};")
+    cursor.execute(f"SET search_path TO {SCHEMA}, public;")
+    cursor.execute("""CREATE TABLE stories (
+            id INT PRIMARY KEY,
+            title TEXT NOT NULL,
+            url TEXT NOT NULL,
+            created_at timestamp NOT NULL,
+            updated_at timestamp NOT NULL,
+            score INT NOT NULL DEFAULT 0,
+            upvotes INT NOT NULL DEFAULT 0,
+            downvotes INT NOT NULL DEFAULT 0);""")
+    cursor.execute("""CREATE TABLE votes (
+            id SERIAL PRIMARY KEY,
+            direction TEXT NOT NULL,
+            created_at timestamp NOT NULL,
+            updated_at timestamp NOT NULL,
+            story_id INT);""")
+    cursor.execute("""INSERT INTO stories (id, title, url, created_at, updated_at)
+            SELECT i,
+                INITCAP(array_to_string(ARRAY(
+                    SELECT (%s::text[])[1 + floor(random() * %s)::int]
+                    FROM generate_series(1, 5 + i %% 6)), ' ')),
+                'https://www.bbc.co.uk/news/' || i,
+                now() - i * interval '1 minute',
+                now() - i * interval '1 minute'
+            FROM generate_series(1, %s) AS i;""", (WORDS, len(WORDS), rows))
+    cursor.execute("""CREATE INDEX stories_title_search_idx
+            ON stories USING GIN (to_tsvector('english', title));""")
+    cursor.execute("""CREATE INDEX stories_title_trigram_idx
+            ON stories USING GIN (LOWER(title) gin_trgm_ops);""")
+    cursor.execute("CREATE INDEX votes_story_id_idx ON votes (story_id);")
+    cursor.execute("ANALYZE stories;")
+    connection.commit()
+    cursor.close()
+
+
+def make_searches(count: int) -> list[str]:
+    """Mixes whole words, two-word phrases, partial words and typos"""
+    searches = []
+    for i in range(count):
+        word = random.choice(WORDS)
+        kind = i % 4
+        if kind == 0:
+            searches.append(word)
+        elif kind == 1:
+            searches.append(f"{word} {random.choice(WORDS)}")
+        elif kind == 2:
+            searches.append(word[:max(3, len(word) - 3)])
+        else:
+            position = random.randrange(len(word))
+            searches.append(word[:position] + word[position + 1:])
+    return searches
+
+
+def time_searches(searches: list[str], search) -> dict:
+    """Runs each search once and summarises the latencies in milliseconds"""
+    timings = []
+    for term in searches:
+        start = time.perf_counter()
+        search(term)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+    return {
+        "mean_ms": round(statistics.mean(timings), 2),
+        "p50_ms": round(timings[len(timings) // 2], 2),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 2),
+        "max_ms": round(timings[-1], 2)
+    }
+
+
+def main():
+    """Seeds the table and prints a latency comparison per search path"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark schema")
+    args = parser.parse_args()
+
+    load_dotenv()
+    connection = get_db_connection()
+    random.seed(0)
+
+    print(f"Seeding {args.rows} stories...")
+    seed(connection, args.rows)
+    searches = make_searches(args.queries)
+
+    def legacy(term):
+        cursor = connection.cursor()
+        cursor.execute(LEGACY_QUERY, (f"%{term.lower()}%", LIMIT))
+        cursor.fetchall()
+        cursor.close()
+
+    results = {
+        "legacy LIKE scan": time_searches(searches, legacy),
+        "indexed search": time_searches(
+            searches, lambda term: find_specific_story(connection, term, limit=LIMIT)),
+        "indexed prefix search": time_searches(
+            searches, lambda term: find_specific_story(connection, term, True, LIMIT))
+    }
+
+    for name, summary in results.items():
+        print(f"{name:<24}" + "  ".join(f"{key}={value}" for key, value in summary.items()))
+
+    if not args.keep:
+        cursor = connection.cursor()
+        cursor.execute(f"DROP SCHEMA {SCHEMA} CASCADE;")
+        connection.commit()
+        cursor.close()
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
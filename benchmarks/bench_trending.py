@@ -0,0 +1,115 @@
+"""Measures the cost of the trending decay pass and of serving the trending top N.
+
+Seeds stories with random scores and ages in their own schema (built from
+social_news.sql) so real data is untouched, then times refresh passes and
+top-N reads against ranking every story on the fly. Run from the repository root:
+
+    python -m benchmarks.bench_trending --stories 1000000 --top 30
+"""
+import argparse
+import statistics
+import time
+from dotenv import load_dotenv
+from benchmarks.bench_api import schema_statements
+from stories_functions import (
+get_db_connection,
+refresh_trending,
+sort_stories,
+trending_settings)
+
+SCHEMA = "trending_bench"
+
+ON_THE_FLY_QUERY = """SELECT * FROM stories
+        ORDER BY trending_rank(score, created_at, %(gravity)s, %(age_offset)s) DESC, id DESC
+        LIMIT %(limit)s;"""
+
+
+def seed(connection, stories: int, days: float) -> None:
+    """Creates the benchmark schema and fills it with stories spread over the last few days"""
+    cursor = connection.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+    cursor.execute(f"CREATE SCHEMA {SCHEMA};")
+    cursor.execute(f"SET search_path TO {SCHEMA}, public;")
+    for statement in schema_statements():
+        cursor.execute(statement)
+
+    cursor.execute("""INSERT INTO stories (title, url, canonical_url, created_at, updated_at, score)
+            SELECT 'Story ' || i, 'https://www.bbc.co.uk/news/' || i,
+                'https://bbc.co.uk/news/' || i,
+                LOCALTIMESTAMP - random() * %s * interval '1 day', LOCALTIMESTAMP,
+                floor(random() * random() * 500)::int
+            FROM generate_series(1, %s) AS i;""", (days, stories))
+    cursor.execute("ANALYZE stories;")
+    connection.commit()
+    cursor.close()
+
+
+def summarise(timings: list[float]) -> dict:
+    """Mean, median and worst of a list of millisecond timings"""
+    timings = sorted(timings)
+    return {
+        "mean_ms": round(statistics.mean(timings), 2),
+        "p50_ms": round(timings[len(timings) // 2], 2),
+        "max_ms": round(timings[-1], 2)
+    }
+
+
+def time_runs(runs: int, function) -> dict:
+    """Calls function runs times and summarises how long each call took"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return summarise(timings)
+
+
+def main():
+    """Seeds the table and prints refresh and read costs"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stories", type=int, default=1_000_000)
+    parser.add_argument("--days", type=float, default=30)
+    parser.add_argument("--horizon-hours", type=float, default=72)
+    parser.add_argument("--top", type=int, default=30)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark schema")
+    args = parser.parse_args()
+
+    load_dotenv()
+    connection = get_db_connection()
+    settings = trending_settings()
+
+    print(f"Seeding {args.stories} stories over {args.days} days...")
+    seed(connection, args.stories, args.days)
+
+    refreshed = refresh_trending(connection, args.horizon_hours, **settings)
+    print(f"Each decay pass refreshes {refreshed} stories")
+
+    def on_the_fly():
+        cursor = connection.cursor()
+        cursor.execute(ON_THE_FLY_QUERY, {**settings, "limit": args.top})
+        cursor.fetchall()
+        cursor.close()
+
+    results = {
+        "decay pass": time_runs(
+            max(1, args.runs // 4),
+            lambda: refresh_trending(connection, args.horizon_hours, **settings)),
+        f"ranked on the fly, top {args.top}": time_runs(args.runs, on_the_fly),
+        f"indexed rank, top {args.top}": time_runs(
+            args.runs, lambda: sort_stories(connection, "trending", None, args.top))
+    }
+
+    for name, summary in results.items():
+        print(f"{name:<28}" + "  ".join(f"{key}={value}" for key, value in summary.items()))
+
+    if not args.keep:
+        cursor = connection.cursor()
+        cursor.execute(f"DROP SCHEMA {SCHEMA} CASCADE;")
+        connection.commit()
+        cursor.close()
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Measures the votes table's size and score query latency before and after compaction.
+
+Seeds stories and votes spread over many months in their own schema (built
+from social_news.sql) so real data is untouched, then measures the size of
+votes and vote_rollups and times recalculating every score, before and after
+rolling up all but the latest months. Run from the repository root:
+
+    python -m benchmarks.bench_votes --stories 100000 --votes 10000000 --months 24
+"""
+import argparse
+from dotenv import load_dotenv
+from benchmarks.bench_api import schema_statements
+from benchmarks.bench_trending import time_runs
+from stories_functions import (
+get_db_connection,
+ensure_vote_partitions,
+compact_votes,
+reconcile_story_scores)
+
+SCHEMA = "votes_bench"
+
+SIZE_QUERY = """SELECT
+        (SELECT SUM(pg_total_relation_size(relid)) FROM pg_partition_tree('votes')),
+        pg_total_relation_size('vote_rollups');"""
+
+STORY_TALLY_QUERY = """SELECT SUM(upvotes), SUM(downvotes) FROM (
+        SELECT upvotes, downvotes FROM vote_rollups WHERE story_id = %(story_id)s
+        UNION ALL
+        SELECT (direction = 'up')::int, (direction = 'down')::int FROM votes
+        WHERE story_id = %(story_id)s) AS counted;"""
+
+
+def seed(connection, stories: int, votes: int, months: int) -> None:
+    """Creates the benchmark schema, one partition per month, and fills it
+    with stories and votes spread evenly over those months"""
+    cursor = connection.cursor()
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+    cursor.execute(f"CREATE SCHEMA {SCHEMA};")
+    cursor.execute(f"SET search_path TO {SCHEMA}, public;")
+    for statement in schema_statements():
+        cursor.execute(statement)
+    connection.commit()
+
+    ensure_vote_partitions(connection, months_back=months)
+
+    cursor.execute("""INSERT INTO stories (title, url, canonical_url, created_at, updated_at)
+            SELECT 'Story ' || i, 'https://www.bbc.co.uk/news/' || i,
+                'https://bbc.co.uk/news/' || i, LOCALTIMESTAMP, LOCALTIMESTAMP
+            FROM generate_series(1, %s) AS i;""", (stories, ))
+    cursor.execute("""INSERT INTO votes (direction, created_at, updated_at, story_id)
+            SELECT CASE WHEN random() < 0.7 THEN 'up' ELSE 'down' END, voted_at, voted_at,
+                1 + floor(random() * %s)::int
+            FROM (SELECT LOCALTIMESTAMP - random() * %s * interval '1 month' AS voted_at
+                  FROM generate_series(1, %s)) AS seeded;""", (stories, months, votes))
+    connection.commit()
+
+    connection.autocommit = True
+    cursor.execute("VACUUM ANALYZE votes;")
+    cursor.execute("VACUUM ANALYZE stories;")
+    connection.autocommit = False
+    cursor.close()
+
+
+def measure(connection, runs: int, stories: int) -> dict:
+    """Table sizes and score query timings as the data stands"""
+    cursor = connection.cursor()
+    cursor.execute(SIZE_QUERY)
+    votes_bytes, rollup_bytes = cursor.fetchone()
+    connection.commit()
+
+    def story_tally():
+        cursor.execute(STORY_TALLY_QUERY, {"story_id": 1 + stories // 2})
+        cursor.fetchone()
+
+    measured = {
+        "votes_mb": round(votes_bytes / 2 ** 20, 1),
+        "vote_rollups_mb": round(rollup_bytes / 2 ** 20, 1),
+        "recalculate every score": time_runs(runs, lambda: reconcile_story_scores(connection)),
+        "tally one story": time_runs(runs * 10, story_tally)
+    }
+    cursor.close()
+    return measured
+
+
+def report(label: str, measured: dict) -> None:
+    """Prints one measurement"""
+    print(f"{label}: votes {measured['votes_mb']}MB, vote_rollups {measured['vote_rollups_mb']}MB")
+    for name in ("recalculate every score", "tally one story"):
+        print(f"  {name:<26}" + "  ".join(
+            f"{key}={value}" for key, value in measured[name].items()))
+
+
+def main():
+    """Seeds votes, then compares size and score latency before and after compaction"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stories", type=int, default=100_000)
+    parser.add_argument("--votes", type=int, default=10_000_000)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--keep-months", type=int, default=3)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark schema")
+    args = parser.parse_args()
+
+    load_dotenv()
+    connection = get_db_connection()
+
+    print(f"Seeding {args.stories} stories and {args.votes} votes over {args.months} months...")
+    seed(connection, args.stories, args.votes, args.months)
+    report("before", measure(connection, args.runs, args.stories))
+
+    compacted = compact_votes(connection, args.keep_months)
+    connection.autocommit = True
+    connection.cursor().execute("VACUUM ANALYZE vote_rollups;")
+    connection.autocommit = False
+    print(f"Rolled up {compacted['votes_rolled_up']} votes, "
+          f"dropping {compacted['partitions_dropped']} partitions")
+    report("after", measure(connection, args.runs, args.stories))
+
+    if not args.keep:
+        cursor = connection.cursor()
+        cursor.execute(f"DROP SCHEMA {SCHEMA} CASCADE;")
+        connection.commit()
+        cursor.close()
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+"""Builds the static assets: copies each one to static/dist with a hash of its
+content in the name, with gzip and brotli copies, and writes the manifest
+the app links them by. Run it whenever the files in static/ change"""
+from assets import build, brotli, DIST
+
+
+if __name__ == "__main__":
+    manifest = build()
+    for name, fingerprinted in manifest.items():
+        sizes = [f"{suffix.lstrip('.') or 'plain'} {(DIST / (fingerprinted + suffix)).stat().st_size}B"
+                 for suffix in ("", ".gz", ".br") if (DIST / (fingerprinted + suffix)).exists()]
+        print(f"{name} -> {fingerprinted} ({', '.join(sizes)})")
+    if brotli is None:
+        print("brotli is not installed, so only gzip copies were written")
@@ -0,0 +1,24 @@
+"""Maintains the partitioned votes table: creates upcoming monthly partitions,
+then rolls votes older than VOTE_RAW_MONTHS whole months into vote_rollups.
+Run it daily, e.g. from cron"""
+from os import environ
+from dotenv import load_dotenv
+from stories_functions import (
+get_db_connection,
+ensure_vote_partitions,
+compact_votes,
+VOTE_RAW_MONTHS,
+VOTE_PARTITIONS_AHEAD)
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    connection = get_db_connection()
+    created = ensure_vote_partitions(
+        connection, months_ahead=int(environ.get("VOTE_PARTITIONS_AHEAD", VOTE_PARTITIONS_AHEAD)))
+    compacted = compact_votes(connection, int(environ.get("VOTE_RAW_MONTHS", VOTE_RAW_MONTHS)))
+    connection.close()
+    print(f"Created partitions {', '.join(created) or 'none'}. "
+          f"Rolled up {compacted['votes_rolled_up']} votes, "
+          f"discarded {compacted['votes_discarded']} votes with no story, "
+          f"dropping {compacted['partitions_dropped']} partitions")
@@ -3,8 +3,15 @@ import pytest
 from flask.testing import FlaskClient
 
 from api import app
+from response_cache import get_stories_cache
 
 @pytest.fixture()
 def api_client() -> FlaskClient:
     """Returns a version of the API for testing."""
     return app.test_client()
+
+
+@pytest.fixture(autouse=True)
+def empty_stories_cache():
+    """Stops cached GET /stories responses leaking between tests."""
+    get_stories_cache().clear()
@@ -0,0 +1,212 @@
+"""Bulk crawler that scrapes a file of seed urls straight into the stories table.
+
+    python3 crawl.py seeds.txt --workers 8 --checkpoint crawl.checkpoint
+
+Pages are fetched and parsed in worker processes, without going through the
+API's /scrape endpoint. Each parsed page is appended to the checkpoint file
+before it is loaded, and a marker is appended once a batch is committed, so
+an interrupted crawl started again with the same checkpoint fetches no page
+twice: pages already in the checkpoint are skipped, and any parsed but not
+yet loaded are loaded first. Batches are copied into a staging table with
+COPY FROM STDIN and merged into stories with the same deduplication as
+scrape jobs.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+from multiprocessing import Pool
+from dotenv import load_dotenv
+from psycopg2 import extensions
+
+from fetcher import Fetcher, FetchError
+from ingest import unique_stories, merge_statement
+from metrics import timed_query
+from news_scaper import parse_stories_bs
+from response_cache import invalidate_stories
+from stories_functions import get_db_connection
+
+BATCH_SIZE = 5000
+
+_fetcher = None
+
+
+def read_seeds(path: str) -> list[str]:
+    """Urls from a seed file, one per line, ignoring blank lines, comments and repeats"""
+    with open(path, encoding="utf_8") as seeds:
+        urls = (line.strip() for line in seeds)
+        return list(dict.fromkeys(url for url in urls if url and not url.startswith("#")))
+
+
+class Checkpoint:
+    """Append-only record of the pages a crawl has parsed and loaded"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> tuple[set[str], list[dict]]:
+        """Returns the urls already parsed, and the stories of the pages parsed
+        since the last committed batch, which still need to be loaded"""
+        done = set()
+        pending = []
+        if not os.path.exists(self.path):
+            return done, pending
+
+        with open(self.path, "rb+") as checkpoint:
+            contents = checkpoint.read()
+            # drops a record cut short by the interruption, so new ones start on their own line
+            complete = contents.rfind(b"\n") + 1
+            checkpoint.truncate(complete)
+
+        for line in contents[:complete].decode("utf_8").splitlines():
+            record = json.loads(line)
+            if "loaded" in record:
+                pending = []
+            else:
+                done.add(record["url"])
+                pending.extend(record["stories"])
+
+        return done, pending
+
+    def record_page(self, url: str, stories: list[dict]) -> None:
+        """Notes a page as parsed, with its stories"""
+        self._append({"url": url, "stories": stories})
+
+    def record_loaded(self) -> None:
+        """Notes that every page recorded so far is in the database"""
+        self._append({"loaded": True}, sync=True)
+
+    def _append(self, record: dict, sync: bool = False) -> None:
+        with open(self.path, "a", encoding="utf_8") as checkpoint:
+            checkpoint.write(json.dumps(record) + "\n")
+            if sync:
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+
+
+def init_worker(timeout: float, retries: int) -> None:
+    """Gives each worker process its own fetcher and keep-alive connections"""
+    global _fetcher
+    _fetcher = Fetcher(workers=1, timeout=timeout, deadline=timeout * (retries + 1) * 2,
+                       retries=retries)
+
+
+def crawl_page(url: str) -> tuple:
+    """Fetches and parses one page in a worker, returning (url, stories, error)"""
+    try:
+        html = _fetcher.fetch(url)
+    except FetchError as err:
+        return url, None, str(err)
+
+    return url, parse_stories_bs(url, html), None
+
+
+def crawl_pages(urls: list[str], workers: int, timeout: float, retries: int):
+    """Yields (url, stories, error) for each url as worker processes finish them"""
+    with Pool(workers, initializer=init_worker, initargs=(timeout, retries)) as pool:
+        yield from pool.imap_unordered(crawl_page, urls)
+
+
+@timed_query
+def load_stories(connection: extensions.connection, stories: list[dict]) -> dict:
+    """Copies a batch of stories into a staging table and merges them into
+    stories in one transaction, returning counts like ingest_stories"""
+    counts = {"inserted": 0, "updated": 0, "merged": 0, "skipped": 0}
+
+    rows, counts["merged"] = unique_stories(stories)
+
+    if rows:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for title, url, canonical_url, fingerprint, bands in rows:
+            writer.writerow((title, url, canonical_url, fingerprint,
+                             "{" + ",".join(map(str, bands)) + "}"))
+        buffer.seek(0)
+
+        cursor = connection.cursor()
+        cursor.execute("""CREATE TEMP TABLE IF NOT EXISTS crawl_staging (
+                title TEXT, url TEXT, canonical_url TEXT, fingerprint BIGINT, bands INT[]
+                ) ON COMMIT DELETE ROWS;""")
+        cursor.copy_expert("COPY crawl_staging FROM STDIN WITH (FORMAT csv);", buffer)
+        cursor.execute(merge_statement("SELECT * FROM crawl_staging"))
+        inserted, updated, merged = cursor.fetchone()
+
+        connection.commit()
+        cursor.close()
+        invalidate_stories()
+
+        counts["inserted"] = inserted
+        counts["updated"] = updated
+        counts["merged"] += merged
+
+    counts["skipped"] = len(stories) - counts["inserted"] - counts["updated"] - counts["merged"]
+    return counts
+
+
+def crawl(connection: extensions.connection, urls: list[str], checkpoint: Checkpoint,
+          batch_size: int = BATCH_SIZE, workers: int = 4, timeout: float = 10,
+          retries: int = 2) -> dict:
+    """Crawls every url not already in the checkpoint, loading stories in
+    batches of about batch_size, and returns page and story counts"""
+    totals = {"pages": 0, "failed": 0, "inserted": 0, "updated": 0, "merged": 0, "skipped": 0}
+    done, batch = checkpoint.load()
+
+    def load_batch():
+        counts = load_stories(connection, batch)
+        checkpoint.record_loaded()
+        for key, count in counts.items():
+            totals[key] += count
+        batch.clear()
+
+    if batch:
+        load_batch()
+
+    todo = [url for url in urls if url not in done]
+    for url, stories, error in crawl_pages(todo, workers, timeout, retries):
+        if error is not None:
+            totals["failed"] += 1
+            print("Failed to crawl", url, error)
+            continue
+
+        checkpoint.record_page(url, stories)
+        batch.extend(stories)
+        totals["pages"] += 1
+
+        if len(batch) >= batch_size:
+            load_batch()
+
+    if batch:
+        load_batch()
+
+    return totals
+
+
+def main():
+    """Crawls the seed urls given on the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("seeds", help="file with one url to crawl per line")
+    parser.add_argument("--checkpoint", default="crawl.checkpoint",
+                        help="progress file, reused to resume an interrupted crawl")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="stories loaded per COPY")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--retries", type=int, default=2)
+    args = parser.parse_args()
+
+    load_dotenv()
+    connection = get_db_connection()
+    try:
+        totals = crawl(connection, read_seeds(args.seeds), Checkpoint(args.checkpoint),
+                       args.batch_size, args.workers, args.timeout, args.retries)
+    finally:
+        connection.close()
+
+    print(f"Crawled {totals['pages']} pages ({totals['failed']} failed): "
+          f"{totals['inserted']} stories added, {totals['updated']} updated, "
+          f"{totals['merged']} merged, {totals['skipped']} skipped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""Pool of reusable database connections, checked out once per Flask request.
+
+Writes use the primary's pool. Story reads can use a pool per read replica
+instead, chosen by get_read_connection as described in replicas.py.
+"""
+import threading
+import time
+from os import environ
+import psycopg2
+from psycopg2 import extensions
+from flask import g, request
+
+from stories_functions import (
+get_db_connection as connect_to_database,
+get_replica_connection,
+replica_lag)
+from replicas import replica_dsns, reads_pinned_to_primary, make_replica_health, ReplicaHealth
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes free before the checkout timeout"""
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections with health checks and idle recycling"""
+
+    def __init__(self, connect, min_size: int = 1, max_size: int = 10,
+                 timeout: float = 5.0, max_idle: float = 300.0):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1")
+
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._condition = threading.Condition()
+        self._counters = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "opened": 0,
+            "closed": 0,
+            "health_check_failures": 0,
+            "recycled": 0
+        }
+
+    def fill(self) -> None:
+        """Opens connections until the pool holds at least min_size of them"""
+        while True:
+            with self._condition:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+
+            try:
+                connection = self._open()
+            except psycopg2.Error:
+                with self._condition:
+                    self._size -= 1
+                    self._condition.notify()
+                raise
+
+            with self._condition:
+                self._idle.append((connection, time.monotonic()))
+                self._condition.notify()
+
+    def checkout(self) -> extensions.connection:
+        """Takes a healthy connection from the pool, opening one if there is room"""
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            connection = self._reserve(deadline)
+
+            if connection is None:
+                try:
+                    connection = self._open()
+                except psycopg2.Error:
+                    self._release_slot()
+                    raise
+                return connection
+
+            if self._is_healthy(connection):
+                return connection
+
+            with self._condition:
+                self._counters["health_check_failures"] += 1
+            self._discard(connection)
+
+    def checkin(self, connection: extensions.connection) -> None:
+        """Returns a connection to the pool, rolling back any unfinished transaction"""
+        if connection.closed:
+            self._discard(connection)
+            return
+
+        try:
+            if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except psycopg2.Error:
+            self._discard(connection)
+            return
+
+        with self._condition:
+            self._in_use -= 1
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    def close(self) -> None:
+        """Closes every idle connection; checked out connections close on checkin"""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._counters["closed"] += len(idle)
+
+        for connection, _ in idle:
+            connection.close()
+
+    def stats(self) -> dict:
+        """Returns a snapshot of the pool for monitoring"""
+        with self._condition:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                **self._counters
+            }
+
+    def _reserve(self, deadline: float):
+        """Claims an idle connection, or a free slot (returned as None) for a new one"""
+        with self._condition:
+            while True:
+                self._recycle_idle()
+
+                if self._idle:
+                    connection, _ = self._idle.pop()
+                    self._in_use += 1
+                    self._counters["checkouts"] += 1
+                    return connection
+
+                if self._size < self.max_size:
+                    self._size += 1
+                    self._in_use += 1
+                    self._counters["checkouts"] += 1
+                    return None
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+                    raise PoolTimeoutError(
+                        f"No database connection free after {self.timeout} seconds")
+
+                self._waiting += 1
+                self._condition.wait(remaining)
+                self._waiting -= 1
+
+    def _recycle_idle(self) -> None:
+        """Closes connections idle for longer than max_idle, keeping min_size open"""
+        cutoff = time.monotonic() - self.max_idle
+
+        while self._idle and self._size > self.min_size and self._idle[0][1] < cutoff:
+            connection, _ = self._idle.pop(0)
+            self._size -= 1
+            self._counters["recycled"] += 1
+            self._counters["closed"] += 1
+            connection.close()
+
+    def _open(self) -> extensions.connection:
+        """Opens a brand-new connection using the pool's connect function"""
+        connection = self.connect()
+        if connection is None:
+            raise psycopg2.OperationalError("Could not open a database connection")
+
+        with self._condition:
+            self._counters["opened"] += 1
+        return connection
+
+    def _is_healthy(self, connection: extensions.connection) -> bool:
+        """Checks a connection is still usable with a single round trip"""
+        if connection.closed:
+            return False
+
+        try:
+            connection.autocommit = True
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.close()
+            connection.autocommit = False
+        except psycopg2.Error:
+            return False
+
+        return True
+
+    def _discard(self, connection: extensions.connection) -> None:
+        """Closes a checked out connection and frees its slot"""
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+        with self._condition:
+            self._counters["closed"] += 1
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        """Gives back the slot held by a checked out connection that no longer exists"""
+        with self._condition:
+            self._size -= 1
+            self._in_use -= 1
+            self._condition.notify()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_replica_pools = None
+_replica_health = None
+
+
+def make_pool(connect) -> ConnectionPool:
+    """A pool sized from environment settings"""
+    return ConnectionPool(
+        connect,
+        min_size=int(environ.get("DATABASE_POOL_MIN_SIZE", 1)),
+        max_size=int(environ.get("DATABASE_POOL_MAX_SIZE", 10)),
+        timeout=float(environ.get("DATABASE_POOL_TIMEOUT", 5)),
+        max_idle=float(environ.get("DATABASE_POOL_MAX_IDLE", 300))
+    )
+
+
+def get_pool() -> ConnectionPool:
+    """Returns the process-wide pool, creating it from environment settings on first use"""
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = make_pool(connect_to_database)
+            try:
+                _pool.fill()
+            except psycopg2.Error as err:
+                print("Error warming database pool.", err)
+        return _pool
+
+
+def get_replica_pools() -> list[ConnectionPool]:
+    """Returns a pool for each configured read replica, empty without replicas.
+    Replica pools open connections when first used"""
+    global _replica_pools, _replica_health
+
+    with _pool_lock:
+        if _replica_pools is None:
+            dsns = replica_dsns()
+            _replica_pools = [
+                make_pool(lambda dsn=dsn: get_replica_connection(dsn)) for dsn in dsns
+            ]
+            _replica_health = make_replica_health(len(dsns))
+        return _replica_pools
+
+
+def get_replica_health() -> ReplicaHealth:
+    """Returns the health tracking of this process's replica pools"""
+    get_replica_pools()
+    return _replica_health
+
+
+def checkout_replica(pools: list[ConnectionPool], health: ReplicaHealth) -> tuple:
+    """Checks out a connection from the next usable replica, measuring its lag
+    when due. Returns (pool, connection), or (None, None) if none is usable"""
+    for index in health.candidates():
+        pool = pools[index]
+        try:
+            connection = pool.checkout()
+        except (psycopg2.Error, PoolTimeoutError):
+            health.mark_down(index)
+            continue
+
+        try:
+            if health.lag_due(index):
+                health.record_lag(index, replica_lag(connection))
+        except psycopg2.Error:
+            pool.checkin(connection)
+            health.mark_down(index)
+            continue
+
+        if health.within_lag(index):
+            return pool, connection
+        pool.checkin(connection)
+
+    return None, None
+
+
+def get_db_connection() -> extensions.connection:
+    """Checks out a pooled connection for the current request, reusing it on later calls"""
+    if "db_connection" not in g:
+        g.db_connection = get_pool().checkout()
+    return g.db_connection
+
+
+def get_read_replica_connection() -> extensions.connection:
+    """Checks out a replica connection for the current request's story reads,
+    reusing it on later calls. Returns None when reads should use the primary:
+    there are no replicas, none is up to date, or the client has just written"""
+    if "db_read_connection" in g:
+        return g.db_read_connection
+
+    pools = get_replica_pools()
+    if not pools:
+        return None
+
+    health = get_replica_health()
+    pool, connection = (None, None)
+    if not reads_pinned_to_primary(request.cookies):
+        pool, connection = checkout_replica(pools, health)
+
+    health.record_read(connection is not None)
+    if connection is None:
+        return None
+
+    g.db_read_pool = pool
+    g.db_read_connection = connection
+    return connection
+
+
+def read_from_replica() -> bool:
+    """Whether the current request has read from a replica"""
+    return "db_read_connection" in g
+
+
+def release_db_connection(exception=None) -> None:
+    """Teardown hook returning the request's connections to their pools"""
+    connection = g.pop("db_connection", None)
+    if connection is not None:
+        get_pool().checkin(connection)
+
+    read_connection = g.pop("db_read_connection", None)
+    if read_connection is not None:
+        g.pop("db_read_pool").checkin(read_connection)
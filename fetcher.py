@@ -0,0 +1,250 @@
+"""Concurrent page fetcher for the news scraper.
+
+Fetches a batch of urls on a thread pool, reusing keep-alive connections,
+asking for compressed responses and limiting how many requests run against
+any one host at a time. Results are yielded as each page completes.
+"""
+import gzip
+import http.client
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from urllib.parse import urljoin, urlsplit
+
+from page_cache import PageCache
+from metrics import timed_phase
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DECODE_ERRORS = (OSError, EOFError, zlib.error, LookupError) + ((brotli.error, ) if brotli else ())
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_REDIRECTS = 5
+USER_AGENT = "News-Scraper/1.0"
+
+
+class FetchError(Exception):
+    """Raised when a page cannot be fetched"""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def accepted_encodings() -> str:
+    """Content encodings this fetcher can decode, for the Accept-Encoding header"""
+    return "gzip, deflate, br" if brotli else "gzip, deflate"
+
+
+def decode_body(body: bytes, headers) -> str:
+    """Decompresses a response body and decodes it using the declared charset"""
+    encoding = (headers.get("Content-Encoding") or "").lower()
+
+    if encoding == "gzip":
+        body = gzip.decompress(body)
+    elif encoding == "deflate":
+        body = zlib.decompress(body)
+    elif encoding == "br" and brotli:
+        body = brotli.decompress(body)
+
+    charset = "utf_8"
+    content_type = headers.get("Content-Type") or ""
+    if "charset=" in content_type:
+        charset = content_type.split("charset=")[-1].split(";")[0].strip()
+
+    return body.decode(charset, errors="replace")
+
+
+class HostConnections:
+    """Idle keep-alive connections for each host, shared between worker threads"""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def take(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        """Returns an idle connection to the host, or opens a new one"""
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def give_back(self, scheme: str, netloc: str, connection) -> None:
+        """Keeps a connection open for the next request to the same host"""
+        with self._lock:
+            self._idle.setdefault((scheme, netloc), []).append(connection)
+
+    def close(self) -> None:
+        """Closes every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+class Fetcher:
+    """Fetches many pages at once with per-host limits, timeouts and retries"""
+
+    def __init__(self, workers: int = 8, per_host: int = 4, timeout: float = 10,
+                 deadline: float = 60, retries: int = 2, backoff: float = 0.5,
+                 cache: PageCache = None):
+        self.workers = workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+
+        self.connections = HostConnections(timeout)
+        self._host_limits = {}
+        self._host_limits_lock = threading.Lock()
+
+    def fetch_all(self, urls: list[str], failures: dict = None):
+        """Yields (url, html) for each url as soon as it has been fetched.
+        With a cache, html is None when the page has not changed since it was
+        last fetched, and a changed page is only cached once the caller calls
+        cache.commit(url) after storing its stories. Urls that still fail after
+        retrying, or are unfinished when the deadline passes, are left out and
+        recorded in failures if given"""
+        failures = failures if failures is not None else {}
+        finish_by = time.monotonic() + self.deadline
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        futures = {executor.submit(self.fetch, url, finish_by): url for url in dict.fromkeys(urls)}
+        try:
+            for future in as_completed(futures, timeout=max(0, finish_by - time.monotonic())):
+                url = futures[future]
+                try:
+                    yield url, future.result()
+                except FetchError as err:
+                    failures[url] = err
+        except FuturesTimeout:
+            for future, url in futures.items():
+                if not future.done():
+                    failures[url] = FetchError("Deadline passed before the page was fetched")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def fetch(self, url: str, finish_by: float = None) -> str:
+        """Fetches one page, retrying connection errors and temporary server errors.
+        Returns None if the cache shows the page is unchanged"""
+        finish_by = finish_by or time.monotonic() + self.deadline
+        attempt = 0
+
+        with timed_phase("fetch"):
+            while True:
+                try:
+                    return self._fetch_following_redirects(url, finish_by)
+                except FetchError as err:
+                    if not err.retryable or attempt >= self.retries:
+                        raise
+                    delay = self.backoff * 2 ** attempt
+                    if time.monotonic() + delay >= finish_by:
+                        raise
+                    attempt += 1
+                    time.sleep(delay)
+
+    def close(self) -> None:
+        """Closes the connections kept open between batches"""
+        self.connections.close()
+
+    def _fetch_following_redirects(self, url: str, finish_by: float) -> str:
+        """Requests a page, following up to MAX_REDIRECTS redirects, and
+        checks it against the cache"""
+        requested_url = url
+        headers = self.cache.conditional_headers(url) if self.cache else {}
+
+        for _ in range(MAX_REDIRECTS + 1):
+            status, response_headers, body = self._request(url, finish_by, headers)
+
+            if status in (301, 302, 303, 307, 308) and response_headers.get("Location"):
+                url = urljoin(url, response_headers["Location"])
+                continue
+
+            if status == 304 and self.cache:
+                self.cache.not_modified(requested_url)
+                return None
+
+            if status in RETRY_STATUSES:
+                raise FetchError(f"{url} returned HTTP {status}", retryable=True)
+
+            if status >= 400:
+                raise FetchError(f"{url} returned HTTP {status}")
+
+            try:
+                html = decode_body(body, response_headers)
+            except DECODE_ERRORS as err:
+                raise FetchError(f"{url} sent a body that could not be decoded: {err!r}") from err
+
+            if self.cache and not self.cache.stage(
+                    requested_url, html,
+                    response_headers.get("ETag"), response_headers.get("Last-Modified")):
+                return None
+
+            return html
+
+        raise FetchError(f"{url} redirected more than {MAX_REDIRECTS} times")
+
+    def _request(self, url: str, finish_by: float, headers: dict = None) -> tuple:
+        """Sends one GET over a pooled connection, within the host's concurrency limit"""
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise FetchError(f"{url} is not an http(s) url")
+
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        host_limit = self._host_limit(parts.netloc)
+        if not host_limit.acquire(timeout=max(0, finish_by - time.monotonic())):
+            raise FetchError(f"Deadline passed waiting to fetch {url}")
+
+        try:
+            connection = self.connections.take(parts.scheme, parts.netloc)
+            try:
+                connection.request("GET", path, headers={
+                    "Accept-Encoding": accepted_encodings(),
+                    "User-Agent": USER_AGENT,
+                    **(headers or {})
+                })
+                response = connection.getresponse()
+                body = response.read()
+            except (OSError, http.client.HTTPException) as err:
+                connection.close()
+                raise FetchError(f"{url}: {err!r}", retryable=True) from err
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.connections.give_back(parts.scheme, parts.netloc, connection)
+
+            return response.status, response.headers, body
+        finally:
+            host_limit.release()
+
+    def _host_limit(self, netloc: str) -> threading.BoundedSemaphore:
+        """Semaphore capping concurrent requests to one host"""
+        with self._host_limits_lock:
+            if netloc not in self._host_limits:
+                self._host_limits[netloc] = threading.BoundedSemaphore(self.per_host)
+            return self._host_limits[netloc]
+
+
+def fetch_all(urls: list[str], failures: dict = None, **options):
+    """Fetches a batch of urls with a one-off Fetcher, yielding (url, html) as each completes"""
+    fetcher = Fetcher(**options)
+    try:
+        yield from fetcher.fetch_all(urls, failures)
+    finally:
+        fetcher.close()
@@ -0,0 +1,190 @@
+"""Bulk ingest of scraped stories, deduplicated by canonical url and title fingerprint.
+
+A story whose canonical url is already stored refreshes that story. A story
+with a new url is merged into an existing story instead of inserted when
+their titles are near-duplicates: the simhash fingerprints of the normalized
+titles differ in at most TITLE_DISTANCE bits and the existing story is from
+the last TITLE_WINDOW_DAYS days. Fingerprints are split into four 16 bit
+bands, any two within TITLE_DISTANCE bits share at least one band, and the
+bands are indexed so candidates are found without scanning the table.
+"""
+import hashlib
+import re
+import unicodedata
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from psycopg2 import extensions, extras
+from response_cache import invalidate_stories
+from metrics import timed_query
+
+TRACKING_PARAMS = {"fbclid", "gclid", "ocid", "ns_mchannel", "ns_source", "ns_campaign", "ns_linkname"}
+TRACKING_PREFIXES = ("utm_", "at_")
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "of", "to", "in", "on", "for", "at", "by",
+    "with", "from", "as", "is", "are", "was", "were", "be", "has", "have", "it", "its"
+}
+MIN_FINGERPRINT_WORDS = 3
+TITLE_DISTANCE = 3
+TITLE_WINDOW_DAYS = 7
+FINGERPRINT_BITS = 64
+BAND_BITS = 16
+
+
+def canonicalize_url(url: str) -> str:
+    """Reduces a story url to a key shared by every spelling of the same page:
+    https, no www, default port, fragment, tracking parameters, repeated or
+    trailing slashes, and with the remaining parameters sorted"""
+    url = url.strip()
+    if "://" not in url:
+        url = "http://" + url
+    parts = urlsplit(url)
+
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port and parts.port not in (80, 443):
+        host += f":{parts.port}"
+
+    path = "/".join(segment for segment in parts.path.split("/") if segment)
+    path = "/" + path
+
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+    )
+
+    return urlunsplit(("https", host, path, urlencode(query), ""))
+
+
+def normalize_title(title: str) -> list[str]:
+    """Words of a headline with case, accents, punctuation, stopwords and
+    single letters removed, so trivial rewordings normalize the same"""
+    title = unicodedata.normalize("NFKD", title)
+    title = "".join(char for char in title if not unicodedata.combining(char)).lower()
+    words = re.findall(r"[a-z0-9]+", title)
+    return [word for word in words if len(word) > 1 and word not in STOPWORDS]
+
+
+def title_fingerprint(title: str) -> int:
+    """64 bit simhash of a normalized title as a signed bigint, or None when
+    the title has too few words for a match to mean anything"""
+    words = normalize_title(title)
+    if len(set(words)) < MIN_FINGERPRINT_WORDS:
+        return None
+
+    weights = [0] * FINGERPRINT_BITS
+    for word in words:
+        word_hash = int.from_bytes(hashlib.blake2b(word.encode("utf_8"), digest_size=8).digest(), "big")
+        for bit in range(FINGERPRINT_BITS):
+            weights[bit] += 1 if word_hash >> bit & 1 else -1
+
+    fingerprint = sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+    if fingerprint >= 1 << (FINGERPRINT_BITS - 1):
+        fingerprint -= 1 << FINGERPRINT_BITS
+    return fingerprint
+
+
+def fingerprint_bands(fingerprint: int) -> list[int]:
+    """Splits a fingerprint into bands, each tagged with its position"""
+    if fingerprint is None:
+        return []
+
+    unsigned = fingerprint % (1 << FINGERPRINT_BITS)
+    band_mask = (1 << BAND_BITS) - 1
+    return [(band << BAND_BITS) | (unsigned >> (band * BAND_BITS) & band_mask)
+            for band in range(FINGERPRINT_BITS // BAND_BITS)]
+
+
+def title_distance(first: int, second: int) -> int:
+    """Number of bits two fingerprints differ in"""
+    return bin((first ^ second) % (1 << FINGERPRINT_BITS)).count("1")
+
+
+def unique_stories(stories: list[dict]) -> tuple[list[tuple], int]:
+    """Drops repeated urls and near-duplicate titles within a batch, returning
+    (title, url, canonical_url, fingerprint, bands) rows and how many stories
+    were merged as near-duplicates"""
+    rows = {}
+    kept_by_band = {}
+    merged = 0
+
+    for story in stories:
+        canonical_url = canonicalize_url(story["url"])
+        if canonical_url in rows:
+            continue
+
+        fingerprint = title_fingerprint(story["title"])
+        bands = fingerprint_bands(fingerprint)
+        candidates = {kept for band in bands for kept in kept_by_band.get(band, [])}
+        if any(title_distance(fingerprint, kept) <= TITLE_DISTANCE for kept in candidates):
+            merged += 1
+            continue
+
+        rows[canonical_url] = (story["title"], story["url"], canonical_url, fingerprint, bands)
+        for band in bands:
+            kept_by_band.setdefault(band, []).append(fingerprint)
+
+    return list(rows.values()), merged
+
+
+def merge_statement(source: str) -> str:
+    """The statement that merges a batch of stories, given a query producing
+    (title, url, canonical_url, fingerprint, bands) rows, and returns how
+    many were inserted, updated and merged into a near-duplicate"""
+    return f"""WITH batch (title, url, canonical_url, fingerprint, bands) AS ({source}),
+            classified AS (
+                SELECT batch.*, NOT EXISTS (
+                    SELECT 1 FROM stories WHERE stories.canonical_url = batch.canonical_url
+                ) AND EXISTS (
+                    SELECT 1 FROM stories
+                    WHERE stories.title_bands && batch.bands
+                    AND stories.created_at > LOCALTIMESTAMP - interval '{TITLE_WINDOW_DAYS:d} days'
+                    AND title_distance(stories.title_fingerprint, batch.fingerprint)
+                        <= {TITLE_DISTANCE:d}
+                ) AS merged
+                FROM batch),
+            written AS (
+                INSERT INTO stories (title, url, canonical_url, title_fingerprint, title_bands,
+                    created_at, updated_at)
+                SELECT title, url, canonical_url, fingerprint, bands,
+                    current_timestamp, current_timestamp
+                FROM classified WHERE NOT merged
+                ON CONFLICT (canonical_url) DO UPDATE
+                SET title = EXCLUDED.title, title_fingerprint = EXCLUDED.title_fingerprint,
+                title_bands = EXCLUDED.title_bands, updated_at = current_timestamp
+                WHERE stories.title IS DISTINCT FROM EXCLUDED.title
+                RETURNING (xmax = 0) AS inserted)
+            SELECT
+                (SELECT COUNT(*) FROM written WHERE inserted) AS inserted,
+                (SELECT COUNT(*) FROM written WHERE NOT inserted) AS updated,
+                (SELECT COUNT(*) FROM classified WHERE merged) AS merged;"""
+
+
+@timed_query
+def ingest_stories(connection: extensions.connection, stories: list[dict]) -> dict:
+    """Writes a whole scrape result in one statement and transaction.
+    New urls are inserted unless their title is a near-duplicate of a recent
+    story, in which case they are merged into it. Known urls get their title
+    refreshed if it changed, and everything else (including repeats within
+    the batch) is skipped"""
+    counts = {"inserted": 0, "updated": 0, "merged": 0, "skipped": 0}
+
+    rows, counts["merged"] = unique_stories(stories)
+
+    if rows:
+        cursor = connection.cursor()
+        [(inserted, updated, merged)] = extras.execute_values(
+            cursor, merge_statement("VALUES %s"), rows,
+            template="(%s, %s, %s, %s::bigint, %s::int[])",
+            page_size=len(rows), fetch=True)
+
+        connection.commit()
+        cursor.close()
+        invalidate_stories()
+
+        counts["inserted"] = inserted
+        counts["updated"] = updated
+        counts["merged"] += merged
+
+    counts["skipped"] = len(stories) - counts["inserted"] - counts["updated"] - counts["merged"]
+    return counts
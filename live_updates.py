@@ -0,0 +1,185 @@
+"""Live story updates for GET /stories/stream, sent as Server-Sent Events.
+
+Triggers on stories (migrations/010_story_notifications.sql) NOTIFY the
+story_changes channel with a small JSON delta whenever a story is added,
+edited, deleted or has its score changed. Each process keeps one connection
+listening on that channel and copies every delta to all of its subscribers,
+so the database sees one listener per process however many clients are open.
+A subscriber that falls more than SSE_MAX_PENDING events behind, or that may
+have missed events while the listener reconnected, is sent a reset event
+telling it to reload the stories instead.
+"""
+import json
+import select
+import threading
+import time
+from collections import deque
+from os import environ
+import psycopg2
+
+from stories_functions import get_db_connection
+
+CHANNEL = "story_changes"
+RETRY_MS = 3000
+
+
+def format_event(event: str, data: str) -> str:
+    """One Server-Sent Event"""
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+def parse_notification(payload: str) -> tuple[str, str]:
+    """Splits a trigger's payload into the event name and the data sent on"""
+    return json.loads(payload)["event"], payload
+
+
+class Subscription:
+    """Events waiting to be sent to one client"""
+
+    def __init__(self, max_pending: int = 100):
+        self.max_pending = max_pending
+        self._events = deque()
+        self._condition = threading.Condition()
+
+    def put(self, event: str, data: str) -> bool:
+        """Queues an event. If the client is too far behind, its queue is
+        replaced by a reset event and False is returned"""
+        with self._condition:
+            overflowed = len(self._events) >= self.max_pending
+            if overflowed:
+                self._events.clear()
+                self._events.append(("reset", "{}"))
+            else:
+                self._events.append((event, data))
+            self._condition.notify()
+            return not overflowed
+
+    def get(self, timeout: float) -> tuple:
+        """Waits up to timeout seconds for the next (event, data), or returns None"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._events, timeout)
+            return self._events.popleft() if self._events else None
+
+
+def event_stream(listener, heartbeat: float):
+    """Subscribes to a listener and yields its events as Server-Sent Events,
+    with a comment every heartbeat seconds so idle connections stay open.
+    Unsubscribes when the client goes away"""
+    subscription = listener.subscribe()
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        while True:
+            next_event = subscription.get(heartbeat)
+            yield ": keep-alive\n\n" if next_event is None else format_event(*next_event)
+    finally:
+        listener.unsubscribe(subscription)
+
+
+class StoryChangeListener:
+    """One LISTEN connection per process, fanning notifications out to subscribers"""
+
+    def __init__(self, connect, max_pending: int = 100, reconnect_delay: float = 1.0):
+        self.connect = connect
+        self.max_pending = max_pending
+        self.reconnect_delay = reconnect_delay
+
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self._stats = {"notifications": 0, "resets": 0, "reconnects": 0}
+
+    def subscribe(self) -> Subscription:
+        """Adds a subscriber, starting to listen if this is the first"""
+        subscription = Subscription(self.max_pending)
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                self._stopping.clear()
+                self._thread = threading.Thread(
+                    target=self._listen, name="story-change-listener", daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Removes a subscriber"""
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event: str, data: str) -> None:
+        """Sends an event to every subscriber"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self._stats["notifications"] += 1
+
+        resets = sum(1 for subscription in subscribers if not subscription.put(event, data))
+        if resets:
+            with self._lock:
+                self._stats["resets"] += resets
+
+    def stop(self) -> None:
+        """Stops listening once the current wait ends"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        self._stopping.set()
+        if thread is not None:
+            thread.join()
+
+    def stats(self) -> dict:
+        """Returns the subscriber count and notification counters"""
+        with self._lock:
+            return {"subscribers": len(self._subscribers), **self._stats}
+
+    def _listen(self) -> None:
+        """Listens until stopped, reconnecting after errors. Subscribers are
+        reset after a reconnect since notifications may have been missed"""
+        connected_before = False
+        while not self._stopping.is_set():
+            connection = None
+            try:
+                connection = self.connect()
+                if connection is None:
+                    raise psycopg2.OperationalError("Could not open a database connection")
+                connection.autocommit = True
+                cursor = connection.cursor()
+                cursor.execute(f"LISTEN {CHANNEL};")
+                cursor.close()
+
+                if connected_before:
+                    self.publish("reset", "{}")
+                connected_before = True
+
+                while not self._stopping.is_set():
+                    if select.select([connection], [], [], 1.0) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self.publish(*parse_notification(connection.notifies.pop(0).payload))
+            except (psycopg2.Error, OSError, ValueError) as err:
+                print("Error listening for story changes.", err)
+                with self._lock:
+                    self._stats["reconnects"] += 1
+                time.sleep(self.reconnect_delay)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def heartbeat_seconds() -> float:
+    """Seconds between keep-alive comments on an idle event stream"""
+    return float(environ.get("SSE_HEARTBEAT", 15))
+
+
+def get_story_listener() -> StoryChangeListener:
+    """Returns this process's story change listener, creating it on first use"""
+    global _listener
+
+    with _listener_lock:
+        if _listener is None:
+            _listener = StoryChangeListener(
+                get_db_connection, max_pending=int(environ.get("SSE_MAX_PENDING", 100)))
+        return _listener
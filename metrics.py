@@ -0,0 +1,362 @@
+"""Request, query and scrape instrumentation, exposed in Prometheus text format.
+
+Routes are timed by hooks installed with instrument_app. Queries are timed by
+the cursors of connections made with InstrumentedConnection, and labelled with
+the name of the function running them through the timed_query decorator.
+Statements slower than SLOW_QUERY_MS milliseconds (default 100) are written
+as json lines to the slow query log, a file if SLOW_QUERY_LOG is set and
+stderr otherwise. Statements are logged without their parameter values, only
+the shape of the parameters.
+"""
+import inspect
+import json
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from os import environ
+import psycopg2
+from psycopg2 import extensions
+from flask import Flask, g, request
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+MAX_LOGGED_STATEMENT = 1000
+UNNAMED_QUERY = "other"
+
+
+def escape_label(value) -> str:
+    """Escapes a label value for the text format"""
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(labels: dict) -> str:
+    """Renders labels as {name="value",...}, or nothing if there are none"""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels.items()) + "}"
+
+
+class Counter:
+    """Monotonic count, kept separately for each combination of labels"""
+
+    def __init__(self, name: str, description: str, labelnames: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """Adds to the count for these labels"""
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """Returns the count for these labels"""
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self) -> list[str]:
+        """Lines for the text format"""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(dict(zip(self.labelnames, key)))} {value}")
+        return lines
+
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, for each combination of labels"""
+
+    def __init__(self, name: str, description: str, labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        """Records one value for these labels"""
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def count(self, **labels) -> int:
+        """Returns how many values were observed for these labels"""
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, (None, 0.0, 0))[2]
+
+    def sum(self, **labels) -> float:
+        """Returns the total of the values observed for these labels"""
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, (None, 0.0, 0))[1]
+
+    def render(self) -> list[str]:
+        """Lines for the text format"""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                labels = dict(zip(self.labelnames, key))
+                for bound, bucket_count in zip(self.buckets, counts):
+                    bucket_labels = format_labels({**labels, "le": bound})
+                    lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+                lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': '+Inf'})} {count}")
+                lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+
+class Registry:
+    """Set of metrics rendered together on /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        """Adds a metric to the registry and returns it"""
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Every metric in the text format"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Time spent handling requests",
+    ("method", "route")))
+REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "Requests handled, by response status",
+    ("method", "route", "status")))
+REQUEST_ERRORS = REGISTRY.register(Counter(
+    "http_request_errors_total", "Requests that failed with a server error",
+    ("method", "route")))
+QUERY_SECONDS = REGISTRY.register(Histogram(
+    "db_query_duration_seconds", "Time spent running SQL statements", ("query", )))
+QUERY_ROWS = REGISTRY.register(Counter(
+    "db_query_rows_total", "Rows returned or changed by SQL statements", ("query", )))
+QUERY_ERRORS = REGISTRY.register(Counter(
+    "db_query_errors_total", "SQL statements that raised a database error", ("query", )))
+SLOW_QUERIES = REGISTRY.register(Counter(
+    "db_slow_queries_total", "SQL statements written to the slow query log", ("query", )))
+TRENDING_REFRESH_SECONDS = REGISTRY.register(Histogram(
+    "trending_refresh_duration_seconds", "Time spent on each trending decay pass"))
+TRENDING_REFRESHED_STORIES = REGISTRY.register(Counter(
+    "trending_refreshed_stories_total", "Stories whose trending rank was recomputed by decay passes"))
+SCRAPE_PHASE_SECONDS = REGISTRY.register(Histogram(
+    "scrape_phase_duration_seconds", "Time spent fetching, parsing and inserting scraped pages",
+    ("phase", )))
+
+
+def render_metrics() -> str:
+    """Every registered metric in the text format"""
+    return REGISTRY.render()
+
+
+def params_shape(params):
+    """Describes query parameters by type, so values never reach the log"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {name: type(value).__name__ for name, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [type(value).__name__ for value in params]
+    return type(params).__name__
+
+
+class SlowQueryLog:
+    """Writes statements slower than a threshold as json lines"""
+
+    def __init__(self, threshold_ms: float = 100, stream=None):
+        self.threshold_ms = threshold_ms
+        self.stream = stream or sys.stderr
+        self._lock = threading.Lock()
+
+    def record(self, query: str, statement, params, duration: float, rows: int) -> bool:
+        """Logs a statement if it took longer than the threshold, returning whether it did"""
+        duration_ms = duration * 1000
+        if duration_ms < self.threshold_ms:
+            return False
+
+        if isinstance(statement, bytes):
+            statement = statement.decode("utf_8", errors="replace")
+        statement = re.sub(r"\s+", " ", str(statement)).strip()
+
+        line = json.dumps({
+            "query": query,
+            "statement": statement[:MAX_LOGGED_STATEMENT],
+            "params": params_shape(params),
+            "duration_ms": round(duration_ms, 3),
+            "rows": rows
+        })
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+        SLOW_QUERIES.inc(query=query)
+        return True
+
+
+_slow_query_log = None
+_slow_query_log_lock = threading.Lock()
+
+
+def get_slow_query_log() -> SlowQueryLog:
+    """Returns the process-wide slow query log, configured from the environment"""
+    global _slow_query_log
+
+    with _slow_query_log_lock:
+        if _slow_query_log is None:
+            path = environ.get("SLOW_QUERY_LOG")
+            _slow_query_log = SlowQueryLog(
+                threshold_ms=float(environ.get("SLOW_QUERY_MS", 100)),
+                stream=open(path, "a", encoding="utf_8") if path else None
+            )
+        return _slow_query_log
+
+
+_current_query = ContextVar("current_query", default=UNNAMED_QUERY)
+
+
+def current_query() -> str:
+    """Name of the timed_query function running on this thread or task"""
+    return _current_query.get()
+
+
+def timed_query(function):
+    """Labels the statements a database function runs with its name.
+    Works for coroutine functions as well as plain ones"""
+
+    if inspect.iscoroutinefunction(function):
+        @wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            token = _current_query.set(function.__name__)
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                _current_query.reset(token)
+
+        return async_wrapper
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        token = _current_query.set(function.__name__)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current_query.reset(token)
+
+    return wrapper
+
+
+def record_query(statement, params, duration: float, rows: int = None,
+                 failed: bool = False) -> None:
+    """Records one statement's timing, row count or error against the current query"""
+    query = current_query()
+    QUERY_SECONDS.observe(duration, query=query)
+
+    if failed:
+        QUERY_ERRORS.inc(query=query)
+        return
+
+    if rows is not None and rows > 0:
+        QUERY_ROWS.inc(rows, query=query)
+    get_slow_query_log().record(query, statement, params, duration, rows)
+
+
+_instrumented_cursors = {}
+_instrumented_cursors_lock = threading.Lock()
+
+
+def instrumented_cursor(cursor_factory: type) -> type:
+    """Subclass of a cursor class whose statements are timed and counted"""
+    with _instrumented_cursors_lock:
+        if cursor_factory not in _instrumented_cursors:
+
+            def execute(self, query, vars=None):  # pylint: disable=redefined-builtin
+                started = time.perf_counter()
+                try:
+                    result = cursor_factory.execute(self, query, vars)
+                except psycopg2.Error:
+                    record_query(query, vars, time.perf_counter() - started, failed=True)
+                    raise
+                record_query(query, vars, time.perf_counter() - started, self.rowcount)
+                return result
+
+            _instrumented_cursors[cursor_factory] = type(
+                f"Instrumented{cursor_factory.__name__}", (cursor_factory, ), {"execute": execute})
+        return _instrumented_cursors[cursor_factory]
+
+
+class InstrumentedConnection(extensions.connection):
+    """Connection whose cursors, of any cursor_factory, time their statements"""
+
+    def cursor(self, *args, **kwargs):
+        """Opens a cursor that records metrics for every statement it runs"""
+        cursor_factory = kwargs.get("cursor_factory") or self.cursor_factory or extensions.cursor
+        kwargs["cursor_factory"] = instrumented_cursor(cursor_factory)
+        return super().cursor(*args, **kwargs)
+
+
+@contextmanager
+def timed_phase(phase: str):
+    """Times one fetch, parse or insert step of a scrape"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        SCRAPE_PHASE_SECONDS.observe(time.perf_counter() - started, phase=phase)
+
+
+def instrument_app(app: Flask, current_request=request, app_globals=g) -> None:
+    """Installs hooks timing every request and counting responses and server errors.
+    Quart apps pass their own request and g, which work the same way"""
+
+    def route_labels() -> dict:
+        """Method and route pattern (not the raw path) of the current request"""
+        rule = current_request.url_rule
+        return {"method": current_request.method, "route": rule.rule if rule else "unmatched"}
+
+    def record_request(status: int) -> None:
+        """Records the current request once, with its response status"""
+        started = app_globals.pop("metrics_request_start", None)
+        if started is None:
+            return
+        labels = route_labels()
+        REQUEST_SECONDS.observe(time.perf_counter() - started, **labels)
+        REQUESTS.inc(status=status, **labels)
+        if status >= 500:
+            REQUEST_ERRORS.inc(**labels)
+
+    @app.before_request
+    def start_timer():
+        app_globals.metrics_request_start = time.perf_counter()
+
+    @app.after_request
+    def stop_timer(response):
+        record_request(response.status_code)
+        return response
+
+    @app.teardown_request
+    def record_unhandled(exception=None):
+        if exception is not None:
+            record_request(500)
@@ -0,0 +1,7 @@
+-- Stores each story's score counters on the story row so reads no longer
+-- aggregate the votes table. Run `python3 reconcile_scores.py` afterwards
+-- to backfill the counters from existing votes.
+
+ALTER TABLE stories ADD COLUMN IF NOT EXISTS score INT NOT NULL DEFAULT 0;
+ALTER TABLE stories ADD COLUMN IF NOT EXISTS upvotes INT NOT NULL DEFAULT 0;
+ALTER TABLE stories ADD COLUMN IF NOT EXISTS downvotes INT NOT NULL DEFAULT 0;
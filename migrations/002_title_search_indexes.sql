@@ -0,0 +1,10 @@
+-- Indexes behind find_specific_story: a full-text index for ranked word
+-- matches and a trigram index for substring and typo-tolerant matches.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS stories_title_search_idx
+    ON stories USING GIN (to_tsvector('english', title));
+
+CREATE INDEX IF NOT EXISTS stories_title_trigram_idx
+    ON stories USING GIN (LOWER(title) gin_trgm_ops);
@@ -0,0 +1,22 @@
+-- Queue of scrape jobs shared by every app instance and scrape worker.
+-- Workers claim jobs with SELECT ... FOR UPDATE SKIP LOCKED.
+
+CREATE TABLE IF NOT EXISTS scrape_jobs (
+  id SERIAL PRIMARY KEY,
+  urls TEXT[] NOT NULL,
+  status TEXT NOT NULL,
+  attempts INT NOT NULL DEFAULT 0,
+  stories_found INT NOT NULL DEFAULT 0,
+  stories_added INT NOT NULL DEFAULT 0,
+  urls_failed INT NOT NULL DEFAULT 0,
+  fetch_ms FLOAT,
+  parse_ms FLOAT,
+  insert_ms FLOAT,
+  error TEXT,
+  created_at timestamp NOT NULL,
+  started_at timestamp,
+  finished_at timestamp
+);
+
+CREATE INDEX IF NOT EXISTS scrape_jobs_pending_idx ON scrape_jobs (id)
+    WHERE status IN ('queued', 'running');
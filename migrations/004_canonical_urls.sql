@@ -0,0 +1,8 @@
+-- Canonical url key used to deduplicate scraped stories. Run
+-- `python3 backfill_canonical_urls.py` afterwards to fill it for existing stories.
+
+ALTER TABLE stories ADD COLUMN IF NOT EXISTS canonical_url TEXT;
+ALTER TABLE stories ADD CONSTRAINT stories_canonical_url_key UNIQUE (canonical_url);
+
+ALTER TABLE scrape_jobs ADD COLUMN IF NOT EXISTS stories_updated INT NOT NULL DEFAULT 0;
+ALTER TABLE scrape_jobs ADD COLUMN IF NOT EXISTS stories_skipped INT NOT NULL DEFAULT 0;
@@ -0,0 +1,3 @@
+-- Counts pages a scrape job skipped because they had not changed since the last fetch.
+
+ALTER TABLE scrape_jobs ADD COLUMN IF NOT EXISTS urls_unchanged INT NOT NULL DEFAULT 0;
@@ -0,0 +1,16 @@
+-- Indexes behind sort_stories and load_stories_page. Each sort orders by its
+-- key and then id, so every sort mode, ascending or descending, is read in
+-- order from one of these indexes instead of sorting the whole table.
+-- INITCAP(title) is indexed with the column's default collation, which is the
+-- collation the queries sort by.
+
+CREATE INDEX IF NOT EXISTS stories_title_sort_idx ON stories (INITCAP(title), id);
+CREATE INDEX IF NOT EXISTS stories_score_sort_idx ON stories (score, id);
+CREATE INDEX IF NOT EXISTS stories_created_at_sort_idx ON stories (created_at, id);
+CREATE INDEX IF NOT EXISTS stories_updated_at_sort_idx ON stories (updated_at, id);
+
+-- Used by the votes foreign key, delete_story and reconcile_story_scores.
+CREATE INDEX IF NOT EXISTS votes_story_id_idx ON votes (story_id);
+
+ANALYZE stories;
+ANALYZE votes;
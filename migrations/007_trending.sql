@@ -0,0 +1,21 @@
+-- Ranking for sort=trending: each story's score decayed by its age, as
+-- score / (age in hours + age_offset) ^ gravity. The rank is stored on the
+-- story and indexed so the top N are read in order. Votes update it as they
+-- change the score, and trending.py decays every recent story periodically.
+
+CREATE OR REPLACE FUNCTION trending_rank(score INT, created_at TIMESTAMP,
+                                         gravity FLOAT8, age_offset FLOAT8)
+RETURNS FLOAT8 AS $$
+    SELECT GREATEST(score, 0) / POWER(
+        GREATEST(EXTRACT(EPOCH FROM LOCALTIMESTAMP - created_at) / 3600, 0) + age_offset,
+        gravity)
+$$ LANGUAGE SQL STABLE;
+
+ALTER TABLE stories ADD COLUMN IF NOT EXISTS trending_score FLOAT8 NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS stories_trending_sort_idx ON stories (trending_score, id);
+
+UPDATE stories SET trending_score = trending_rank(score, created_at, 1.8, 2)
+WHERE created_at > LOCALTIMESTAMP - interval '72 hours';
+
+ANALYZE stories;
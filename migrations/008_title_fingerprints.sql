@@ -0,0 +1,18 @@
+-- Near-duplicate detection for scraped stories. Each title is stored with a
+-- 64 bit simhash of its normalized words (ingest.title_fingerprint) and that
+-- fingerprint split into four position-tagged 16 bit bands. Titles within 3
+-- bits of each other share a band, so the GIN index on the bands finds the
+-- candidates and title_distance confirms them.
+-- Run backfill_title_fingerprints.py afterwards to fingerprint existing stories.
+
+CREATE OR REPLACE FUNCTION title_distance(first BIGINT, second BIGINT)
+RETURNS INT AS $$
+    SELECT length(replace((first # second)::bit(64)::text, '0', ''))
+$$ LANGUAGE SQL IMMUTABLE;
+
+ALTER TABLE stories ADD COLUMN IF NOT EXISTS title_fingerprint BIGINT;
+ALTER TABLE stories ADD COLUMN IF NOT EXISTS title_bands INT[] NOT NULL DEFAULT '{}';
+
+CREATE INDEX IF NOT EXISTS stories_title_bands_idx ON stories USING GIN (title_bands);
+
+ALTER TABLE scrape_jobs ADD COLUMN IF NOT EXISTS stories_merged INT NOT NULL DEFAULT 0;
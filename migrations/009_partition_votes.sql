@@ -0,0 +1,61 @@
+-- Partitions votes by month of created_at and adds vote_rollups, which holds
+-- per-story, per-month up and down counts for votes compacted out of old
+-- partitions. compact_votes.py creates upcoming partitions and rolls up and
+-- drops old ones. Votes outside every monthly partition land in votes_default.
+
+BEGIN;
+
+ALTER TABLE votes RENAME TO votes_unpartitioned;
+ALTER TABLE votes_unpartitioned DROP CONSTRAINT IF EXISTS story_fk;
+ALTER INDEX IF EXISTS votes_pkey RENAME TO votes_unpartitioned_pkey;
+ALTER INDEX IF EXISTS votes_story_id_idx RENAME TO votes_unpartitioned_story_id_idx;
+
+CREATE TABLE votes (
+     id serial,
+     direction TEXT NOT NULL,
+     created_at timestamp NOT NULL,
+     updated_at timestamp NOT NULL,
+     story_id INT,
+     PRIMARY KEY (id, created_at)
+  ) PARTITION BY RANGE (created_at);
+
+CREATE TABLE votes_default PARTITION OF votes DEFAULT;
+
+DO $$
+DECLARE
+    month DATE;
+BEGIN
+    FOR month IN
+        SELECT generate_series(
+            date_trunc('month', COALESCE(MIN(created_at), LOCALTIMESTAMP)),
+            date_trunc('month', LOCALTIMESTAMP) + interval '2 months',
+            interval '1 month')::date
+        FROM votes_unpartitioned
+    LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF votes FOR VALUES FROM (%L) TO (%L)',
+                       'votes_' || to_char(month, 'YYYY_MM'), month, month + interval '1 month');
+    END LOOP;
+END
+$$;
+
+INSERT INTO votes (id, direction, created_at, updated_at, story_id)
+SELECT id, direction, created_at, updated_at, story_id FROM votes_unpartitioned;
+
+SELECT setval(pg_get_serial_sequence('votes', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM votes;
+
+DROP TABLE votes_unpartitioned;
+
+ALTER TABLE votes ADD CONSTRAINT story_fk FOREIGN KEY(story_id) REFERENCES stories(id);
+CREATE INDEX votes_story_id_idx ON votes (story_id);
+
+CREATE TABLE IF NOT EXISTS vote_rollups (
+  story_id INT NOT NULL REFERENCES stories(id),
+  period DATE NOT NULL,
+  upvotes INT NOT NULL DEFAULT 0,
+  downvotes INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (story_id, period)
+);
+
+COMMIT;
+
+ANALYZE votes;
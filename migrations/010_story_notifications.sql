@@ -0,0 +1,41 @@
+-- Live updates for GET /stories/stream. Every change to a story that readers
+-- can see is sent on the story_changes channel as a small JSON delta: added,
+-- edited (title or url), deleted, or score (votes change the counters on the
+-- story, so one trigger on stories covers them). Notifications are delivered
+-- when the transaction commits, and other updates such as trending_score
+-- refreshes send nothing.
+
+CREATE OR REPLACE FUNCTION notify_story_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('story_changes', json_build_object(
+            'event', 'deleted', 'id', OLD.id)::text);
+    ELSIF TG_OP = 'INSERT' THEN
+        PERFORM pg_notify('story_changes', json_build_object(
+            'event', 'added', 'id', NEW.id, 'title', NEW.title, 'url', NEW.url,
+            'score', NEW.score, 'created_at', NEW.created_at)::text);
+    ELSE
+        IF NEW.title IS DISTINCT FROM OLD.title OR NEW.url IS DISTINCT FROM OLD.url THEN
+            PERFORM pg_notify('story_changes', json_build_object(
+                'event', 'edited', 'id', NEW.id, 'title', NEW.title, 'url', NEW.url)::text);
+        END IF;
+        IF NEW.score IS DISTINCT FROM OLD.score THEN
+            PERFORM pg_notify('story_changes', json_build_object(
+                'event', 'score', 'id', NEW.id, 'score', NEW.score,
+                'upvotes', NEW.upvotes, 'downvotes', NEW.downvotes)::text);
+        END IF;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS stories_notify_added_deleted ON stories;
+CREATE TRIGGER stories_notify_added_deleted AFTER INSERT OR DELETE ON stories
+    FOR EACH ROW EXECUTE FUNCTION notify_story_change();
+
+DROP TRIGGER IF EXISTS stories_notify_changed ON stories;
+CREATE TRIGGER stories_notify_changed AFTER UPDATE OF title, url, score ON stories
+    FOR EACH ROW
+    WHEN (NEW.title IS DISTINCT FROM OLD.title OR NEW.url IS DISTINCT FROM OLD.url
+          OR NEW.score IS DISTINCT FROM OLD.score)
+    EXECUTE FUNCTION notify_story_change();
@@ -0,0 +1,15 @@
+-- Deleting a story deletes its votes and vote rollups with it, so removing
+-- many stories (e.g. through POST /stories/batch) is one DELETE on stories.
+-- Both foreign keys are indexed by story_id, so each cascade is an index lookup.
+
+BEGIN;
+
+ALTER TABLE votes DROP CONSTRAINT story_fk;
+ALTER TABLE votes ADD CONSTRAINT story_fk FOREIGN KEY (story_id)
+    REFERENCES stories(id) ON DELETE CASCADE;
+
+ALTER TABLE vote_rollups DROP CONSTRAINT vote_rollups_story_id_fkey;
+ALTER TABLE vote_rollups ADD CONSTRAINT vote_rollups_story_id_fkey FOREIGN KEY (story_id)
+    REFERENCES stories(id) ON DELETE CASCADE;
+
+COMMIT;
@@ -1,33 +1,128 @@
 """News scraper script for stories api"""
-from urllib.request import urlopen
-from bs4 import BeautifulSoup
+from urllib.error import HTTPError
+from urllib.parse import urljoin
+from urllib.request import Request, urlopen
+from os import environ
+import soupsieve
+from bs4 import BeautifulSoup, SoupStrainer
+from page_cache import PageCache
+from metrics import timed_phase
 
+try:
+    import lxml
+except ImportError:
+    lxml = None
 
-def get_html(url):
-    """gets html from url"""
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
 
-    page = urlopen(url)
-    html_bytes = page.read()
+STORY_CLASSES = ["ssrcss-its5xf-PromoLink", "ssrcss-1mrs5ns-PromoLink", "gs-c-promo-heading"]
+STORY_CSS = ", ".join(f"a.{story_class}" for story_class in STORY_CLASSES)
+STORY_SELECTOR = soupsieve.compile(STORY_CSS)
+
+
+def has_story_class(class_value: str) -> bool:
+    """whether any token of an anchor's class attribute is one of the story
+    classes, matched case-sensitively like the CSS selector"""
+
+    return bool(class_value) and any(token in STORY_CLASSES for token in class_value.split())
+
+
+STORY_ANCHORS = SoupStrainer("a", class_=has_story_class)
+
+
+def get_html(url, timeout: float = 10, cache: PageCache = None):
+    """gets html from url, giving up if the server takes longer than timeout seconds.
+    With a cache, sends a conditional request and returns None if the page is unchanged.
+    A changed page is cached once the caller calls cache.commit(url)"""
+
+    headers = cache.conditional_headers(url) if cache else {}
+    with timed_phase("fetch"):
+        try:
+            with urlopen(Request(url, headers=headers), timeout=timeout) as page:
+                html_bytes = page.read()
+                validators = page.headers.get("ETag"), page.headers.get("Last-Modified")
+        except HTTPError as err:
+            if err.code == 304 and cache:
+                cache.not_modified(url)
+                return None
+            raise
     html = html_bytes.decode("utf_8")
+
+    if cache and not cache.stage(url, html, *validators):
+        return None
     return html
 
 
-def parse_stories_bs(domain_url: str, html):
-    """parses story into suitable lists to use"""
+def parse_with_soup(html, features: str) -> list:
+    """parses only the story anchors into a BeautifulSoup tree and returns
+    (href, text) for each anchor matching the story selector"""
+
+    soup = BeautifulSoup(html, features, parse_only=STORY_ANCHORS)
+    return [(anchor.get('href'), anchor.get_text()) for anchor in STORY_SELECTOR.select(soup)]
+
+
+def parse_with_selectolax(html) -> list:
+    """parses html with selectolax and returns (href, text) for each story anchor.
+    Lexbor matches classes case-insensitively in quirks mode and its text
+    includes scripts and styles, so both are brought in line with BeautifulSoup"""
+
+    tree = LexborHTMLParser(html)
+    anchors = []
+    for anchor in tree.css(STORY_CSS):
+        if not has_story_class(anchor.attributes.get('class')):
+            continue
+        anchor.strip_tags(["script", "style"])
+        anchors.append((anchor.attributes.get('href'), anchor.text()))
+    return anchors
+
+
+PARSER_BACKENDS = {
+    "html.parser": lambda html: parse_with_soup(html, "html.parser"),
+    "lxml": lambda html: parse_with_soup(html, "lxml"),
+    "selectolax": parse_with_selectolax
+}
+
+
+def available_backends() -> list[str]:
+    """names of the parser backends whose libraries are installed"""
+
+    backends = ["html.parser"]
+    if lxml:
+        backends.append("lxml")
+    if LexborHTMLParser:
+        backends.append("selectolax")
+    return backends
+
+
+def default_backend() -> str:
+    """backend named in PARSER_BACKEND, otherwise the fastest one installed"""
+
+    backends = available_backends()
+    backend = environ.get("PARSER_BACKEND")
+    if backend and backend not in backends:
+        raise ValueError(
+            f"PARSER_BACKEND {backend!r} is not an installed parser backend, "
+            f"choose one of {', '.join(backends)}")
+    return backend or backends[-1]
+
+
+def parse_stories_bs(domain_url: str, html, backend: str = None):
+    """parses story into suitable lists to use, resolving each link
+    against the page url so relative and absolute links agree"""
 
     stories = []
-    soup = BeautifulSoup(html, "html.parser")
-    scrape_results = soup.select(
-        "a.ssrcss-its5xf-PromoLink, a.ssrcss-1mrs5ns-PromoLink, a.gs-c-promo-heading"
-        )
-
-    for story in scrape_results:
-        if not story.get_text() or not story.get('href'):
-            scrape_results.remove(story)
+    with timed_phase("parse"):
+        anchors = PARSER_BACKENDS[backend or default_backend()](html)
+
+    for href, title in anchors:
+        if not title or not href:
             continue
         stories.append({
-            "url": domain_url + story.get('href'),
-            "title": story.get_text()
+            "url": urljoin(domain_url, href),
+            "title": title
         })
 
     return stories
@@ -0,0 +1,216 @@
+"""On-disk cache of fetched pages, used to make conditional requests when re-scraping.
+
+Each page is stored gzipped under a hash of its url. A small json index keeps
+the validators (ETag / Last-Modified), a hash of the content and when the
+entry was last used, so the cache can be bounded by entry count and size with
+least-recently-used eviction, and entries older than the ttl are dropped.
+
+A scraper stages each page it downloads and commits it once the page's stories
+are stored, so a page whose ingest failed is fetched in full next time rather
+than answered with a 304. Several processes can share one directory: each
+merges its changes into index.json under a lock instead of overwriting it.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def content_hash(html: str) -> str:
+    """Fingerprint of a page's content"""
+    return hashlib.sha256(html.encode("utf_8")).hexdigest()
+
+
+class PageCache:
+    """Bounded LRU store of pages and their HTTP validators, kept on disk"""
+
+    def __init__(self, directory: str, max_entries: int = 500,
+                 max_bytes: int = 50_000_000, ttl: float = 86400):
+        self.directory = Path(directory)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._index_path = self.directory / "index.json"
+        self._lock_path = self.directory / "index.lock"
+        self._lock = threading.Lock()
+        self._index = self._load_index()
+        self._pending = {}
+        self._changed = set()
+        self._removed = set()
+
+    def conditional_headers(self, url: str) -> dict:
+        """Headers that let the server answer 304 if the cached copy is current"""
+        with self._lock:
+            entry = self._fresh_entry(url)
+            if entry is None:
+                return {}
+
+            headers = {}
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+            return headers
+
+    def get(self, url: str) -> str:
+        """Returns the cached page, or None if it is missing or expired"""
+        with self._lock:
+            entry = self._fresh_entry(url)
+            if entry is None:
+                return None
+
+            try:
+                html = gzip.decompress((self.directory / entry["file"]).read_bytes())
+            except OSError:
+                self._remove(url)
+                self._save_index()
+                return None
+
+            entry["last_used"] = time.time()
+            self._changed.add(url)
+            self._save_index()
+            return html.decode("utf_8")
+
+    def not_modified(self, url: str) -> None:
+        """Records that the server confirmed the cached copy is still current"""
+        with self._lock:
+            entry = self._index.get(url)
+            if entry:
+                entry["fetched_at"] = entry["last_used"] = time.time()
+                self._changed.add(url)
+                self._save_index()
+
+    def stage(self, url: str, html: str, etag: str = None, last_modified: str = None) -> bool:
+        """Checks a freshly downloaded page against the cache and returns whether
+        its content changed. A changed page is held back until commit(url), so it
+        is not cached before its stories are stored"""
+        with self._lock:
+            entry = self._fresh_entry(url)
+            if entry is None or entry["content_hash"] != content_hash(html):
+                self._pending[url] = (html, etag, last_modified)
+                return True
+
+            now = time.time()
+            entry.update(etag=etag, last_modified=last_modified, fetched_at=now, last_used=now)
+            self._pending.pop(url, None)
+            self._changed.add(url)
+            self._save_index()
+            return False
+
+    def commit(self, url: str) -> None:
+        """Caches the page stage(url) held back, once its stories are stored"""
+        with self._lock:
+            pending = self._pending.pop(url, None)
+        if pending:
+            self.store(url, *pending)
+
+    def store(self, url: str, html: str, etag: str = None, last_modified: str = None) -> bool:
+        """Saves a freshly downloaded page and returns whether its content changed"""
+        digest = content_hash(html)
+        now = time.time()
+
+        with self._lock:
+            entry = self._fresh_entry(url)
+            changed = entry is None or entry["content_hash"] != digest
+
+            if changed:
+                data = gzip.compress(html.encode("utf_8"))
+                file_name = hashlib.sha256(url.encode("utf_8")).hexdigest() + ".html.gz"
+                temporary = self.directory / (file_name + ".tmp")
+                temporary.write_bytes(data)
+                os.replace(temporary, self.directory / file_name)
+                entry = {"file": file_name, "size": len(data), "content_hash": digest}
+                self._index[url] = entry
+
+            entry.update(etag=etag, last_modified=last_modified, fetched_at=now, last_used=now)
+            self._changed.add(url)
+            self._save_index()
+
+            return changed
+
+    def stats(self) -> dict:
+        """Returns the number of cached pages and their total compressed size"""
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": sum(entry["size"] for entry in self._index.values())
+            }
+
+    def _fresh_entry(self, url: str) -> dict:
+        """Index entry for a url, dropping it if it is older than the ttl"""
+        entry = self._index.get(url)
+        if entry and time.time() - entry["fetched_at"] > self.ttl:
+            self._remove(url)
+            return None
+        return entry
+
+    def _evict(self) -> None:
+        """Removes least recently used pages until the cache is within its bounds"""
+        by_last_use = sorted(self._index, key=lambda url: self._index[url]["last_used"])
+        total_bytes = sum(entry["size"] for entry in self._index.values())
+
+        for url in by_last_use:
+            if len(self._index) <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            total_bytes -= self._index[url]["size"]
+            self._remove(url)
+
+    def _remove(self, url: str) -> None:
+        """Deletes a page and its index entry"""
+        entry = self._index.pop(url)
+        self._changed.discard(url)
+        self._removed.add(url)
+        try:
+            (self.directory / entry["file"]).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _load_index(self) -> dict:
+        """Reads the index left by an earlier run, starting empty if it is unreadable"""
+        try:
+            return json.loads(self._index_path.read_text(encoding="utf_8"))
+        except (OSError, ValueError):
+            return {}
+
+    @contextmanager
+    def _index_locked(self):
+        """Holds the lock other processes sharing the directory take to rewrite the index"""
+        with open(self._lock_path, "a", encoding="utf_8") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save_index(self) -> None:
+        """Merges this cache's changes into the index on disk, which other
+        processes may have changed since, evicts down to the bounds and
+        atomically rewrites the file"""
+        with self._index_locked():
+            index = self._load_index()
+            for url in self._removed:
+                index.pop(url, None)
+            for url in self._changed:
+                index[url] = self._index[url]
+            self._index = index
+            self._evict()
+
+            temporary = self._index_path.with_suffix(f".{os.getpid()}.tmp")
+            temporary.write_text(json.dumps(self._index), encoding="utf_8")
+            os.replace(temporary, self._index_path)
+
+        self._changed.clear()
+        self._removed.clear()
@@ -0,0 +1,11 @@
+"""Backfills or repairs the score counters stored on each story"""
+from dotenv import load_dotenv
+from stories_functions import get_db_connection, reconcile_story_scores
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    connection = get_db_connection()
+    corrected = reconcile_story_scores(connection)
+    connection.close()
+    print(f"Corrected score counters on {corrected} stories")
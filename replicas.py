@@ -0,0 +1,139 @@
+"""Routing of story reads to read replicas, shared by the sync and async apps.
+
+Reads of stories go to the replicas listed in DATABASE_REPLICA_DSNS in turn,
+while writes stay on the primary. A replica is skipped for
+REPLICA_RETRY_AFTER seconds after it fails, and while it is more than
+REPLICA_MAX_LAG seconds behind the primary. After a client writes it is sent
+a cookie that keeps its reads on the primary for REPLICA_STICKY_SECONDS, so
+it always reads its own writes. With no replicas every read uses the primary.
+"""
+import itertools
+import math
+import threading
+import time
+from os import environ
+
+STICKY_COOKIE = "read_primary_until"
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+LAG_QUERY = """SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END;"""
+
+
+def replica_dsns() -> list[str]:
+    """Connection strings of the read replicas, comma separated in DATABASE_REPLICA_DSNS"""
+    return [dsn.strip() for dsn in environ.get("DATABASE_REPLICA_DSNS", "").split(",")
+            if dsn.strip()]
+
+
+def max_lag() -> float:
+    """Seconds a replica may be behind the primary and still serve reads"""
+    return float(environ.get("REPLICA_MAX_LAG", 5))
+
+
+def sticky_seconds() -> float:
+    """Seconds a client's reads stay on the primary after it writes"""
+    return float(environ.get("REPLICA_STICKY_SECONDS", 5))
+
+
+def reads_pinned_to_primary(cookies) -> bool:
+    """Whether a client wrote recently enough that it must read from the primary"""
+    try:
+        return float(cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def stick_to_primary(response, method: str):
+    """After request hook: sends a client that has just written the cookie
+    keeping its reads on the primary. Does nothing without replicas"""
+    if replica_dsns() and method not in READ_METHODS and response.status_code < 400:
+        seconds = sticky_seconds()
+        response.set_cookie(STICKY_COOKIE, f"{time.time() + seconds:.3f}",
+                            max_age=math.ceil(seconds), httponly=True, samesite="Lax")
+    return response
+
+
+class ReplicaHealth:
+    """Which replicas can take reads: not recently failed, and with a recent
+    lag measurement within max_lag. Replicas are offered in turn"""
+
+    def __init__(self, count: int, max_lag: float = 5.0, retry_after: float = 10.0,
+                 check_interval: float = 1.0):
+        self.count = count
+        self.max_lag = max_lag
+        self.retry_after = retry_after
+        self.check_interval = check_interval
+
+        self._turn = itertools.count()
+        self._down_until = [0.0] * count
+        self._lag = [None] * count
+        self._checked_at = [-math.inf] * count
+        self._lock = threading.Lock()
+        self._counters = {"replica_reads": 0, "primary_reads": 0, "failures": 0, "lagging": 0}
+
+    def candidates(self) -> list[int]:
+        """Replicas to try for the next read, starting from the next in turn"""
+        now = time.monotonic()
+        with self._lock:
+            start = next(self._turn)
+            order = [(start + offset) % self.count for offset in range(self.count)]
+            return [index for index in order if self._down_until[index] <= now]
+
+    def lag_due(self, index: int) -> bool:
+        """Whether a replica's lag should be measured before it is used"""
+        with self._lock:
+            return time.monotonic() - self._checked_at[index] >= self.check_interval
+
+    def record_lag(self, index: int, lag: float) -> None:
+        """Stores a lag measurement, None meaning the lag could not be worked out"""
+        with self._lock:
+            self._lag[index] = lag
+            self._checked_at[index] = time.monotonic()
+
+    def within_lag(self, index: int) -> bool:
+        """Whether a replica's last measured lag allows it to serve reads"""
+        with self._lock:
+            lag = self._lag[index]
+            if lag is not None and lag <= self.max_lag:
+                return True
+            self._counters["lagging"] += 1
+            return False
+
+    def mark_down(self, index: int) -> None:
+        """Takes a replica out of use for retry_after seconds after it fails"""
+        with self._lock:
+            self._down_until[index] = time.monotonic() + self.retry_after
+            self._checked_at[index] = -math.inf
+            self._counters["failures"] += 1
+
+    def record_read(self, from_replica: bool) -> None:
+        """Counts where a request's reads were served from"""
+        with self._lock:
+            self._counters["replica_reads" if from_replica else "primary_reads"] += 1
+
+    def stats(self) -> dict:
+        """Returns each replica's state and the routing counters for monitoring"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "replicas": [{
+                    "up": self._down_until[index] <= now,
+                    "lag_seconds": self._lag[index]
+                } for index in range(self.count)],
+                "max_lag": self.max_lag,
+                **self._counters
+            }
+
+
+def make_replica_health(count: int) -> ReplicaHealth:
+    """Replica health tracking configured from the environment"""
+    return ReplicaHealth(
+        count,
+        max_lag=max_lag(),
+        retry_after=float(environ.get("REPLICA_RETRY_AFTER", 10)),
+        check_interval=float(environ.get("REPLICA_LAG_CHECK_INTERVAL", 1))
+    )
@@ -0,0 +1,158 @@
+"""Cache of serialized GET /stories responses, invalidated by a version counter.
+
+Every write to stories or votes bumps the version. Cache keys include the
+version, so entries written before a change are never served again and
+simply age out of the LRU. By default the version lives in this process;
+setting RESPONSE_CACHE_VERSION_FILE shares it between processes on one
+host through the modification time of that file.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+class LocalVersion:
+    """Version counter held in this process"""
+
+    def __init__(self):
+        self._version = 0
+        self._bumped_at = None
+        self._lock = threading.Lock()
+
+    def current(self) -> int:
+        """Returns the current version"""
+        return self._version
+
+    def age(self) -> float:
+        """Seconds since the version last moved"""
+        if self._bumped_at is None:
+            return float("inf")
+        return time.monotonic() - self._bumped_at
+
+    def bump(self) -> None:
+        """Moves to a new version, invalidating cached responses"""
+        with self._lock:
+            self._version += 1
+            self._bumped_at = time.monotonic()
+
+
+class FileVersion:
+    """Version counter shared between processes as the mtime of a file"""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.touch()
+
+    def current(self) -> int:
+        """Returns the current version"""
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def age(self) -> float:
+        """Seconds since the version last moved"""
+        return time.time() - self.current() / 1e9
+
+    def bump(self) -> None:
+        """Moves to a new version, invalidating cached responses in every process"""
+        now = time.time_ns()
+        previous = self.current()
+        os.utime(self.path, ns=(now, max(now, previous + 1)))
+
+
+def make_etag(body: bytes) -> str:
+    """Strong entity tag for a response body"""
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+class ResponseCache:
+    """Bounded LRU of serialized responses keyed by request parameters and version"""
+
+    def __init__(self, max_entries: int = 256, version=None):
+        self.max_entries = max_entries
+        self.version = version or LocalVersion()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, *parts) -> tuple:
+        """Cache key for a request, tied to the current version"""
+        return (self.version.current(), *parts)
+
+    def get(self, key: tuple) -> tuple:
+        """Returns (body, etag) for a key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, body: bytes) -> str:
+        """Stores a response body and returns its etag"""
+        etag = make_etag(body)
+        if self.max_entries <= 0:
+            return etag
+
+        with self._lock:
+            self._entries[key] = (body, etag)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return etag
+
+    def changed_within(self, seconds: float) -> bool:
+        """Whether the version moved less than seconds ago"""
+        return self.version.age() < seconds
+
+    def invalidate(self) -> None:
+        """Bumps the version so every cached response is stale"""
+        self.version.bump()
+
+    def clear(self) -> None:
+        """Drops every cached response"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Returns the entry count and hit/miss counters"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "version": self.version.current()
+            }
+
+
+_stories_cache = None
+_stories_cache_lock = threading.Lock()
+
+
+def get_stories_cache() -> ResponseCache:
+    """Returns the process-wide GET /stories cache, configured from the environment"""
+    global _stories_cache
+
+    with _stories_cache_lock:
+        if _stories_cache is None:
+            version_file = os.environ.get("RESPONSE_CACHE_VERSION_FILE")
+            _stories_cache = ResponseCache(
+                max_entries=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 256)),
+                version=FileVersion(version_file) if version_file else None
+            )
+        return _stories_cache
+
+
+def invalidate_stories() -> None:
+    """Called after any write that changes what GET /stories returns"""
+    get_stories_cache().invalidate()
@@ -0,0 +1,282 @@
+"""Background scrape jobs, queued in the database and run by a pool of worker threads"""
+import threading
+import time
+from os import environ
+import psycopg2
+from psycopg2 import extensions, extras
+from dotenv import load_dotenv
+
+from db_pool import get_pool, PoolTimeoutError
+from fetcher import Fetcher
+from news_scaper import parse_stories_bs, default_backend
+from page_cache import PageCache
+from ingest import ingest_stories
+from metrics import timed_phase, timed_query
+
+
+@timed_query
+def enqueue_scrape_job(connection: extensions.connection, urls: list[str]) -> int:
+    """Queues a job to scrape the given urls and returns its id"""
+    cursor = connection.cursor(cursor_factory = extras.RealDictCursor)
+
+    query = """INSERT INTO scrape_jobs (urls, status, created_at)
+            VALUES (%s, 'queued', current_timestamp) RETURNING id;"""
+    cursor.execute(query, (urls, ))
+    job_id = cursor.fetchone()["id"]
+
+    connection.commit()
+    cursor.close()
+
+    return job_id
+
+
+@timed_query
+def claim_scrape_job(connection: extensions.connection, stale_after: float,
+                     max_attempts: int = 3) -> dict:
+    """Marks the oldest queued job as running and returns it, skipping jobs
+    other workers hold. Jobs left running past stale_after seconds are retried,
+    until they have been tried max_attempts times and are marked failed"""
+    cursor = connection.cursor(cursor_factory = extras.RealDictCursor)
+
+    query = """WITH abandoned AS (
+                UPDATE scrape_jobs
+                SET status = 'failed', finished_at = current_timestamp,
+                error = 'Gave up after ' || attempts || ' attempts that did not finish'
+                WHERE status = 'running' AND attempts >= %(max_attempts)s
+                AND started_at < current_timestamp - %(stale_after)s * interval '1 second')
+            UPDATE scrape_jobs
+            SET status = 'running', started_at = current_timestamp, attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM scrape_jobs
+                WHERE status = 'queued'
+                OR (status = 'running' AND attempts < %(max_attempts)s
+                    AND started_at < current_timestamp - %(stale_after)s * interval '1 second')
+                ORDER BY id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1)
+            RETURNING *;"""
+    cursor.execute(query, {"stale_after": stale_after, "max_attempts": max_attempts})
+    job = cursor.fetchone()
+
+    connection.commit()
+    cursor.close()
+
+    return job
+
+
+@timed_query
+def finish_scrape_job(connection: extensions.connection, job_id: int, results: dict) -> None:
+    """Records the outcome, counts and phase timings of a job"""
+    cursor = connection.cursor(cursor_factory = extras.RealDictCursor)
+
+    query = """UPDATE scrape_jobs
+            SET status = %(status)s, stories_found = %(stories_found)s,
+            stories_added = %(stories_added)s, stories_updated = %(stories_updated)s,
+            stories_skipped = %(stories_skipped)s, stories_merged = %(stories_merged)s,
+            urls_failed = %(urls_failed)s,
+            urls_unchanged = %(urls_unchanged)s,
+            fetch_ms = %(fetch_ms)s, parse_ms = %(parse_ms)s, insert_ms = %(insert_ms)s,
+            error = %(error)s, finished_at = current_timestamp
+            WHERE id = %(job_id)s;"""
+    cursor.execute(query, {**results, "job_id": job_id})
+
+    connection.commit()
+    cursor.close()
+
+
+@timed_query
+def find_scrape_job(connection: extensions.connection, job_id: int) -> dict:
+    """Finds a scrape job with a specific id"""
+    cursor = connection.cursor(cursor_factory = extras.RealDictCursor)
+    cursor.execute("SELECT * FROM scrape_jobs WHERE id = %s;", (job_id, ))
+    row = cursor.fetchone()
+    cursor.close()
+    return row
+
+
+def run_scrape_job(connection: extensions.connection, job: dict, fetcher: Fetcher) -> dict:
+    """Fetches every url in a job concurrently, parsing and upserting each page's
+    stories as it arrives and timing each phase. Pages the cache shows are
+    unchanged skip parsing and ingest, and a changed page is only committed to
+    the cache once its stories are stored. Urls that fail are counted rather
+    than ending the job"""
+    results = {
+        "stories_found": 0,
+        "stories_added": 0,
+        "stories_updated": 0,
+        "stories_skipped": 0,
+        "stories_merged": 0,
+        "urls_failed": 0,
+        "urls_unchanged": 0,
+        "fetch_ms": 0.0,
+        "parse_ms": 0.0,
+        "insert_ms": 0.0,
+        "error": None
+    }
+    failures = {}
+
+    start = time.perf_counter()
+    for url, html in fetcher.fetch_all(job["urls"], failures):
+        results["fetch_ms"] += (time.perf_counter() - start) * 1000
+
+        if html is None:
+            results["urls_unchanged"] += 1
+            start = time.perf_counter()
+            continue
+
+        start = time.perf_counter()
+        stories = parse_stories_bs(url, html)
+        results["parse_ms"] += (time.perf_counter() - start) * 1000
+        results["stories_found"] += len(stories)
+
+        start = time.perf_counter()
+        with timed_phase("insert"):
+            counts = ingest_stories(connection, stories)
+        if fetcher.cache:
+            fetcher.cache.commit(url)
+        results["stories_added"] += counts["inserted"]
+        results["stories_updated"] += counts["updated"]
+        results["stories_skipped"] += counts["skipped"]
+        results["stories_merged"] += counts["merged"]
+        results["insert_ms"] += (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+    results["fetch_ms"] += (time.perf_counter() - start) * 1000
+
+    results["urls_failed"] = len(failures)
+    if failures:
+        results["error"] = "; ".join(str(err) for err in failures.values())
+
+    failed_every_url = len(failures) == len(set(job["urls"]))
+    results["status"] = "failed" if failed_every_url else "done"
+
+    return results
+
+
+class ScrapeWorkerPool:
+    """Bounded set of threads that claim and run queued scrape jobs"""
+
+    def __init__(self, connection_pool, workers: int = 2,
+                 poll_interval: float = 2.0, stale_after: float = 600.0, fetcher: Fetcher = None,
+                 max_attempts: int = 3):
+        self.connection_pool = connection_pool
+        self.fetcher = fetcher or Fetcher()
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+
+        self._threads = []
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Starts the worker threads if they are not already running"""
+        with self._lock:
+            if self._threads:
+                return
+
+            self._stopping.clear()
+            for number in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work, name=f"scrape-worker-{number}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Asks every worker to finish its current job and exit"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+
+        self._stopping.set()
+        self._wake.set()
+        for thread in threads:
+            thread.join()
+        self.fetcher.close()
+
+    def notify(self) -> None:
+        """Wakes idle workers so a newly queued job starts straight away"""
+        self._wake.set()
+
+    def _work(self) -> None:
+        """Claims and runs jobs until the pool is stopped"""
+        while not self._stopping.is_set():
+            try:
+                ran_job = self._run_next_job()
+            except (psycopg2.Error, PoolTimeoutError) as err:
+                print("Error running scrape job.", err)
+                ran_job = False
+
+            if not ran_job:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _run_next_job(self) -> bool:
+        """Runs one queued job, returning False if the queue was empty"""
+        connection = self.connection_pool.checkout()
+        try:
+            job = claim_scrape_job(connection, self.stale_after, self.max_attempts)
+            if job is None:
+                return False
+
+            try:
+                results = run_scrape_job(connection, job, self.fetcher)
+            except Exception as err:  # pylint: disable=broad-except
+                connection.rollback()
+                results = {
+                    "status": "failed", "stories_found": 0, "stories_added": 0,
+                    "stories_updated": 0, "stories_skipped": 0, "stories_merged": 0,
+                    "urls_failed": 0,
+                    "urls_unchanged": 0, "fetch_ms": None, "parse_ms": None,
+                    "insert_ms": None, "error": str(err)
+                }
+
+            finish_scrape_job(connection, job["id"], results)
+            return True
+        finally:
+            self.connection_pool.checkin(connection)
+
+
+_workers = None
+_workers_lock = threading.Lock()
+
+
+def get_scrape_workers() -> ScrapeWorkerPool:
+    """Returns the process-wide scrape worker pool, configured from the environment"""
+    global _workers
+
+    with _workers_lock:
+        if _workers is None:
+            default_backend()  # a misspelt PARSER_BACKEND fails here, not on the first job
+            _workers = ScrapeWorkerPool(
+                get_pool(),
+                workers=int(environ.get("SCRAPE_WORKERS", 2)),
+                poll_interval=float(environ.get("SCRAPE_POLL_INTERVAL", 2)),
+                stale_after=float(environ.get("SCRAPE_JOB_TIMEOUT", 600)),
+                max_attempts=int(environ.get("SCRAPE_JOB_MAX_ATTEMPTS", 3)),
+                fetcher=Fetcher(
+                    per_host=int(environ.get("FETCH_PER_HOST", 4)),
+                    timeout=float(environ.get("FETCH_TIMEOUT", 10)),
+                    deadline=float(environ.get("FETCH_DEADLINE", 60)),
+                    cache=PageCache(
+                        environ.get("PAGE_CACHE_DIR", ".page_cache"),
+                        max_entries=int(environ.get("PAGE_CACHE_MAX_ENTRIES", 500)),
+                        max_bytes=int(environ.get("PAGE_CACHE_MAX_BYTES", 50_000_000)),
+                        ttl=float(environ.get("PAGE_CACHE_TTL", 86400))
+                    )
+                )
+            )
+        return _workers
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    scrape_workers = get_scrape_workers()
+    scrape_workers.start()
+    print(f"Running {scrape_workers.workers} scrape workers, press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        scrape_workers.stop()
@@ -1,6 +1,47 @@
 DROP DATABASE IF EXISTS news;
 CREATE DATABASE news;
 
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE OR REPLACE FUNCTION trending_rank(score INT, created_at TIMESTAMP,
+                                         gravity FLOAT8, age_offset FLOAT8)
+RETURNS FLOAT8 AS $$
+    SELECT GREATEST(score, 0) / POWER(
+        GREATEST(EXTRACT(EPOCH FROM LOCALTIMESTAMP - created_at) / 3600, 0) + age_offset,
+        gravity)
+$$ LANGUAGE SQL STABLE;
+
+CREATE OR REPLACE FUNCTION title_distance(first BIGINT, second BIGINT)
+RETURNS INT AS $$
+    SELECT length(replace((first # second)::bit(64)::text, '0', ''))
+$$ LANGUAGE SQL IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION notify_story_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('story_changes', json_build_object(
+            'event', 'deleted', 'id', OLD.id)::text);
+    ELSIF TG_OP = 'INSERT' THEN
+        PERFORM pg_notify('story_changes', json_build_object(
+            'event', 'added', 'id', NEW.id, 'title', NEW.title, 'url', NEW.url,
+            'score', NEW.score, 'created_at', NEW.created_at)::text);
+    ELSE
+        IF NEW.title IS DISTINCT FROM OLD.title OR NEW.url IS DISTINCT FROM OLD.url THEN
+            PERFORM pg_notify('story_changes', json_build_object(
+                'event', 'edited', 'id', NEW.id, 'title', NEW.title, 'url', NEW.url)::text);
+        END IF;
+        IF NEW.score IS DISTINCT FROM OLD.score THEN
+            PERFORM pg_notify('story_changes', json_build_object(
+                'event', 'score', 'id', NEW.id, 'score', NEW.score,
+                'upvotes', NEW.upvotes, 'downvotes', NEW.downvotes)::text);
+        END IF;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TABLE IF EXISTS scrape_jobs;
+DROP TABLE IF EXISTS vote_rollups;
 DROP TABLE IF EXISTS votes;
 DROP TABLE IF EXISTS stories;
 
@@ -8,17 +49,80 @@ CREATE TABLE stories (
   id SERIAL PRIMARY KEY,
   title TEXT NOT NULL,
   url TEXT NOT NULL,
+  canonical_url TEXT UNIQUE,
   created_at timestamp NOT NULL,
-  updated_at timestamp NOT NULL
+  updated_at timestamp NOT NULL,
+  score INT NOT NULL DEFAULT 0,
+  upvotes INT NOT NULL DEFAULT 0,
+  downvotes INT NOT NULL DEFAULT 0,
+  trending_score FLOAT8 NOT NULL DEFAULT 0,
+  title_fingerprint BIGINT,
+  title_bands INT[] NOT NULL DEFAULT '{}'
 );
 
 
 CREATE TABLE votes (
-     id serial PRIMARY KEY,
+     id serial,
      direction TEXT NOT NULL,
      created_at timestamp NOT NULL,
      updated_at timestamp NOT NULL,
-     story_id INT
-  );
+     story_id INT,
+     PRIMARY KEY (id, created_at)
+  ) PARTITION BY RANGE (created_at);
+
+CREATE TABLE votes_default PARTITION OF votes DEFAULT;
+
+ALTER TABLE votes ADD CONSTRAINT story_fk FOREIGN KEY(story_id) REFERENCES stories(id)
+  ON DELETE CASCADE;
+
+CREATE TABLE vote_rollups (
+  story_id INT NOT NULL REFERENCES stories(id) ON DELETE CASCADE,
+  period DATE NOT NULL,
+  upvotes INT NOT NULL DEFAULT 0,
+  downvotes INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (story_id, period)
+);
+
+CREATE INDEX stories_title_search_idx ON stories USING GIN (to_tsvector('english', title));
+CREATE INDEX stories_title_trigram_idx ON stories USING GIN (LOWER(title) gin_trgm_ops);
+
+CREATE INDEX stories_title_sort_idx ON stories (INITCAP(title), id);
+CREATE INDEX stories_score_sort_idx ON stories (score, id);
+CREATE INDEX stories_created_at_sort_idx ON stories (created_at, id);
+CREATE INDEX stories_updated_at_sort_idx ON stories (updated_at, id);
+CREATE INDEX stories_trending_sort_idx ON stories (trending_score, id);
+CREATE INDEX stories_title_bands_idx ON stories USING GIN (title_bands);
+CREATE INDEX votes_story_id_idx ON votes (story_id);
+
+CREATE TRIGGER stories_notify_added_deleted AFTER INSERT OR DELETE ON stories
+    FOR EACH ROW EXECUTE FUNCTION notify_story_change();
+
+CREATE TRIGGER stories_notify_changed AFTER UPDATE OF title, url, score ON stories
+    FOR EACH ROW
+    WHEN (NEW.title IS DISTINCT FROM OLD.title OR NEW.url IS DISTINCT FROM OLD.url
+          OR NEW.score IS DISTINCT FROM OLD.score)
+    EXECUTE FUNCTION notify_story_change();
+
+
+CREATE TABLE scrape_jobs (
+  id SERIAL PRIMARY KEY,
+  urls TEXT[] NOT NULL,
+  status TEXT NOT NULL,
+  attempts INT NOT NULL DEFAULT 0,
+  stories_found INT NOT NULL DEFAULT 0,
+  stories_added INT NOT NULL DEFAULT 0,
+  stories_updated INT NOT NULL DEFAULT 0,
+  stories_skipped INT NOT NULL DEFAULT 0,
+  stories_merged INT NOT NULL DEFAULT 0,
+  urls_failed INT NOT NULL DEFAULT 0,
+  urls_unchanged INT NOT NULL DEFAULT 0,
+  fetch_ms FLOAT,
+  parse_ms FLOAT,
+  insert_ms FLOAT,
+  error TEXT,
+  created_at timestamp NOT NULL,
+  started_at timestamp,
+  finished_at timestamp
+);
 
-ALTER TABLE votes ADD CONSTRAINT story_fk FOREIGN KEY(story_id) REFERENCES stories(id);
+CREATE INDEX scrape_jobs_pending_idx ON scrape_jobs (id) WHERE status IN ('queued', 'running');
@@ -60,17 +60,34 @@ async function handleEdit(id, url, title) {
     alert(data.message)
   }
 
-  getStories()
+  if (!liveUpdates) {
+    getStories()
+  }
 }
 
-async function getStories() {
+const PAGE_SIZE = 20
+const SEARCH_DELAY_MS = 250
+let nextCursor = null
+let liveUpdates = false
+
+function getStoriesUrl() {
   const searchTerm = document.getElementById('search_input').value
   const sort = document.getElementById('sort').value
   const order = document.getElementById('order').value
-  let url = `${getUrl()}/stories?sort=${sort}&order=${order}`
+  let url = `${getUrl()}/stories?sort=${sort}&order=${order}&limit=${PAGE_SIZE}`
 
   if (searchTerm) {
-    url += `&search=${searchTerm}`
+    url += `&search=${encodeURIComponent(searchTerm)}&prefix=true`
+  }
+
+  return url
+}
+
+async function fetchStoriesPage(cursor) {
+  let url = getStoriesUrl()
+
+  if (cursor) {
+    url += `&cursor=${encodeURIComponent(cursor)}`
   }
 
   console.log(`Stories Requested From: ${url}`)
@@ -91,10 +108,43 @@ async function getStories() {
 
   if (data.error || data.message) {
     alert(data.message)
+    return null
   }
 
+  return data
+}
+
+function updateLoadMore() {
+  const loadMore = document.getElementById('load_more')
+  loadMore.hidden = !nextCursor
+}
+
+async function getStories() {
+  const data = await fetchStoriesPage(null)
+
   resetStories()
-  displayStories(data)
+
+  if (data) {
+    nextCursor = data.next_cursor
+    displayStories(data.stories)
+  }
+
+  updateLoadMore()
+}
+
+async function loadMoreStories() {
+  if (!nextCursor) {
+    return
+  }
+
+  const data = await fetchStoriesPage(nextCursor)
+
+  if (data) {
+    nextCursor = data.next_cursor
+    displayStories(data.stories)
+  }
+
+  updateLoadMore()
 }
 
 function onError(response) {
@@ -115,7 +165,7 @@ async function handleVote(e) {
     credentials: 'include'
   })
 
-  if (rawRes.status !== 200) {
+  if (!rawRes.ok) {
     onError(rawRes)
   }
 
@@ -125,7 +175,9 @@ async function handleVote(e) {
     alert(data.message)
   }
 
-  getStories()
+  if (!liveUpdates) {
+    getStories()
+  }
 }
 
 async function handleDelete(e) {
@@ -153,7 +205,9 @@ async function handleDelete(e) {
     alert(data.message)
   }
 
-  getStories()
+  if (!liveUpdates) {
+    getStories()
+  }
 }
 
 function getContentComponent(story) {
@@ -164,6 +218,7 @@ function getContentComponent(story) {
   link.innerText = story.title
 
   const score = document.createElement('span')
+  score.className = 'score'
   score.innerText = `(${story.score} points)`
 
   contentWrapper.append(link, score)
@@ -178,7 +233,7 @@ function getVotesComponent(story) {
   const downvoteButton = createVoteButton(`${story.id}-down`, '⬇')
   const deleteButton = createDeleteButton(`${story.id}-delete`, '❌')
   const editButton = createEditButton(
-    `${story.id}-delete`,
+    `${story.id}-edit`,
     story.url,
     story.title
   )
@@ -187,16 +242,97 @@ function getVotesComponent(story) {
   return voteWrapper
 }
 
-function createStory(story) {
-  const stories = document.getElementById('stories')
+function createStoryElement(story) {
   const storyWrapper = document.createElement('div')
   storyWrapper.classList = 'storyWrapper'
+  storyWrapper.dataset.id = story.id
+  storyWrapper.dataset.score = story.score
 
   const contentWrapper = getContentComponent(story)
   const voteWrapper = getVotesComponent(story)
 
   storyWrapper.append(voteWrapper, contentWrapper)
-  stories.append(storyWrapper)
+  return storyWrapper
+}
+
+function createStory(story) {
+  const stories = document.getElementById('stories')
+  stories.append(createStoryElement(story))
+}
+
+function findStoryElement(id) {
+  return document.querySelector(`#stories [data-id="${id}"]`)
+}
+
+function showsNewestFirst() {
+  const searchTerm = document.getElementById('search_input').value
+  const sort = document.getElementById('sort').value
+  const order = document.getElementById('order').value
+  return !searchTerm && sort === 'created' && order === 'descending'
+}
+
+function onStoryAdded(story) {
+  // Only shown straight away where it belongs at the top; otherwise it
+  // appears in its place the next time the stories are loaded
+  if (showsNewestFirst() && !findStoryElement(story.id)) {
+    document.getElementById('stories').prepend(createStoryElement(story))
+  }
+}
+
+function onStoryEdited(story) {
+  const element = findStoryElement(story.id)
+  if (element) {
+    element.replaceWith(
+      createStoryElement({ ...story, score: element.dataset.score })
+    )
+  }
+}
+
+function onScoreChanged(story) {
+  const element = findStoryElement(story.id)
+  if (element) {
+    element.dataset.score = story.score
+    element.querySelector('.score').innerText = `(${story.score} points)`
+  }
+}
+
+function onStoryDeleted(story) {
+  const element = findStoryElement(story.id)
+  if (element) {
+    element.remove()
+  }
+}
+
+function followStoryChanges() {
+  if (!window.EventSource) {
+    return
+  }
+
+  const source = new EventSource(`${getUrl()}/stories/stream`)
+  const handlers = {
+    added: onStoryAdded,
+    edited: onStoryEdited,
+    score: onScoreChanged,
+    deleted: onStoryDeleted
+  }
+  let connectedBefore = false
+
+  Object.entries(handlers).forEach(([event, handler]) => {
+    source.addEventListener(event, (e) => handler(JSON.parse(e.data)))
+  })
+  source.addEventListener('reset', () => getStories())
+
+  source.onopen = () => {
+    // Changes made while reconnecting were missed, so reload once
+    if (connectedBefore) {
+      getStories()
+    }
+    connectedBefore = true
+    liveUpdates = true
+  }
+  source.onerror = () => {
+    liveUpdates = false
+  }
 }
 
 function displayStories(stories) {
@@ -218,13 +354,52 @@ function setupSelects() {
 function setupSearch() {
   const search = document.getElementById('search')
 
+  const searchInput = document.getElementById('search_input')
+  let typingTimer = null
+
   search.onclick = () => {
     getStories()
   }
+
+  searchInput.oninput = () => {
+    clearTimeout(typingTimer)
+    typingTimer = setTimeout(getStories, SEARCH_DELAY_MS)
+  }
+}
+
+function setupLoadMore() {
+  const loadMore = document.getElementById('load_more')
+
+  loadMore.onclick = () => {
+    loadMoreStories()
+  }
+}
+
+function showFirstPage() {
+  // The server sends the first page of the default listing inside the page
+  const firstPage = document.getElementById('first_page')
+  const sort = document.getElementById('sort').value
+  const order = document.getElementById('order').value
+  const searchTerm = document.getElementById('search_input').value
+
+  if (!firstPage || sort !== 'title' || order !== 'ascending' || searchTerm) {
+    return false
+  }
+
+  const data = JSON.parse(firstPage.textContent)
+  nextCursor = data.next_cursor
+  resetStories()
+  displayStories(data.stories)
+  updateLoadMore()
+  return true
 }
 
 window.onload = async function load() {
-  getStories()
+  if (!showFirstPage()) {
+    getStories()
+  }
   setupSelects()
   setupSearch()
+  setupLoadMore()
+  followStoryChanges()
 }
\ No newline at end of file
@@ -4,6 +4,32 @@ function onError(response) {
   )
 }
 
+const POLL_INTERVAL_MS = 1000
+
+function showStatus(message) {
+  document.getElementById('scrape_status').innerText = message
+}
+
+async function waitForJob(statusUrl) {
+  const response = await fetch(statusUrl)
+
+  if (response.status !== 200) {
+    onError(response)
+    return
+  }
+
+  const job = await response.json()
+
+  if (job.status === 'queued' || job.status === 'running') {
+    showStatus(`Scrape ${job.status}...`)
+    setTimeout(() => waitForJob(statusUrl), POLL_INTERVAL_MS)
+  } else if (job.status === 'failed') {
+    showStatus(`Scrape failed: ${job.error}`)
+  } else {
+    window.location.href = '/'
+  }
+}
+
 window.onload = async function load() {
   const submitComponent = document.getElementById('submit_scrape')
 
@@ -20,7 +46,7 @@ window.onload = async function load() {
       }
     })
 
-    if (response.status !== 200) {
+    if (response.status !== 202) {
       onError(response)
     }
 
@@ -29,7 +55,8 @@ window.onload = async function load() {
     if (data.error) {
       alert(data.message)
     } else {
-      window.location.href = '/'
+      showStatus('Scrape queued...')
+      waitForJob(data.status_url)
     }
   }
 }
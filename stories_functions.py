@@ -1,8 +1,35 @@
 """Functions and database needed for api"""
+import base64
+import json
+import re
+from datetime import date, datetime
 from os import environ
 import psycopg2
 from psycopg2 import extensions, extras
 
+from ingest import canonicalize_url, title_fingerprint, fingerprint_bands
+from story_batch import create_statement, edit_statement, vote_statement, vote_tallies
+from metrics import InstrumentedConnection, timed_query
+from story_records import RecordCursor
+from response_cache import invalidate_stories
+from replicas import LAG_QUERY
+
+PAGE_SORT_KEYS = {
+    "title": "INITCAP(title)",
+    "score": "score",
+    "created": "created_at",
+    "modified": "updated_at",
+    "trending": "trending_score",
+    "id": "id"
+}
+# what a story is returned as; canonical_url, title_fingerprint, title_bands and
+# trending_score are kept for deduplication and ranking, not for clients
+STORY_COLUMNS = ("stories.id, stories.title, stories.url, stories.created_at, "
+                 "stories.updated_at, stories.score, stories.upvotes, stories.downvotes")
+STREAM_BATCH_SIZE = 500
+VOTE_RAW_MONTHS = 3
+VOTE_PARTITIONS_AHEAD = 2
+VOTE_PARTITION_PATTERN = re.compile(r"votes_\d{4}_\d{2}")
 
 
 def get_db_connection() -> extensions.connection:
@@ -13,139 +40,440 @@ def get_db_connection() -> extensions.connection:
             password=environ["DATABASE_PASSWORD"],
             host=environ["DATABASE_IP"],
             port=environ["DATABASE_PORT"],
-            database=environ["DATABASE_NAME"]
+            database=environ["DATABASE_NAME"],
+            connection_factory=InstrumentedConnection
             )
     except (psycopg2.OperationalError, psycopg2.DatabaseError) as err:
         print("Error connecting to database.", err)
 
 
+def get_replica_connection(dsn: str) -> extensions.connection:
+    """Gets connection to a read replica from its connection string"""
+    try:
+        return psycopg2.connect(dsn, connection_factory=InstrumentedConnection)
+    except (psycopg2.OperationalError, psycopg2.DatabaseError) as err:
+        print("Error connecting to replica.", err)
+
+
+@timed_query
+def replica_lag(connection: extensions.connection) -> float:
+    """Seconds a replica's data is behind the primary, 0 when it is up to date
+    or is not a replica, or None if it cannot be told"""
+    cursor = connection.cursor()
+    cursor.execute(LAG_QUERY)
+    [lag] = cursor.fetchone()
+    connection.rollback()
+    cursor.close()
+    return None if lag is None else float(lag)
+
+
+def trending_settings() -> dict:
+    """Decay parameters for the trending rank, score / (age in hours + age_offset) ^ gravity"""
+    return {
+        "gravity": float(environ.get("TRENDING_GRAVITY", 1.8)),
+        "age_offset": float(environ.get("TRENDING_AGE_OFFSET", 2))
+    }
+
+
+def resolve_order(sort_type: str, order: str) -> str:
+    """'ascending' or 'descending'. Without an order, trending lists the
+    highest ranked first and every other sort is ascending"""
+    if order is None:
+        return "descending" if sort_type == "trending" else "ascending"
+    return "ascending" if order == "ascending" else "descending"
+
+
+@timed_query
 def load_all_stories(connection: extensions.connection) -> list[dict[str]]:
-    """Returns all the story data from the database"""
-    cursor = connection.cursor(cursor_factory = extras.RealDictCursor)
+    """Returns all the story data from the database, as StoryRecords"""
+    cursor = connection.cursor(cursor_factory = RecordCursor)
 
-    cursor.execute("""SELECT stories.*, SUM(CASE votes.direction WHEN 'up'
-            THEN 1 WHEN 'down' THEN -1 ELSE 0 END) AS score FROM stories
-            LEFT JOIN votes ON stories.id = votes.story_id
-            GROUP BY stories.id;""")
+    cursor.execute(f"SELECT {STORY_COLUMNS} FROM stories;")
     rows = cursor.fetchall()
     cursor.close()
 
-    return [dict(row) for row in rows]
+    return rows
 
 
+@timed_query
 def update_stories(connection: extensions.connection, url: str, title: str, story_id: int):
     """Edits the content of a story"""
     cursor = connection.cursor(cursor_factory = extras.RealDictCursor)
 
     query = """UPDATE stories
-        SET title = %s, url = %s, updated_at = current_timestamp 
+        SET title = %s, url = %s, canonical_url = %s, title_fingerprint = %s,
+        title_bands = %s::int[], updated_at = current_timestamp
         WHERE id = %s;"""
-    params = (title, url, story_id)
+    fingerprint = title_fingerprint(title)
+    params = (title, url, canonicalize_url(url), fingerprint, fingerprint_bands(fingerprint),
+              story_id)
     cursor.execute(query, params)
 
     connection.commit()
+    invalidate_stories()
     cursor.close()
 
 
-def make_new_story(connection: extensions.connection, url: str, title: str):
-    """Creates a new story and adds this to database"""
+@timed_query
+def make_new_story(connection: extensions.connection, url: str, title: str) -> int:
+    """Creates a new story and adds this to database, returning its id, or
+    None if a story with the same canonical url already exists"""
     cursor = connection.cursor(cursor_factory = extras.RealDictCursor)
 
-    query = "INSERT INTO stories (title, url, created_at, updated_at)\
-        VALUES (%s, %s, current_timestamp, current_timestamp);"
-    params = (title, url)
+    query = "INSERT INTO stories (title, url, canonical_url, title_fingerprint, title_bands,\
+        created_at, updated_at)\
+        VALUES (%s, %s, %s, %s, %s::int[], current_timestamp, current_timestamp)\
+        ON CONFLICT (canonical_url) DO NOTHING\
+        RETURNING id;"
+    fingerprint = title_fingerprint(title)
+    params = (title, url, canonicalize_url(url), fingerprint, fingerprint_bands(fingerprint))
     cursor.execute(query, params)
+    row = cursor.fetchone()
 
     connection.commit()
+    invalidate_stories()
     cursor.close()
+    return row["id"] if row else None
 
 
+@timed_query
 def find_story_with_id(connection: extensions.connection, story_id: int) -> list[dict]:
     """Finds a story with specific id"""
     cursor = connection.cursor(cursor_factory = extras.RealDictCursor)
-    cursor.execute("SELECT * FROM stories WHERE id = %s;", (story_id, ))
+    cursor.execute(f"SELECT {STORY_COLUMNS} FROM stories WHERE id = %s;", (story_id, ))
     row = cursor.fetchone()
     cursor.close()
     return row
 
 
-def add_votes(connection: extensions.connection, direction: str, story_id: int) -> None:
-    """Adds a new vote to story, inserting row into votes database"""
+@timed_query
+def add_votes(connection: extensions.connection, direction: str, story_id: int) -> int:
+    """Adds a new vote to story, inserting row into votes database and updating
+    the story's score counters and trending rank in one atomic statement.
+    Downvotes are refused when the score is 0. Returns the new score, or None if no vote was added"""
     cursor = connection.cursor(cursor_factory = extras.RealDictCursor)
-    query = """INSERT INTO votes(direction, created_at, updated_at, story_id)
-            VALUES (%s, current_timestamp, current_timestamp, %s);"""
-    params = (direction, story_id)
+    query = """WITH counted AS (
+            UPDATE stories SET
+            upvotes = upvotes + (%(direction)s = 'up')::int,
+            downvotes = downvotes + (%(direction)s = 'down')::int,
+            score = score + CASE %(direction)s WHEN 'up' THEN 1 ELSE -1 END,
+            trending_score = trending_rank(
+                score + CASE %(direction)s WHEN 'up' THEN 1 ELSE -1 END,
+                created_at, %(gravity)s, %(age_offset)s)
+            WHERE id = %(story_id)s AND (%(direction)s = 'up' OR score > 0)
+            RETURNING id, score)
+            INSERT INTO votes(direction, created_at, updated_at, story_id)
+            SELECT %(direction)s, current_timestamp, current_timestamp, id FROM counted
+            RETURNING (SELECT score FROM counted);"""
+    params = {"direction": direction, "story_id": story_id, **trending_settings()}
     cursor.execute(query, params)
+    row = cursor.fetchone()
 
     connection.commit()
     cursor.close()
 
+    if row is None:
+        return None
 
-def delete_story(connection: extensions.connection, story_id: int):
-    """Deletes a story given an id"""
-    cursor = connection.cursor(cursor_factory = extras.RealDictCursor)
+    invalidate_stories()
+    return row["score"]
 
-    query = """DELETE FROM votes WHERE story_id = %s;
-            DELETE FROM stories WHERE id = %s;"""
-    params = (story_id, story_id)
-    cursor.execute(query, params)
+
+@timed_query
+def add_vote_batch(connection: extensions.connection, tallies: dict[int, list[int]]) -> int:
+    """Applies many buffered votes at once, given {story_id: [upvotes, downvotes]}.
+    Each story's upvotes count first and downvotes that would take its score
+    below 0 are dropped. The decay settings are floats, so they are written
+    into the statement, which execute_values only fills with the rows.
+    Returns the number of votes added"""
+    cursor = connection.cursor()
+    applied = apply_vote_tallies(cursor, tallies)
 
     connection.commit()
     cursor.close()
+    invalidate_stories()
+
+    return sum(ups + downs for ups, downs, _ in applied.values())
+
 
+def apply_vote_tallies(cursor: extensions.cursor, tallies: dict[int, list[int]]) -> dict:
+    """Runs the vote statement for add_vote_batch and apply_story_batch without
+    committing, returning {story_id: (upvotes, downvotes, score)} for the stories found"""
+    if not tallies:
+        return {}
+    settings = trending_settings()
+    query = vote_statement("VALUES %s", repr(settings["gravity"]), repr(settings["age_offset"]))
+    rows = [(story_id, ups, downs) for story_id, (ups, downs) in tallies.items()]
+    applied = extras.execute_values(cursor, query, rows, page_size=len(rows), fetch=True)
+    return {row[0]: tuple(row[1:]) for row in applied}
+
+
+@timed_query
+def apply_story_batch(connection: extensions.connection, plan: dict) -> dict:
+    """Writes a batch checked by story_batch.parse_batch in one transaction,
+    with one statement each for its creates, edits, votes and deletes.
+    Returns what story_batch.report_batch needs. On a database error the
+    transaction is rolled back and the error raised"""
+    cursor = connection.cursor()
+    written = {"created": {}, "edited": {}, "voted": {}, "deleted": set()}
+
+    try:
+        if plan["create"]:
+            rows = extras.execute_values(
+                cursor, create_statement("VALUES %s"),
+                [row[1:] for row in plan["create"]],
+                template="(%s, %s, %s, %s::bigint, %s::int[])",
+                page_size=len(plan["create"]), fetch=True)
+            written["created"] = {canonical_url: story_id for story_id, canonical_url in rows}
+
+        if plan["edit"]:
+            rows = extras.execute_values(
+                cursor, edit_statement("VALUES %s"),
+                [row[1:] for row in plan["edit"]],
+                template="(%s::int, %s, %s, %s, %s::bigint, %s::int[])",
+                page_size=len(plan["edit"]), fetch=True)
+            written["edited"] = {story_id: (found, updated) for story_id, found, updated in rows}
+
+        written["voted"] = apply_vote_tallies(cursor, vote_tallies(plan["vote"]))
+
+        if plan["delete"]:
+            cursor.execute("DELETE FROM stories WHERE id = ANY(%s) RETURNING id;",
+                           ([story_id for _, story_id in plan["delete"]], ))
+            written["deleted"] = {row[0] for row in cursor.fetchall()}
+    except psycopg2.Error:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
 
-def sort_stories(connection: extensions.connection, sort_type: str, order: str) -> list[dict]:
-    """Sorts stories based on input from user and returns it"""
+    connection.commit()
+    invalidate_stories()
+    return written
+
+
+@timed_query
+def delete_story(connection: extensions.connection, story_id: int):
+    """Deletes a story given an id. Its votes and vote rollups go with it,
+    as their foreign keys cascade"""
     cursor = connection.cursor(cursor_factory = extras.RealDictCursor)
-    sort_order = 'ASC' if order in (None, "ascending") else 'DESC'
 
-    if sort_type == "created":
-        sort_type += "_at"
+    cursor.execute("DELETE FROM stories WHERE id = %s;", (story_id, ))
+
+    connection.commit()
+    invalidate_stories()
+    cursor.close()
 
-    if sort_type == "modified":
-        sort_type = "updated_at"
 
-    capitalise = "INITCAP" if sort_type == "title" else ""
+@timed_query
+def sort_stories(connection: extensions.connection, sort_type: str, order: str,
+                 limit: int = None) -> list[dict]:
+    """Sorts stories based on input from user and returns it. Every sort is
+    backed by an index on (sort key, id), so with a limit only that many rows are read"""
+    cursor = connection.cursor(cursor_factory = RecordCursor)
+    sort_order = 'ASC' if resolve_order(sort_type, order) == "ascending" else 'DESC'
+    sort_key = PAGE_SORT_KEYS.get(sort_type, "id")
 
-    cursor.execute(f"""
-                SELECT stories.*, SUM(CASE votes.direction WHEN 'up'
-            THEN 1 WHEN 'down' THEN -1 ELSE 0 END) AS score FROM stories
-            LEFT JOIN votes ON stories.id = votes.story_id
-            GROUP BY stories.id
-            ORDER BY {capitalise}({sort_type}) {sort_order};""")
+    cursor.execute(f"""SELECT {STORY_COLUMNS} FROM stories
+            ORDER BY {sort_key} {sort_order}, id {sort_order}
+            LIMIT %s;""", (limit, ))
 
     rows = cursor.fetchall()
     cursor.close()
 
-    return [dict(row) for row in rows]
+    return rows
 
 
-def find_specific_story(connection: extensions.connection, search: str) -> list[dict]:
-    """Finds specific story based on user search"""
-    cursor = connection.cursor(cursor_factory = extras.RealDictCursor)
+@timed_query
+def stream_stories(connection: extensions.connection, sort_type: str = None, order: str = None,
+                   batch_size: int = STREAM_BATCH_SIZE):
+    """Opens a server-side cursor over every story in the requested sort and
+    returns an iterator of rows. Rows are fetched batch_size at a time, so
+    only one batch is held in memory however many stories there are"""
+    cursor = connection.cursor(name="stream_stories", cursor_factory = RecordCursor)
+    cursor.itersize = batch_size
+    sort_order = 'ASC' if resolve_order(sort_type, order) == "ascending" else 'DESC'
+    sort_key = PAGE_SORT_KEYS.get(sort_type, "id")
+
+    cursor.execute(f"""SELECT {STORY_COLUMNS} FROM stories
+            ORDER BY {sort_key} {sort_order}, id {sort_order};""")
+
+    return iterate_and_close(cursor)
+
+
+def iterate_and_close(cursor: extensions.cursor):
+    """Yields a cursor's rows, closing it when they run out or the caller stops early"""
+    try:
+        yield from cursor
+    finally:
+        cursor.close()
+
+
+def encode_cursor(sort_type: str, order: str, sort_key, story_id: int) -> str:
+    """Packs the position after a story into an opaque cursor token"""
+    if isinstance(sort_key, datetime):
+        sort_key = sort_key.isoformat()
 
-    query = """SELECT stories.*, SUM(CASE votes.direction WHEN 'up'
-            THEN 1 WHEN 'down' THEN -1 ELSE 0 END) AS score 
-            FROM stories LEFT JOIN votes ON stories.id = votes.story_id
-            WHERE LOWER(title) LIKE %s
-            GROUP BY stories.id 
-            ;"""
-    params = (f'%{search.lower()}%',)
+    position = json.dumps([sort_type, order, sort_key, story_id])
+    return base64.urlsafe_b64encode(position.encode("utf_8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Unpacks a cursor token, raising ValueError if it was not made by encode_cursor"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        sort_type, order, sort_key, story_id = position
+    except (ValueError, TypeError, UnicodeError) as err:
+        raise ValueError("Invalid cursor") from err
+
+    if (sort_type not in PAGE_SORT_KEYS or not valid_sort_key(sort_type, sort_key)
+            or not isinstance(story_id, int) or isinstance(story_id, bool)):
+        raise ValueError("Invalid cursor")
+
+    return sort_type, order, sort_key, story_id
+
+
+def valid_sort_key(sort_type: str, sort_key) -> bool:
+    """Whether a cursor's sort key has the type of the column the sort reads,
+    so a forged cursor is refused rather than failing in Postgres"""
+    if sort_type in ("created", "modified"):
+        try:
+            datetime.fromisoformat(sort_key)
+        except (TypeError, ValueError):
+            return False
+        return True
+
+    if isinstance(sort_key, bool):
+        return False
+    if sort_type == "trending":
+        return isinstance(sort_key, (int, float))
+    return isinstance(sort_key, int if sort_type in ("score", "id") else str)
+
+
+@timed_query
+def load_stories_page(connection: extensions.connection, sort_type: str, order: str,
+                      limit: int, cursor: str = None) -> tuple[list[dict], str]:
+    """Loads one page of stories using keyset pagination, returning the
+    stories and a cursor for the next page (None on the last page)"""
+    sort_type = sort_type if sort_type in PAGE_SORT_KEYS else "id"
+    order = resolve_order(sort_type, order)
+    sort_key = PAGE_SORT_KEYS[sort_type]
+    sort_order, seek = ("ASC", ">") if order == "ascending" else ("DESC", "<")
+
+    where = ""
+    params = []
+    if cursor:
+        cursor_sort, cursor_order, last_key, last_id = decode_cursor(cursor)
+        if (cursor_sort, cursor_order) != (sort_type, order):
+            raise ValueError("Cursor does not match the requested sort")
+        where = f"WHERE ({sort_key}, id) {seek} (%s, %s)"
+        params = [last_key, last_id]
+
+    db_cursor = connection.cursor(cursor_factory = extras.RealDictCursor)
+    db_cursor.execute(f"""SELECT {STORY_COLUMNS}, {sort_key} AS sort_key FROM stories
+            {where}
+            ORDER BY {sort_key} {sort_order}, id {sort_order}
+            LIMIT %s;""", (*params, limit + 1))
+    rows = db_cursor.fetchall()
+    db_cursor.close()
+
+    stories = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = stories[-1]
+        next_cursor = encode_cursor(sort_type, order, last["sort_key"], last["id"])
+
+    for story in stories:
+        del story["sort_key"]
+
+    return stories, next_cursor
+
+
+def build_prefix_query(search: str) -> str:
+    """Turns a search into a tsquery where the last word may be unfinished"""
+    words = re.findall(r"\w+", search.lower())
+    if not words:
+        return ""
+
+    return " & ".join(words) + ":*"
+
+
+def encode_search_cursor(search: str, offset: int) -> str:
+    """Packs how far into a search's results the next page starts into a cursor token"""
+    position = json.dumps(["search", search, offset])
+    return base64.urlsafe_b64encode(position.encode("utf_8")).decode("ascii")
+
+
+def decode_search_cursor(cursor: str, search: str) -> int:
+    """The offset in a search cursor, raising ValueError if it was not made by
+    encode_search_cursor for the same search"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        kind, cursor_search, offset = position
+    except (ValueError, TypeError, UnicodeError) as err:
+        raise ValueError("Invalid cursor") from err
+
+    if kind != "search" or not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        raise ValueError("Invalid cursor")
+    if cursor_search != search:
+        raise ValueError("Cursor does not match the requested search")
+
+    return offset
+
+
+def search_stories_page(connection: extensions.connection, search: str, prefix: bool,
+                        limit: int, cursor: str = None) -> tuple[list[dict], str]:
+    """Loads one page of search results, most relevant first, returning the
+    stories and a cursor for the next page (None on the last page). Results are
+    ranked rather than sorted on a column, so pages are read by offset"""
+    offset = decode_search_cursor(cursor, search) if cursor else 0
+    stories = find_specific_story(connection, search, prefix, limit + 1, offset)
+
+    next_cursor = None
+    if len(stories) > limit:
+        stories = stories[:limit]
+        next_cursor = encode_search_cursor(search, offset + limit)
+
+    return stories, next_cursor
+
+
+@timed_query
+def find_specific_story(connection: extensions.connection, search: str,
+                        prefix: bool = False, limit: int = None, offset: int = 0) -> list[dict]:
+    """Finds stories matching a user search, most relevant first.
+    Matches whole words through the full-text index, and substrings or
+    near-miss spellings through the trigram index"""
+    cursor = connection.cursor(cursor_factory = RecordCursor)
+
+    if prefix:
+        terms = "to_tsquery('english', %s)"
+        search_terms = build_prefix_query(search)
+    else:
+        terms = "plainto_tsquery('english', %s)"
+        search_terms = search
+
+    query = f"""SELECT {STORY_COLUMNS} FROM stories, {terms} AS terms
+            WHERE to_tsvector('english', title) @@ terms
+            OR LOWER(title) LIKE %s
+            OR LOWER(title) %% %s
+            ORDER BY ts_rank(to_tsvector('english', title), terms) DESC,
+            similarity(LOWER(title), %s) DESC, id
+            LIMIT %s OFFSET %s;"""
+    params = (search_terms, f'%{search.lower()}%', search.lower(), search.lower(), limit,
+              offset)
     cursor.execute(query, params)
 
     rows = cursor.fetchall()
     cursor.close()
 
-    return [dict(row) for row in rows]
+    return rows
 
 
+@timed_query
 def count_votes(connection: extensions.connection, story_id) -> list[dict]:
     """Counts the votes for a specific story"""
     cursor = connection.cursor(cursor_factory = extras.RealDictCursor)
 
-    query = """SELECT SUM(CASE direction WHEN 'up' THEN 1 ELSE -1 END)
-                AS score
-                FROM votes WHERE story_id = %s;"""
+    query = "SELECT score, upvotes, downvotes FROM stories WHERE id = %s;"
     params = (story_id, )
     cursor.execute(query, params)
 
@@ -153,3 +481,165 @@ def count_votes(connection: extensions.connection, story_id) -> list[dict]:
     cursor.close()
 
     return row
+
+
+@timed_query
+def reconcile_story_scores(connection: extensions.connection) -> int:
+    """Recalculates every story's score counters from the rolled up and
+    raw votes, returning how many stories had counters that were out of date"""
+    cursor = connection.cursor(cursor_factory = extras.RealDictCursor)
+
+    query = """UPDATE stories SET
+            upvotes = tallies.upvotes,
+            downvotes = tallies.downvotes,
+            score = tallies.upvotes - tallies.downvotes
+            FROM (SELECT stories.id,
+                COALESCE(SUM(counted.upvotes), 0) AS upvotes,
+                COALESCE(SUM(counted.downvotes), 0) AS downvotes
+                FROM stories LEFT JOIN (
+                    SELECT story_id, upvotes, downvotes FROM vote_rollups
+                    UNION ALL
+                    SELECT story_id, (direction = 'up')::int, (direction = 'down')::int FROM votes
+                ) AS counted ON stories.id = counted.story_id
+                GROUP BY stories.id) AS tallies
+            WHERE stories.id = tallies.id
+            AND (stories.upvotes, stories.downvotes, stories.score)
+            IS DISTINCT FROM
+            (tallies.upvotes, tallies.downvotes, tallies.upvotes - tallies.downvotes);"""
+    cursor.execute(query)
+    corrected = cursor.rowcount
+
+    connection.commit()
+    invalidate_stories()
+    cursor.close()
+
+    return corrected
+
+
+def vote_partition_name(month: date) -> str:
+    """Name of the votes partition holding a month's votes"""
+    return f"votes_{month:%Y_%m}"
+
+
+@timed_query
+def ensure_vote_partitions(connection: extensions.connection, months_back: int = 0,
+                           months_ahead: int = VOTE_PARTITIONS_AHEAD) -> list[str]:
+    """Creates the monthly votes partitions from months_back months ago to
+    months_ahead months from now, returning the ones it created. A month that
+    already has votes in the default partition is left there"""
+    cursor = connection.cursor()
+    cursor.execute("""SELECT month::date, (month + interval '1 month')::date
+            FROM generate_series(
+                date_trunc('month', LOCALTIMESTAMP) - %s * interval '1 month',
+                date_trunc('month', LOCALTIMESTAMP) + %s * interval '1 month',
+                interval '1 month') AS month;""", (months_back, months_ahead))
+    months = cursor.fetchall()
+    cursor.execute("""SELECT child.relname FROM pg_inherits
+            JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = 'votes'::regclass;""")
+    existing = {name for (name, ) in cursor.fetchall()}
+
+    created = []
+    for start, end in months:
+        name = vote_partition_name(start)
+        if name in existing:
+            continue
+
+        cursor.execute("""SELECT EXISTS (SELECT 1 FROM votes_default
+                WHERE created_at >= %s AND created_at < %s);""", (start, end))
+        if cursor.fetchone()[0]:
+            continue
+
+        cursor.execute(f"""CREATE TABLE {name} PARTITION OF votes
+                FOR VALUES FROM (%s) TO (%s);""", (start, end))
+        created.append(name)
+
+    connection.commit()
+    cursor.close()
+    return created
+
+
+@timed_query
+def compact_votes(connection: extensions.connection, keep_months: int = VOTE_RAW_MONTHS) -> dict:
+    """Rolls votes older than the last keep_months whole months into per-story,
+    per-month counts in vote_rollups. Monthly partitions are rolled up,
+    detached and dropped, and old votes in the default partition rolled up and
+    deleted. Votes with no story cannot be rolled up; they are dropped with the
+    rest and counted as discarded. Score counters on stories are unchanged"""
+    cursor = connection.cursor()
+    cursor.execute("""SELECT (date_trunc('month', LOCALTIMESTAMP)
+            - %s * interval '1 month')::date;""", (keep_months, ))
+    [cutoff] = cursor.fetchone()
+    cursor.execute("""SELECT child.relname FROM pg_inherits
+            JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = 'votes'::regclass
+            ORDER BY child.relname;""")
+    old_partitions = [name for (name, ) in cursor.fetchall()
+                      if VOTE_PARTITION_PATTERN.fullmatch(name)
+                      and name < vote_partition_name(cutoff)]
+
+    compacted = {"partitions_dropped": 0, "votes_rolled_up": 0, "votes_discarded": 0}
+    for name in old_partitions + ["votes_default"]:
+        cursor.execute(f"""WITH tallies AS (
+                    SELECT story_id, date_trunc('month', created_at)::date AS period,
+                    COUNT(*) FILTER (WHERE direction = 'up') AS upvotes,
+                    COUNT(*) FILTER (WHERE direction = 'down') AS downvotes
+                    FROM {name} WHERE created_at < %(cutoff)s AND story_id IS NOT NULL
+                    GROUP BY 1, 2),
+                rolled AS (
+                    INSERT INTO vote_rollups (story_id, period, upvotes, downvotes)
+                    SELECT story_id, period, upvotes, downvotes FROM tallies
+                    ON CONFLICT (story_id, period) DO UPDATE
+                    SET upvotes = vote_rollups.upvotes + EXCLUDED.upvotes,
+                    downvotes = vote_rollups.downvotes + EXCLUDED.downvotes)
+                SELECT COALESCE(SUM(upvotes + downvotes), 0)::bigint,
+                (SELECT COUNT(*) FROM {name} WHERE created_at < %(cutoff)s AND story_id IS NULL)
+                FROM tallies;""", {"cutoff": cutoff})
+        rolled_up, discarded = cursor.fetchone()
+        compacted["votes_rolled_up"] += rolled_up
+        compacted["votes_discarded"] += discarded
+
+        if name == "votes_default":
+            cursor.execute("DELETE FROM votes_default WHERE created_at < %s;", (cutoff, ))
+            connection.commit()
+        else:
+            # detached first, so dropping the table holds no lock on votes
+            cursor.execute(f"ALTER TABLE votes DETACH PARTITION {name};")
+            connection.commit()
+            cursor.execute(f"DROP TABLE {name};")
+            connection.commit()
+            compacted["partitions_dropped"] += 1
+
+    cursor.close()
+    return compacted
+
+
+@timed_query
+def refresh_trending(connection: extensions.connection, horizon_hours: float,
+                     gravity: float, age_offset: float) -> int:
+    """Decays the trending rank of every story created within horizon_hours,
+    and drops older stories to 0. Only one process runs a pass at a time;
+    returns how many stories were refreshed, or None if another pass was running"""
+    cursor = connection.cursor()
+
+    cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext('refresh_trending'));")
+    if not cursor.fetchone()[0]:
+        connection.rollback()
+        cursor.close()
+        return None
+
+    query = """UPDATE stories SET trending_score = CASE
+                WHEN created_at > LOCALTIMESTAMP - %(horizon)s * interval '1 hour'
+                THEN trending_rank(score, created_at, %(gravity)s, %(age_offset)s)
+                ELSE 0 END
+            WHERE created_at > LOCALTIMESTAMP - %(horizon)s * interval '1 hour'
+            OR trending_score > 0;"""
+    params = {"horizon": horizon_hours, "gravity": gravity, "age_offset": age_offset}
+    cursor.execute(query, params)
+    refreshed = cursor.rowcount
+
+    connection.commit()
+    invalidate_stories()
+    cursor.close()
+
+    return refreshed
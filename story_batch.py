@@ -0,0 +1,234 @@
+"""Batches of story mutations for POST /stories/batch, shared by the sync and async apps.
+
+A batch is a JSON object with any of four lists:
+
+    {"create": [{"url": ..., "title": ...}],
+     "edit": [{"id": ..., "url": ..., "title": ...}],
+     "vote": [{"id": ..., "direction": "up" or "down"}],
+     "delete": [id, ...]}
+
+Items are checked first and the valid ones are written in one transaction
+with one multi-row statement per kind, run in that order. Each list gets a
+result for every item, in the same order, with the status the single item
+endpoint would have given.
+"""
+from ingest import canonicalize_url, title_fingerprint, fingerprint_bands
+
+MAX_BATCH_SIZE = 10000
+MAX_STORY_ID = 2 ** 31 - 1
+KINDS = ("create", "edit", "vote", "delete")
+
+DUPLICATE_URL = "Another story already has this url"
+NO_STORY = "There is no story with this id"
+ZERO_SCORE = "Can't downvote for a story with points of 0"
+
+
+class BatchError(ValueError):
+    """The batch as a whole is malformed"""
+
+
+def story_row(item: dict) -> tuple:
+    """(title, url, canonical_url, fingerprint, bands) for a new or edited story"""
+    fingerprint = title_fingerprint(item["title"])
+    return (item["title"], item["url"], canonicalize_url(item["url"]), fingerprint,
+            fingerprint_bands(fingerprint))
+
+
+def is_story_id(value) -> bool:
+    """Whether a value from the request can be a story id"""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def in_id_range(story_id: int) -> bool:
+    """Whether a story could have this id: stories.id is a serial, so an id
+    outside int4 names no story and would be refused by Postgres"""
+    return 1 <= story_id <= MAX_STORY_ID
+
+
+def missing_story_fields(item) -> str:
+    """The error for a create or edit without a url or title, or None"""
+    for field in ("url", "title"):
+        if not isinstance(item, dict) or not isinstance(item.get(field), str):
+            return f"missing {field}"
+    return None
+
+
+def parse_batch(body) -> tuple[dict, dict]:
+    """Checks a batch, returning the items to write and the results so far,
+    which hold an error for every item left out. The items to write are
+    (position, ...row) tuples: create and edit rows are story_row with the
+    edited id first, votes are (story_id, direction) and deletes story ids"""
+    if not isinstance(body, dict) or not body or set(body) - set(KINDS):
+        raise BatchError(f"A batch is an object with any of {', '.join(KINDS)}")
+    if not all(isinstance(items, list) for items in body.values()):
+        raise BatchError("Each kind of change in a batch must be a list")
+    if sum(len(items) for items in body.values()) > MAX_BATCH_SIZE:
+        raise BatchError(f"A batch can have at most {MAX_BATCH_SIZE} changes")
+
+    plan = {kind: [] for kind in KINDS}
+    results = {kind: [None] * len(items) for kind, items in body.items()}
+    new_urls = set()
+    edited = set()
+
+    for position, item in enumerate(body.get("create", [])):
+        error = missing_story_fields(item)
+        if error:
+            results["create"][position] = {"status": 400, "error": error}
+            continue
+        row = story_row(item)
+        if row[2] in new_urls:
+            results["create"][position] = {"status": 409, "error": DUPLICATE_URL}
+            continue
+        new_urls.add(row[2])
+        plan["create"].append((position, *row))
+
+    for position, item in enumerate(body.get("edit", [])):
+        error = missing_story_fields(item)
+        if error is None and not is_story_id(item.get("id")):
+            error = "missing id"
+        if error is None and item["id"] in edited:
+            error = "A story can only be edited once in a batch"
+        if error:
+            results["edit"][position] = {"status": 400, "error": error}
+            continue
+        if not in_id_range(item["id"]):
+            results["edit"][position] = {"status": 404, "error": NO_STORY}
+            continue
+        row = story_row(item)
+        if row[2] in new_urls:
+            results["edit"][position] = {"status": 409, "error": DUPLICATE_URL}
+            continue
+        new_urls.add(row[2])
+        edited.add(item["id"])
+        plan["edit"].append((position, item["id"], *row))
+
+    for position, item in enumerate(body.get("vote", [])):
+        if not isinstance(item, dict) or not is_story_id(item.get("id")):
+            results["vote"][position] = {"status": 400, "error": "missing id"}
+        elif item.get("direction") not in ("up", "down"):
+            results["vote"][position] = {"status": 400, "error": "Direction must be up or down"}
+        elif not in_id_range(item["id"]):
+            results["vote"][position] = {"status": 404, "error": NO_STORY}
+        else:
+            plan["vote"].append((position, item["id"], item["direction"]))
+
+    for position, story_id in enumerate(body.get("delete", [])):
+        if is_story_id(story_id) and in_id_range(story_id):
+            plan["delete"].append((position, story_id))
+        elif is_story_id(story_id):
+            results["delete"][position] = {"status": 404, "error": NO_STORY}
+        else:
+            results["delete"][position] = {"status": 400, "error": "Story ids must be integers"}
+
+    return plan, results
+
+
+def vote_tallies(votes: list[tuple]) -> dict[int, list[int]]:
+    """{story_id: [upvotes, downvotes]} for the votes in a plan"""
+    tallies = {}
+    for _, story_id, direction in votes:
+        tallies.setdefault(story_id, [0, 0])[0 if direction == "up" else 1] += 1
+    return tallies
+
+
+def report_batch(plan: dict, results: dict, written: dict) -> dict:
+    """Fills in the results of the items that were written, given what the
+    statements returned: the ids of created stories by canonical url, the
+    (found, updated) state of each edited id, the (upvotes, downvotes, score)
+    applied to each voted story and the set of deleted ids"""
+    for position, _, _, canonical_url, _, _ in plan["create"]:
+        story_id = written["created"].get(canonical_url)
+        results["create"][position] = {"status": 201, "id": story_id} if story_id \
+            else {"status": 409, "error": DUPLICATE_URL}
+
+    for position, story_id, *_ in plan["edit"]:
+        found, updated = written["edited"].get(story_id, (False, False))
+        if updated:
+            results["edit"][position] = {"status": 201, "id": story_id}
+        else:
+            results["edit"][position] = {"status": 409, "error": DUPLICATE_URL} if found \
+                else {"status": 404, "error": NO_STORY}
+
+    downvotes_left = {story_id: downs for story_id, (_, downs, _) in written["voted"].items()}
+    for position, story_id, direction in plan["vote"]:
+        if story_id not in written["voted"]:
+            results["vote"][position] = {"status": 404, "error": NO_STORY}
+        elif direction == "down" and not downvotes_left[story_id]:
+            results["vote"][position] = {"status": 400, "error": ZERO_SCORE}
+        else:
+            downvotes_left[story_id] -= direction == "down"
+            results["vote"][position] = {"status": 200, "score": written["voted"][story_id][2]}
+
+    for position, story_id in plan["delete"]:
+        results["delete"][position] = {"status": 200, "id": story_id} \
+            if story_id in written["deleted"] else {"status": 404, "error": NO_STORY}
+
+    return results
+
+
+def create_statement(source: str) -> str:
+    """Inserts new stories from a query producing (title, url, canonical_url,
+    fingerprint, bands) rows, returning the id and canonical url of each one
+    inserted. Stories whose canonical url is taken are left out"""
+    return f"""WITH batch (title, url, canonical_url, fingerprint, bands) AS ({source})
+            INSERT INTO stories (title, url, canonical_url, title_fingerprint, title_bands,
+                created_at, updated_at)
+            SELECT title, url, canonical_url, fingerprint, bands,
+                current_timestamp, current_timestamp
+            FROM batch
+            ON CONFLICT (canonical_url) DO NOTHING
+            RETURNING id, canonical_url;"""
+
+
+def edit_statement(source: str) -> str:
+    """Edits stories from a query producing (id, title, url, canonical_url,
+    fingerprint, bands) rows. Edits that would give a story another story's
+    canonical url are left out rather than failing the batch. Returns each
+    id with whether it was found and whether it was updated"""
+    return f"""WITH edits (id, title, url, canonical_url, fingerprint, bands) AS ({source}),
+            updated AS (
+                UPDATE stories SET
+                title = edits.title, url = edits.url, canonical_url = edits.canonical_url,
+                title_fingerprint = edits.fingerprint, title_bands = edits.bands,
+                updated_at = current_timestamp
+                FROM edits
+                WHERE stories.id = edits.id AND NOT EXISTS (
+                    SELECT 1 FROM stories AS other
+                    WHERE other.canonical_url = edits.canonical_url AND other.id <> edits.id)
+                RETURNING stories.id)
+            SELECT edits.id,
+                EXISTS (SELECT 1 FROM stories WHERE stories.id = edits.id) AS found,
+                edits.id IN (SELECT id FROM updated) AS updated
+            FROM edits;"""
+
+
+def vote_statement(source: str, gravity: str, age_offset: str) -> str:
+    """Adds votes from a query producing (story_id, upvotes, downvotes) rows,
+    updating each story's counters and trending rank. Each story's upvotes
+    count first and downvotes that would take its score below 0 are dropped.
+    Returns the votes applied to each story that exists and its new score"""
+    return f"""WITH batch (story_id, ups, downs) AS ({source}),
+            locked AS (
+                SELECT stories.id, batch.ups,
+                GREATEST(0, LEAST(batch.downs, stories.score + batch.ups)) AS downs
+                FROM stories JOIN batch ON stories.id = batch.story_id
+                ORDER BY stories.id
+                FOR UPDATE OF stories),
+            counted AS (
+                UPDATE stories SET
+                upvotes = upvotes + locked.ups,
+                downvotes = downvotes + locked.downs,
+                score = score + locked.ups - locked.downs,
+                trending_score = trending_rank(
+                    score + locked.ups - locked.downs, created_at, {gravity}, {age_offset})
+                FROM locked WHERE stories.id = locked.id
+                RETURNING stories.id, stories.score),
+            inserted AS (
+                INSERT INTO votes(direction, created_at, updated_at, story_id)
+                SELECT expanded.direction, current_timestamp, current_timestamp, locked.id
+                FROM locked, LATERAL (
+                    SELECT 'up' FROM generate_series(1, locked.ups)
+                    UNION ALL
+                    SELECT 'down' FROM generate_series(1, locked.downs)) AS expanded (direction))
+            SELECT locked.id, locked.ups, locked.downs, counted.score
+            FROM locked JOIN counted ON counted.id = locked.id;"""
@@ -0,0 +1,82 @@
+"""Compact rows for story listings.
+
+RealDictCursor builds a dict for every row fetched, and the listing functions
+then copied each one into another dict. RecordCursor keeps the tuple psycopg2
+already made and wraps it in a StoryRecord: a __slots__ object whose class
+holds the column names once for every row of the same query. Records read like
+the dicts they replace (record["id"], dict(record), record == {...}), and
+story_json.py encodes a list of them a column at a time.
+"""
+from collections.abc import Mapping
+from functools import lru_cache
+from psycopg2 import extensions
+
+
+class StoryRecord(Mapping):
+    """One row's values, read by column name"""
+    __slots__ = ("row",)
+    columns = ()
+    positions = {}
+
+    def __init__(self, row: tuple):
+        self.row = row
+
+    def __getitem__(self, column: str):
+        return self.row[self.positions[column]]
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+    def __repr__(self) -> str:
+        return f"StoryRecord({dict(self)!r})"
+
+
+@lru_cache(maxsize=64)
+def record_class(columns: tuple[str]) -> type:
+    """The StoryRecord class for rows with these columns, made once per query shape"""
+    return type("StoryRecord", (StoryRecord,), {
+        "__slots__": (),
+        "columns": columns,
+        "positions": {column: position for position, column in enumerate(columns)}
+    })
+
+
+def from_asyncpg(rows: list) -> list[StoryRecord]:
+    """StoryRecords for rows asyncpg fetched, which all share the first row's columns"""
+    if not rows:
+        return []
+
+    record = record_class(tuple(rows[0].keys()))
+    return [record(tuple(row)) for row in rows]
+
+
+class RecordCursor(extensions.cursor):
+    """A cursor returning StoryRecords, for cursor_factory"""
+
+    def record(self) -> type:
+        """The record class for the last query's columns"""
+        return record_class(tuple(column.name for column in self.description))
+
+    def fetchone(self):
+        row = super().fetchone()
+        return None if row is None else self.record()(row)
+
+    def fetchmany(self, size=None):
+        return list(map(self.record(), super().fetchmany(size)))
+
+    def fetchall(self):
+        return list(map(self.record(), super().fetchall()))
+
+    def __iter__(self):
+        # a named cursor has no description until its first row is fetched
+        rows = super().__iter__()
+        first = next(rows, None)
+        if first is None:
+            return
+
+        record = self.record()
+        yield record(first)
+        yield from map(record, rows)
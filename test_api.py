@@ -1,16 +1,29 @@
 """ Tests for routes in stories api """
 from api import app
 import json
+from datetime import datetime
+from decimal import Decimal
 from unittest.mock import patch
+from response_cache import invalidate_stories
+from db_pool import PoolTimeoutError
 
 
-def test_index():
-    """ Tests if the index page returns successfully """
+@patch("api.get_db_connection")
+@patch("api.load_stories_page")
+def test_index(mock_page, mock_database):
+    """ Tests if the index page returns successfully, with the first page of stories in it """
 
+    mock_page.return_value = ([{"id": 1, "title": "A <b>story</b>", "url": "https://a.com",
+                                "score": 3}], "next-page")
     test_client = app.test_client()
     response = test_client.get('/')
+    html = response.get_data(as_text=True)
 
     assert response.status_code == 200
+    assert mock_page.call_args[0][1:] == ("title", "ascending", 20, None)
+    assert 'data-id="1"' in html
+    assert "A &lt;b&gt;story&lt;/b&gt;" in html
+    assert '"next_cursor":"next-page"' in html.replace(" ", "")
 
 
 @patch("api.get_db_connection")
@@ -43,6 +56,25 @@ def test_gets_no_stories(mock_new_story, mock_database, api_client):
     assert body == [{"error": True, "message": "No stories were found"}]
 
 
+@patch("api.get_db_connection")
+@patch("api.load_all_stories")
+@patch("api.find_specific_story")
+@patch("api.sort_stories")
+def test_search_and_sort_skip_full_load(mock_sort, mock_search, mock_load, mock_database,
+                                        api_client):
+    """Searches and sorts only run their own query, and an empty result is a 404"""
+
+    mock_search.return_value = []
+    mock_sort.return_value = [{"title": "bob"}]
+
+    searched = api_client.get("/stories?search=bob")
+    sorted_stories = api_client.get("/stories?sort=score")
+
+    assert searched.status_code == 404
+    assert sorted_stories.json == [{"title": "bob"}]
+    assert mock_load.call_count == 0
+
+
 @patch("api.get_db_connection")
 @patch("api.make_new_story")
 def test_post_story_request_success(mock_new_story, mock_database, api_client):
@@ -60,6 +92,21 @@ def test_post_story_request_success(mock_new_story, mock_database, api_client):
     assert body == {"success": "New story added"}
 
 
+@patch("api.get_db_connection")
+@patch("api.make_new_story")
+def test_post_story_duplicate_url(mock_new_story, mock_database, api_client):
+    """A story whose url is already taken is refused, as nothing was written"""
+
+    mock_new_story.return_value = None
+    response = api_client.post("/stories", json={
+        "title": "Kayode2 Website",
+        "url": "https://www.kayode2.co.uk/"
+    })
+
+    assert response.status_code == 409
+    assert response.json == {"error": "Another story already has this url"}
+
+
 @patch("api.get_db_connection")
 @patch("api.make_new_story")
 def test_invalid_post_story(mock_new_story, mock_database, api_client):
@@ -115,7 +162,7 @@ def test_successful_patch_request(story_update, found_story, mock_database, api_
 def test_story_non_existent(story_update, found_story, mock_database, api_client):
     """Story doesn't exist when patch request is made"""
 
-    found_story.return_value = []
+    found_story.return_value = None
 
     response = api_client.patch("/stories/87687587567", json={
         "title": "Kayode2 Website",
@@ -149,3 +196,251 @@ def test_edit_a_story(mock_find_story, update, mock_database, api_client):
     body = response.json
     assert response.status_code == 201
     assert body == {"success": "Story updated"}
+
+
+@patch("api.get_db_connection")
+@patch("api.load_stories_page")
+def test_get_stories_page(mock_page, mock_database, api_client):
+    """Returns a page of stories and the cursor for the next page"""
+
+    mock_page.return_value = ([{"title": "bob"}], "next-page")
+    response = api_client.get("/stories?limit=1&sort=score&order=descending")
+
+    assert response.status_code == 200
+    assert response.json == {"stories": [{"title": "bob"}], "next_cursor": "next-page"}
+    assert mock_page.call_args[0][1:] == ("score", "descending", 1, None)
+
+
+@patch("api.get_db_connection")
+@patch("api.search_stories_page")
+def test_search_is_paged(mock_search, mock_database, api_client):
+    """A search with a limit returns a cursor for its next page, and a bad cursor is a 400"""
+
+    mock_search.return_value = ([{"title": "bob"}], "next-page")
+    response = api_client.get("/stories?limit=1&search=bob&prefix=true&cursor=abc")
+    mock_search.side_effect = ValueError("Invalid cursor")
+    refused = api_client.get("/stories?limit=1&search=bob&cursor=abc")
+
+    assert response.json == {"stories": [{"title": "bob"}], "next_cursor": "next-page"}
+    assert mock_search.call_args_list[0][0][1:] == ("bob", True, 1, "abc")
+    assert refused.status_code == 400
+
+
+@patch("api.get_db_connection")
+@patch("api.load_stories_page")
+def test_invalid_page_limit(mock_page, mock_database, api_client):
+    """Rejects page sizes that are not between 1 and the maximum"""
+
+    not_number = api_client.get("/stories?limit=ten")
+    too_large = api_client.get("/stories?limit=1000")
+
+    assert not_number.status_code == 400
+    assert too_large.status_code == 400
+    assert mock_page.call_count == 0
+
+
+@patch("api.get_db_connection")
+@patch("api.get_scrape_workers")
+@patch("api.enqueue_scrape_job")
+def test_scrape_queues_job(mock_enqueue, mock_workers, mock_database, api_client):
+    """Scrape requests are queued and answered straight away with a job id"""
+
+    mock_enqueue.return_value = 3
+    response = api_client.post("/scrape", json={"url": "https://www.bbc.co.uk/news"})
+
+    assert response.status_code == 202
+    assert response.json["job_id"] == 3
+    assert response.json["status_url"] == "/scrape/jobs/3"
+    assert mock_enqueue.call_args[0][1] == ["https://www.bbc.co.uk/news"]
+    assert mock_workers().notify.call_count == 1
+
+
+@patch("api.get_db_connection")
+@patch("api.enqueue_scrape_job")
+def test_scrape_rejects_other_sites(mock_enqueue, mock_database, api_client):
+    """Only BBC pages can be queued for scraping"""
+
+    response = api_client.post("/scrape", json={
+        "urls": ["https://www.bbc.co.uk/news", "https://www.vice.com/en"]
+    })
+
+    assert response.status_code == 400
+    assert mock_enqueue.call_count == 0
+
+
+@patch("api.get_db_connection")
+@patch("api.load_all_stories")
+def test_get_stories_cached_with_etag(mock_load, mock_database, api_client):
+    """Repeat requests are answered from the cache, and revalidate with a 304"""
+
+    mock_load.return_value = [{"title": "bob"}]
+    first = api_client.get("/stories")
+    second = api_client.get("/stories")
+    revalidated = api_client.get("/stories", headers={"If-None-Match": first.headers["ETag"]})
+
+    assert first.json == second.json == [{"title": "bob"}]
+    assert first.headers["ETag"] == second.headers["ETag"]
+    assert revalidated.status_code == 304
+    assert mock_load.call_count == 1
+    assert mock_database.call_count == 1
+
+
+@patch("api.get_db_connection")
+@patch("api.load_all_stories")
+@patch("api.make_new_story")
+def test_new_story_invalidates_cache(mock_new_story, mock_load, mock_database, api_client):
+    """A write makes the next GET go back to the database"""
+
+    mock_load.return_value = [{"title": "bob"}]
+    mock_new_story.side_effect = lambda *args: invalidate_stories()
+
+    api_client.get("/stories")
+    api_client.post("/stories", json={"title": "new", "url": "www.new.com"})
+    api_client.get("/stories")
+
+    assert mock_load.call_count == 2
+
+
+@patch("api.get_db_connection")
+@patch("api.find_story_with_id")
+@patch("api.add_votes")
+def test_vote_refused_downvote(mock_add_votes, mock_find_story, mock_database, api_client):
+    """A downvote on a story at 0 points is refused by the vote itself"""
+
+    mock_add_votes.return_value = None
+    mock_find_story.return_value = {"id": 4, "score": 0}
+
+    response = api_client.post("/stories/4/votes", json={"direction": "down"})
+
+    assert response.status_code == 400
+    assert mock_add_votes.call_count == 1
+
+
+@patch("api.get_db_connection")
+@patch("api.find_story_with_id")
+@patch("api.add_votes")
+def test_vote_missing_story(mock_add_votes, mock_find_story, mock_database, api_client):
+    """Voting on a story that does not exist returns 404"""
+
+    mock_add_votes.return_value = None
+    mock_find_story.return_value = None
+
+    response = api_client.post("/stories/4/votes", json={"direction": "up"})
+
+    assert response.status_code == 404
+
+
+@patch("api.get_vote_buffer")
+@patch("api.add_votes")
+def test_vote_write_behind(mock_add_votes, mock_buffer, api_client, monkeypatch):
+    """With write-behind on, votes are buffered rather than written"""
+
+    monkeypatch.setenv("VOTE_WRITE_BEHIND", "1")
+
+    response = api_client.post("/stories/4/votes", json={"direction": "up"})
+
+    assert response.status_code == 202
+    mock_buffer().add.assert_called_once_with(4, "up")
+    mock_add_votes.assert_not_called()
+
+
+@patch("api.get_db_connection")
+@patch("api.load_all_stories")
+def test_metrics_times_routes(mock_load, mock_database, api_client):
+    """Requests are counted per route pattern and exposed on /metrics"""
+
+    mock_load.return_value = [{"title": "bob"}]
+    api_client.get("/stories")
+
+    response = api_client.get("/metrics")
+    body = response.get_data(as_text=True)
+
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    assert 'http_requests_total{method="GET",route="/stories",status="200"}' in body
+    assert 'http_request_duration_seconds_count{method="GET",route="/stories"}' in body
+
+
+@patch("api.get_db_connection")
+@patch("api.load_all_stories")
+@patch("api.stream_stories")
+def test_stream_matches_full_response(mock_stream, mock_load, mock_database, api_client):
+    """Streamed stories serialize dates and decimals exactly like the full response"""
+
+    stories = [
+        {"id": 1, "created_at": datetime(2023, 10, 26, 12, 46), "score": Decimal("1.5")},
+        {"id": 2, "created_at": datetime(2023, 10, 27, 9, 0), "score": Decimal("0")}
+    ]
+    mock_load.return_value = stories
+    mock_stream.return_value = iter(stories)
+
+    full = api_client.get("/stories")
+    streamed = api_client.get("/stories?stream=1&sort=score&order=descending")
+
+    assert streamed.status_code == 200
+    assert streamed.is_streamed
+    assert streamed.json == full.json
+    assert mock_stream.call_args[0][1:3] == ("score", "descending")
+
+
+@patch("api.get_db_connection")
+@patch("api.stream_stories")
+def test_stream_ndjson(mock_stream, mock_database, api_client):
+    """stream=ndjson sends one story per line"""
+
+    mock_stream.return_value = iter([{"id": 1}, {"id": 2}, {"id": 3}])
+    response = api_client.get("/stories?stream=ndjson")
+    lines = response.get_data(as_text=True).splitlines()
+
+    assert response.mimetype == "application/x-ndjson"
+    assert [json.loads(line) for line in lines] == [{"id": 1}, {"id": 2}, {"id": 3}]
+
+
+@patch("api.get_db_connection")
+@patch("api.stream_stories")
+def test_stream_empty_and_invalid(mock_stream, mock_database, api_client):
+    """Streaming no stories is a 404, and search or limit cannot be streamed"""
+
+    mock_stream.return_value = iter([])
+
+    assert api_client.get("/stories?stream=1").status_code == 404
+    assert api_client.get("/stories?stream=1&limit=5").status_code == 400
+
+
+@patch("api.get_db_connection")
+@patch("api.apply_story_batch")
+def test_story_batch(mock_apply, mock_database, api_client):
+    """A batch is written in one call and answered with a result per item"""
+
+    mock_apply.return_value = {
+        "created": {"https://kayode2.co.uk/": 11}, "edited": {}, "voted": {}, "deleted": {4}
+    }
+
+    response = api_client.post("/stories/batch", json={
+        "create": [{"title": "Kayode2 Website", "url": "www.kayode2.co.uk"}, {"title": "No url"}],
+        "delete": [4, 5]
+    })
+
+    assert response.status_code == 200
+    assert response.json == {
+        "create": [{"status": 201, "id": 11}, {"status": 400, "error": "missing url"}],
+        "delete": [{"status": 200, "id": 4},
+                   {"status": 404, "error": "There is no story with this id"}]
+    }
+    assert mock_apply.call_count == 1
+    assert api_client.post("/stories/batch", json={"rename": []}).status_code == 400
+
+
+@patch("db_pool.get_pool")
+def test_exhausted_pool_is_503(mock_get_pool, api_client):
+    """A request that gets no database connection in time is told to retry"""
+
+    mock_get_pool.return_value.checkout.side_effect = PoolTimeoutError(
+        "No database connection free after 5.0 seconds")
+
+    response = api_client.post("/stories/4/votes", json={"direction": "up"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert response.json == {"error": True,
+                             "message": "No database connection free after 5.0 seconds"}
@@ -0,0 +1,137 @@
+""" Runs the same API scenarios against the sync (Flask) and async (Quart) apps"""
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock, patch
+import pytest
+
+import api
+import asgi_api
+from db_pool import PoolTimeoutError
+from response_cache import get_stories_cache
+
+STORY = {
+    "id": 2,
+    "title": "Rishi Sunak backs Israel against 'evil' Hamas",
+    "url": "https://www.bbc.co.uk/news/uk-politics-67151404",
+    "score": 3,
+    "created_at": datetime(2023, 10, 19, 16, 48, 46),
+    "updated_at": datetime(2023, 10, 20, 9, 0),
+    "weight": Decimal("1.50")
+}
+
+
+class Rows(list):
+    """Rows a mocked stream_stories yields"""
+
+
+async def async_rows(rows):
+    """Async iterator over rows, standing in for the asyncpg cursor"""
+    for row in rows:
+        yield row
+
+
+# (method, path, json body, {function: return value, or an exception it raises})
+SCENARIOS = [
+    ("GET", "/", None, {"load_stories_page": ([STORY], "next-page")}),
+    ("GET", "/stories", None, {"load_all_stories": [STORY]}),
+    ("GET", "/stories", None, {"load_all_stories": []}),
+    ("GET", "/stories?search=sunak", None, {"find_specific_story": [STORY]}),
+    ("GET", "/stories?search=nothing", None, {"find_specific_story": []}),
+    ("GET", "/stories?sort=score&order=descending", None, {"sort_stories": [STORY]}),
+    ("GET", "/stories?limit=1&sort=score", None, {"load_stories_page": ([STORY], "next-page")}),
+    ("GET", "/stories?limit=1&search=sunak", None,
+     {"search_stories_page": ([STORY], "next-page")}),
+    ("GET", "/stories?limit=ten", None, {}),
+    ("GET", "/stories?limit=1000", None, {}),
+    ("GET", "/stories?stream=1", None, {"stream_stories": Rows([STORY, STORY])}),
+    ("GET", "/stories?stream=1", None, {"stream_stories": Rows([])}),
+    ("GET", "/stories?stream=1&search=x", None, {}),
+    ("POST", "/stories", {"title": "Kayode2 Website", "url": "www.kayode2.co.uk"},
+     {"make_new_story": 7}),
+    ("POST", "/stories", {"title": "Kayode2 Website", "url": "www.kayode2.co.uk"},
+     {"make_new_story": None}),
+    ("POST", "/stories", {"title": "Kayode2 Website"}, {}),
+    ("POST", "/stories", {"url": "www.kayode2.co.uk"}, {}),
+    ("PATCH", "/stories/2", {"title": "Kayode2 Website", "url": "www.kayode2.co.uk"},
+     {"find_story_with_id": STORY, "update_stories": None}),
+    ("PATCH", "/stories/2", {"title": "Kayode2 Website"}, {"find_story_with_id": STORY}),
+    ("DELETE", "/stories/2", None, {"find_story_with_id": STORY, "delete_story": None}),
+    ("PATCH", "/stories/99", {"title": "Kayode2 Website", "url": "www.kayode2.co.uk"},
+     {"find_story_with_id": None, "update_stories": None}),
+    ("DELETE", "/stories/99", None, {"find_story_with_id": None, "delete_story": None}),
+    # ids outside int4 are refused before any query, which asyncpg could not send
+    ("PATCH", "/stories/87687587567", {"title": "Kayode2 Website", "url": "www.kayode2.co.uk"},
+     {}),
+    ("POST", "/stories/87687587567/votes", {"direction": "up"}, {}),
+    ("POST", "/stories/4/votes", {"direction": "up"}, {"add_votes": 4}),
+    ("POST", "/stories/4/votes", {"direction": "down"},
+     {"add_votes": None, "find_story_with_id": {"id": 4, "score": 0}}),
+    ("POST", "/stories/4/votes", {"direction": "up"},
+     {"add_votes": None, "find_story_with_id": None}),
+    ("POST", "/stories/4/votes", {"direction": "sideways"}, {}),
+    ("POST", "/stories/4/votes", {"direction": "up"},
+     {"add_votes": PoolTimeoutError("No database connection free after 5.0 seconds")}),
+    ("GET", "/stories/stream/stats", None, {}),
+    ("POST", "/stories/batch",
+     {"create": [{"title": "Kayode2 Website", "url": "www.kayode2.co.uk"}, {"url": "x.com"}],
+      "vote": [{"id": 2, "direction": "up"}, {"id": 5, "direction": "down"}], "delete": [2]},
+     {"apply_story_batch": {"created": {}, "edited": {}, "voted": {2: (1, 0, 4)},
+                            "deleted": {2}}}),
+    ("POST", "/stories/batch", {"delete": "all"}, {}),
+    ("POST", "/scrape", {"url": "https://www.bbc.co.uk/news"},
+     {"enqueue_scrape_job": 3, "get_scrape_workers": MagicMock()}),
+    ("POST", "/scrape", {"urls": ["https://www.bbc.co.uk/news", "https://www.vice.com/en"]}, {}),
+    ("GET", "/scrape/jobs/3", None, {"find_scrape_job": {"id": 3, "status": "done"}}),
+    ("GET", "/scrape/jobs/3", None, {"find_scrape_job": None}),
+]
+
+
+def sync_mock(value):
+    """Mock for a function of api.py"""
+    if isinstance(value, Exception):
+        return MagicMock(side_effect=value)
+    if isinstance(value, Rows):
+        return MagicMock(side_effect=lambda *args: iter(value))
+    return MagicMock(return_value=value)
+
+
+def async_mock(value):
+    """Mock for a coroutine (or async generator) of asgi_api.py"""
+    if isinstance(value, Exception):
+        return AsyncMock(side_effect=value)
+    if isinstance(value, Rows):
+        return MagicMock(side_effect=lambda *args: async_rows(value))
+    return AsyncMock(return_value=value)
+
+
+def call_sync(method, path, body, mocks) -> tuple:
+    """Runs a scenario against the Flask app"""
+    with patch.multiple(api, get_db_connection=MagicMock(),
+                        **{name: sync_mock(value) for name, value in mocks.items()}):
+        response = api.app.test_client().open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+
+def call_async(method, path, body, mocks) -> tuple:
+    """Runs a scenario against the Quart app"""
+
+    async def run():
+        with patch.multiple(asgi_api, get_db_pool=AsyncMock(),
+                            **{name: async_mock(value) for name, value in mocks.items()}):
+            response = await asgi_api.app.test_client().open(path, method=method, json=body)
+            return response.status_code, await response.get_data()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("method, path, body, mocks", SCENARIOS)
+def test_sync_and_async_apps_agree(method, path, body, mocks):
+    """Both apps answer with the same status and byte-identical JSON"""
+
+    sync_status, sync_body = call_sync(method, path, body, mocks)
+    get_stories_cache().clear()
+    async_status, async_body = call_async(method, path, body, mocks)
+
+    assert async_status == sync_status
+    assert async_body == sync_body
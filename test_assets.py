@@ -0,0 +1,91 @@
+""" Tests for built static assets and the server-rendered stories page"""
+import gzip
+import json
+import pytest
+
+import assets
+from assets import (
+build,
+fingerprinted_name,
+link_assets,
+accepted_encodings,
+render_stories_page,
+EMPTY_STORIES)
+
+
+@pytest.fixture()
+def built(tmp_path, monkeypatch):
+    """Builds the assets into a temporary directory and serves them from there"""
+    monkeypatch.setattr(assets, "DIST", tmp_path)
+    manifest = build(dist_dir=tmp_path)
+    yield manifest
+    assets.load_manifest.cache_clear()
+
+
+def test_fingerprinted_name_changes_with_content():
+    """Tests the hash goes before the extension and follows the content"""
+
+    first = fingerprinted_name("scrape/index.js", b"one")
+
+    assert first.startswith("scrape/index.") and first.endswith(".js")
+    assert first != fingerprinted_name("scrape/index.js", b"two")
+
+
+def test_build_writes_compressed_copies(built, tmp_path):
+    """Tests each asset is copied under its fingerprinted name with a gzip copy"""
+
+    fingerprinted = built["index.js"]
+    content = (tmp_path / fingerprinted).read_bytes()
+
+    assert content == (assets.STATIC / "index.js").read_bytes()
+    assert gzip.decompress((tmp_path / (fingerprinted + ".gz")).read_bytes()) == content
+    assert json.loads((tmp_path / "manifest.json").read_text()) == built
+
+
+def test_pages_link_built_assets(built):
+    """Tests pages point at the fingerprinted files once they are built"""
+
+    html = '<script src="../static/index.js" defer></script><img src="../static/logo.png">'
+
+    assert link_assets(html) == (f'<script src="/assets/{built["index.js"]}" defer></script>'
+                                 '<img src="/static/logo.png">')
+
+
+def test_accepted_encodings():
+    """Tests quality values are read and unknown ones refused"""
+
+    assert accepted_encodings("gzip, br;q=0, deflate;q=0.5, *;q=x") == {
+        "gzip": 1.0, "br": 0.0, "deflate": 0.5, "*": 0.0
+    }
+
+
+def test_asset_served_compressed_and_immutable(built, api_client):
+    """Tests a built asset is sent gzipped to clients accepting it and cached for good"""
+
+    fingerprinted = built["index.css"]
+
+    gzipped = api_client.get(f"/assets/{fingerprinted}", headers={"Accept-Encoding": "gzip"})
+    plain = api_client.get(f"/assets/{fingerprinted}", headers={"Accept-Encoding": "identity"})
+
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert gzipped.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert gzipped.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(gzipped.get_data()) == plain.get_data()
+    assert "Content-Encoding" not in plain.headers
+    assert plain.mimetype == "text/css"
+    assert api_client.get("/assets/../api.py").status_code == 404
+
+
+def test_first_page_embedded_safely():
+    """Tests stories are rendered into the page and their JSON cannot close the script tag"""
+
+    story = {"id": 4, "title": "</script><script>alert(1)</script>", "url": "https://a.com",
+             "score": 2}
+
+    html = render_stories_page(f"<main>{EMPTY_STORIES}</main>", [story], None, json.dumps)
+
+    assert html.count("</script>") == 1
+    assert '<span class="score">(2 points)</span>' in html
+    assert json.loads(html.split('type="application/json">')[1].split("</script>")[0]) == {
+        "stories": [story], "next_cursor": None
+    }
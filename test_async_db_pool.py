@@ -0,0 +1,26 @@
+""" Tests for the asyncpg pool used by the async app"""
+import asyncio
+import pytest
+from async_db_pool import create_async_pool
+from db_pool import PoolTimeoutError
+
+
+def test_acquire_gives_up_after_pool_timeout(monkeypatch):
+    """A statement that gets no connection in DATABASE_POOL_TIMEOUT raises PoolTimeoutError"""
+
+    monkeypatch.setenv("DATABASE_POOL_MIN_SIZE", "0")
+    monkeypatch.setenv("DATABASE_POOL_MAX_SIZE", "1")
+    monkeypatch.setenv("DATABASE_POOL_TIMEOUT", "0.05")
+
+    async def never_connects(*args, **kwargs):
+        await asyncio.sleep(10)
+
+    async def fetch():
+        pool = await create_async_pool("postgresql://news@127.0.0.1/news", never_connects)
+        try:
+            await pool.fetch("SELECT 1;")
+        finally:
+            pool.terminate()
+
+    with pytest.raises(PoolTimeoutError):
+        asyncio.run(fetch())
@@ -0,0 +1,98 @@
+""" Tests for the async fetcher, run against an in-process httpx transport"""
+import asyncio
+import time
+import httpx
+import pytest
+from async_fetcher import AsyncFetcher
+from fetcher import FetchError
+from page_cache import PageCache
+
+
+def stand_in_transport(calls: list) -> httpx.MockTransport:
+    """Answers like the BBC stand-in in test_fetcher, with a flaky and a missing page"""
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        if request.url.path == "/flaky" and calls.count("/flaky") == 1:
+            return httpx.Response(503, text="try again")
+        if request.url.path == "/missing":
+            return httpx.Response(404, text="not found")
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, text=f"<html>{request.url.path}</html>", headers={"ETag": '"v1"'})
+
+    return httpx.MockTransport(handler)
+
+
+async def fetch_all(fetcher: AsyncFetcher, urls: list[str], failures: dict) -> dict:
+    """Collects everything fetch_all yields and closes the fetcher"""
+    pages = {url: html async for url, html in fetcher.fetch_all(urls, failures)}
+    await fetcher.close()
+    return pages
+
+
+def test_retries_and_records_failures():
+    """A temporary server error is retried, and a missing page is recorded as failed"""
+
+    calls = []
+    fetcher = AsyncFetcher(backoff=0, transport=stand_in_transport(calls))
+    failures = {}
+
+    pages = asyncio.run(fetch_all(
+        fetcher, ["http://bbc.test/flaky", "http://bbc.test/missing"], failures))
+
+    assert pages == {"http://bbc.test/flaky": "<html>/flaky</html>"}
+    assert calls.count("/flaky") == 2
+    assert list(failures) == ["http://bbc.test/missing"]
+
+
+def test_unchanged_page_is_none(tmp_path):
+    """A page the cache already holds comes back as None after a 304"""
+
+    cache = PageCache(tmp_path)
+    url = "http://bbc.test/news"
+
+    first = asyncio.run(fetch_all(AsyncFetcher(cache=cache, transport=stand_in_transport([])),
+                                  [url], {}))
+    cache.commit(url)
+    second = asyncio.run(fetch_all(AsyncFetcher(cache=cache, transport=stand_in_transport([])),
+                                   [url], {}))
+
+    assert first == {url: "<html>/news</html>"}
+    assert second == {url: None}
+
+
+def test_uncommitted_page_fetched_in_full(tmp_path):
+    """A page whose stories were never stored is not answered with a 304 next time"""
+
+    cache = PageCache(tmp_path)
+    url = "http://bbc.test/news"
+
+    asyncio.run(fetch_all(AsyncFetcher(cache=cache, transport=stand_in_transport([])), [url], {}))
+    second = asyncio.run(fetch_all(AsyncFetcher(cache=cache, transport=stand_in_transport([])),
+                                   [url], {}))
+
+    assert second == {url: "<html>/news</html>"}
+
+
+def test_request_timeout_capped_by_deadline():
+    """A request close to the deadline times out at the deadline, and none is sent after it"""
+
+    timeouts = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        timeouts.append(request.extensions["timeout"]["read"])
+        return httpx.Response(200, text="<html></html>")
+
+    async def fetch_both(fetcher: AsyncFetcher):
+        await fetcher.fetch("http://bbc.test/news", time.monotonic() + 1)
+        try:
+            await fetcher.fetch("http://bbc.test/sport", time.monotonic() - 1)
+        finally:
+            await fetcher.close()
+
+    with pytest.raises(FetchError, match="Deadline"):
+        asyncio.run(fetch_both(AsyncFetcher(timeout=10, transport=httpx.MockTransport(handler))))
+
+    assert len(timeouts) == 1
+    assert timeouts[0] <= 1
@@ -0,0 +1,111 @@
+""" Tests for the bulk crawler"""
+from unittest.mock import MagicMock, patch
+import crawl
+from crawl import Checkpoint, read_seeds, load_stories
+from fetcher import FetchError
+
+
+def test_read_seeds(tmp_path):
+    """Tests blank lines, comments and repeated urls are left out"""
+
+    seeds = tmp_path / "seeds.txt"
+    seeds.write_text("# topics\nhttps://www.bbc.co.uk/news/1\n\n"
+                     "  https://www.bbc.co.uk/news/2 \nhttps://www.bbc.co.uk/news/1\n")
+
+    assert read_seeds(seeds) == ["https://www.bbc.co.uk/news/1", "https://www.bbc.co.uk/news/2"]
+
+
+def test_checkpoint_resumes_unloaded_pages(tmp_path):
+    """Tests parsed pages are remembered and only those after the last load are pending"""
+
+    checkpoint = Checkpoint(tmp_path / "crawl.checkpoint")
+    checkpoint.record_page("https://www.bbc.co.uk/news/1", [{"url": "/1", "title": "One"}])
+    checkpoint.record_loaded()
+    checkpoint.record_page("https://www.bbc.co.uk/news/2", [{"url": "/2", "title": "Two"}])
+
+    done, pending = checkpoint.load()
+
+    assert done == {"https://www.bbc.co.uk/news/1", "https://www.bbc.co.uk/news/2"}
+    assert pending == [{"url": "/2", "title": "Two"}]
+
+
+def test_checkpoint_drops_cut_off_record(tmp_path):
+    """Tests a record half written when the crawl stopped is discarded"""
+
+    path = tmp_path / "crawl.checkpoint"
+    checkpoint = Checkpoint(path)
+    checkpoint.record_page("https://www.bbc.co.uk/news/1", [])
+    with open(path, "a", encoding="utf_8") as cut_off:
+        cut_off.write('{"url": "https://www.bbc.co.uk/ne')
+
+    assert checkpoint.load() == ({"https://www.bbc.co.uk/news/1"}, [])
+
+    checkpoint.record_page("https://www.bbc.co.uk/news/2", [])
+    assert checkpoint.load()[0] == {"https://www.bbc.co.uk/news/1", "https://www.bbc.co.uk/news/2"}
+
+
+def test_crawl_page_reports_fetch_errors():
+    """Tests a page that cannot be fetched is returned as an error, not raised"""
+
+    mock_fetcher = MagicMock()
+    mock_fetcher.fetch.side_effect = FetchError("timed out")
+
+    with patch("crawl._fetcher", mock_fetcher):
+        assert crawl.crawl_page("https://www.bbc.co.uk/news") == \
+            ("https://www.bbc.co.uk/news", None, "timed out")
+
+
+def test_load_stories_copies_through_staging():
+    """Tests a batch is copied in as csv and merged in one transaction"""
+
+    mock_connection = MagicMock()
+    mock_cursor = mock_connection.cursor()
+    mock_cursor.fetchone.return_value = (1, 0, 0)
+    copied = []
+    mock_cursor.copy_expert.side_effect = lambda statement, buffer: copied.append(buffer.read())
+
+    counts = load_stories(mock_connection, [
+        {"url": "https://www.bbc.co.uk/news/1", "title": "Storm, \"Babet\""},
+        {"url": "https://www.bbc.co.uk/news/1?at_medium=RSS", "title": "Storm Babet"}
+    ])
+
+    assert counts == {"inserted": 1, "updated": 0, "merged": 0, "skipped": 1}
+    assert "COPY crawl_staging FROM STDIN" in mock_cursor.copy_expert.call_args[0][0]
+    assert copied == [
+        '"Storm, ""Babet""",https://www.bbc.co.uk/news/1,https://bbc.co.uk/news/1,,{}\r\n'
+    ]
+    assert "FROM crawl_staging" in mock_cursor.execute.call_args[0][0]
+    assert mock_connection.commit.call_count == 1
+
+
+@patch("crawl.load_stories")
+@patch("crawl.crawl_pages")
+def test_crawl_resumes_without_refetching(mock_crawl_pages, mock_load, tmp_path):
+    """Tests pages in the checkpoint are not fetched again and unloaded ones are loaded first"""
+
+    checkpoint = Checkpoint(tmp_path / "crawl.checkpoint")
+    checkpoint.record_page("https://www.bbc.co.uk/news/1", [{"url": "/1", "title": "One"}])
+    mock_crawl_pages.return_value = iter([
+        ("https://www.bbc.co.uk/news/2", [{"url": "/2", "title": "Two"}], None),
+        ("https://www.bbc.co.uk/news/3", None, "timed out")
+    ])
+    loaded = []
+    mock_load.side_effect = lambda connection, stories: loaded.append(list(stories)) or {
+        "inserted": len(stories), "updated": 0, "merged": 0, "skipped": 0
+    }
+
+    totals = crawl.crawl(MagicMock(), [
+        "https://www.bbc.co.uk/news/1", "https://www.bbc.co.uk/news/2",
+        "https://www.bbc.co.uk/news/3"
+    ], checkpoint, batch_size=1)
+
+    assert mock_crawl_pages.call_args[0][0] == [
+        "https://www.bbc.co.uk/news/2", "https://www.bbc.co.uk/news/3"
+    ]
+    assert loaded == [[{"url": "/1", "title": "One"}], [{"url": "/2", "title": "Two"}]]
+    assert totals["pages"] == 1
+    assert totals["failed"] == 1
+    assert totals["inserted"] == 2
+    assert checkpoint.load() == (
+        {"https://www.bbc.co.uk/news/1", "https://www.bbc.co.uk/news/2"}, []
+    )
@@ -0,0 +1,86 @@
+""" Tests for the database connection pool"""
+from unittest.mock import MagicMock
+import psycopg2
+import pytest
+from psycopg2 import extensions
+from db_pool import ConnectionPool, PoolTimeoutError
+
+
+def make_mock_connection():
+    """Returns a mock connection that looks open and idle"""
+    mock_connection = MagicMock()
+    mock_connection.closed = 0
+    mock_connection.get_transaction_status.return_value = extensions.TRANSACTION_STATUS_IDLE
+    return mock_connection
+
+
+def test_checkout_reuses_returned_connection():
+    """Tests a checked in connection is handed out again instead of opening a new one"""
+
+    mock_connect = MagicMock(side_effect=make_mock_connection)
+    pool = ConnectionPool(mock_connect, min_size=0, max_size=2)
+
+    first = pool.checkout()
+    pool.checkin(first)
+    second = pool.checkout()
+
+    assert first is second
+    assert mock_connect.call_count == 1
+    assert pool.stats()["checkouts"] == 2
+
+
+def test_checkout_times_out_when_pool_exhausted():
+    """Tests checkout gives up once every connection is in use"""
+
+    pool = ConnectionPool(make_mock_connection, min_size=0, max_size=1, timeout=0.01)
+    pool.checkout()
+
+    with pytest.raises(PoolTimeoutError):
+        pool.checkout()
+
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_unhealthy_connection_is_replaced():
+    """Tests a connection failing its health check is closed and replaced"""
+
+    broken_connection = make_mock_connection()
+    broken_connection.cursor().execute.side_effect = psycopg2.OperationalError
+    mock_connect = MagicMock(side_effect=[broken_connection, make_mock_connection()])
+    pool = ConnectionPool(mock_connect, min_size=0, max_size=1)
+
+    pool.checkin(pool.checkout())
+    connection = pool.checkout()
+
+    assert connection is not broken_connection
+    assert broken_connection.close.call_count == 1
+    assert pool.stats()["health_check_failures"] == 1
+    assert pool.stats()["size"] == 1
+
+
+def test_checkin_rolls_back_open_transaction():
+    """Tests a connection left mid-transaction is rolled back before reuse"""
+
+    mock_connection = make_mock_connection()
+    mock_connection.get_transaction_status.return_value = extensions.TRANSACTION_STATUS_INTRANS
+    pool = ConnectionPool(lambda: mock_connection, min_size=0, max_size=1)
+
+    pool.checkin(pool.checkout())
+
+    assert mock_connection.rollback.call_count == 1
+    assert pool.stats()["idle"] == 1
+
+
+def test_idle_connections_recycled_down_to_min_size():
+    """Tests connections idle past max_idle are closed, keeping min_size open"""
+
+    pool = ConnectionPool(make_mock_connection, min_size=1, max_size=3, max_idle=0)
+    connections = [pool.checkout() for _ in range(3)]
+    for connection in connections:
+        pool.checkin(connection)
+
+    pool.checkout()
+    stats = pool.stats()
+
+    assert stats["recycled"] == 2
+    assert stats["size"] == 1
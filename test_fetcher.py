@@ -0,0 +1,185 @@
+""" Tests for the concurrent fetcher, run against a local stand-in for the BBC site"""
+import gzip
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import pytest
+from fetcher import Fetcher, fetch_all
+from page_cache import PageCache
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves saved fixture pages, plus a few misbehaving routes"""
+
+    protocol_version = "HTTP/1.1"
+    state = {}
+
+    def do_GET(self):
+        """Answers a GET request according to its path"""
+        state = self.server.state
+        with state["lock"]:
+            state["requests"].append((self.path, self.client_address[1]))
+            state["active"] += 1
+            state["max_active"] = max(state["max_active"], state["active"])
+
+        try:
+            self.respond()
+        finally:
+            with state["lock"]:
+                state["active"] -= 1
+
+    def respond(self):
+        """Writes the response for the requested path"""
+        path = self.path.split("?")[0]
+
+        if path == "/flaky":
+            self.server.state["flaky_calls"] += 1
+            if self.server.state["flaky_calls"] == 1:
+                return self.send_body(503, b"try again")
+            return self.send_body(200, b"<html>recovered</html>")
+
+        if path == "/redirect":
+            self.send_response(301)
+            self.send_header("Location", "/bbc_homepage.html")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+
+        if path == "/slow":
+            time.sleep(0.1)
+            return self.send_body(200, b"<html>slow</html>")
+
+        fixture = FIXTURES / path.lstrip("/")
+        if path.endswith(".html") and fixture.exists():
+            return self.send_body(200, fixture.read_bytes())
+
+        return self.send_body(404, b"not found")
+
+    def send_body(self, status, body):
+        """Sends a body with an ETag, gzipped when the client accepts it,
+        or a bare 304 if the client already has this version"""
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Keeps test output quiet"""
+
+
+@pytest.fixture()
+def stand_in_server():
+    """Runs the stand-in server on a free local port"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    server.state = {
+        "lock": threading.Lock(), "requests": [], "active": 0, "max_active": 0, "flaky_calls": 0
+    }
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetches_fixture_pages(stand_in_server):
+    """Tests every page is yielded, decompressed, with its url"""
+
+    _, base = stand_in_server
+    names = [path.name for path in FIXTURES.glob("*.html")]
+    urls = [f"{base}/{name}" for name in names]
+
+    pages = dict(fetch_all(urls))
+
+    assert set(pages) == set(urls)
+    for name in names:
+        assert pages[f"{base}/{name}"] == (FIXTURES / name).read_text(encoding="utf_8")
+
+
+def test_reuses_keep_alive_connections(stand_in_server):
+    """Tests requests to the same host share a connection instead of reconnecting"""
+
+    server, base = stand_in_server
+    fetcher = Fetcher(workers=1)
+
+    list(fetcher.fetch_all([f"{base}/bbc_homepage.html", f"{base}/bbc_topic_politics.html"]))
+    fetcher.close()
+
+    client_ports = {port for _, port in server.state["requests"]}
+    assert len(server.state["requests"]) == 2
+    assert len(client_ports) == 1
+
+
+def test_limits_requests_per_host(stand_in_server):
+    """Tests no more than per_host requests reach one host at the same time"""
+
+    server, base = stand_in_server
+    fetcher = Fetcher(workers=8, per_host=2)
+
+    pages = list(fetcher.fetch_all([f"{base}/slow?{number}" for number in range(8)]))
+    fetcher.close()
+
+    assert len(pages) == 8
+    assert server.state["max_active"] == 2
+
+
+def test_retries_then_records_failures(stand_in_server):
+    """Tests temporary errors are retried and permanent errors recorded"""
+
+    _, base = stand_in_server
+    failures = {}
+
+    pages = dict(fetch_all([f"{base}/flaky", f"{base}/missing", f"{base}/redirect"],
+                           failures, backoff=0.01))
+
+    assert pages[f"{base}/flaky"] == "<html>recovered</html>"
+    assert "BBC News" in pages[f"{base}/redirect"]
+    assert list(failures) == [f"{base}/missing"]
+    assert "404" in str(failures[f"{base}/missing"])
+
+
+def test_deadline_stops_waiting(stand_in_server):
+    """Tests pages not finished by the deadline are reported as failures"""
+
+    _, base = stand_in_server
+    failures = {}
+
+    pages = dict(fetch_all([f"{base}/slow?{number}" for number in range(6)],
+                           failures, per_host=1, deadline=0.25))
+
+    assert pages
+    assert len(pages) + len(failures) == 6
+    assert all("Deadline" in str(err) for err in failures.values())
+
+
+def test_cached_pages_revalidated(stand_in_server, tmp_path):
+    """Tests a second fetch sends the ETag and reports the unchanged page as None"""
+
+    server, base = stand_in_server
+    cache = PageCache(tmp_path)
+    url = f"{base}/bbc_topic_politics.html"
+
+    first = dict(fetch_all([url], cache=cache))
+    cache.commit(url)
+    second = dict(fetch_all([url], cache=cache))
+
+    assert "BBC News" in first[url]
+    assert second == {url: None}
+    assert cache.get(url) == first[url]
+    assert len(server.state["requests"]) == 2
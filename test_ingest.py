@@ -0,0 +1,132 @@
+""" Tests for bulk ingest of scraped stories"""
+from unittest.mock import MagicMock, patch
+from ingest import (
+canonicalize_url,
+ingest_stories,
+normalize_title,
+title_fingerprint,
+fingerprint_bands,
+title_distance,
+unique_stories)
+
+
+def test_canonicalize_url_merges_spellings():
+    """Tests different spellings of one page share a canonical url"""
+
+    spellings = [
+        "https://www.bbc.co.uk/news/uk-politics-67151404",
+        "http://bbc.co.uk//news/uk-politics-67151404/",
+        "https://WWW.BBC.CO.UK/news/uk-politics-67151404#comments",
+        "https://www.bbc.co.uk/news/uk-politics-67151404?at_medium=RSS&utm_source=x",
+        "https://www.bbc.co.uk:443/news/uk-politics-67151404"
+    ]
+
+    assert {canonicalize_url(url) for url in spellings} == {
+        "https://bbc.co.uk/news/uk-politics-67151404"
+    }
+
+
+def test_canonicalize_url_keeps_meaningful_params():
+    """Tests non-tracking parameters are kept, in a stable order"""
+
+    assert canonicalize_url("https://www.bbc.co.uk/search?q=storm&page=2") == \
+        "https://bbc.co.uk/search?page=2&q=storm"
+
+
+def test_trivial_rewordings_share_a_fingerprint():
+    """Tests case, punctuation, accents and common words do not change a title's fingerprint"""
+
+    assert normalize_title("Storm Babet: the flood warnings issued") == \
+        ["storm", "babet", "flood", "warnings", "issued"]
+    assert title_fingerprint("Storm Babet: Flood warnings issued across Scotland") == \
+        title_fingerprint("Storm Babet - flood warnings issued across the Scotland")
+    assert title_fingerprint("Café owner wins award for best coffee") == \
+        title_fingerprint("Cafe owner wins an award for best coffee")
+
+
+def test_different_titles_are_far_apart():
+    """Tests unrelated headlines differ in many bits"""
+
+    first = title_fingerprint("Storm Babet: Flood warnings issued across Scotland")
+    second = title_fingerprint("Everton chairman Kenwright dies aged 78")
+
+    assert title_distance(first, second) > 3
+
+
+def test_short_titles_have_no_fingerprint():
+    """Tests titles too short to compare are never merged"""
+
+    assert title_fingerprint("Live: Updates") is None
+    assert fingerprint_bands(None) == []
+
+
+def test_fingerprint_bands_cover_near_duplicates():
+    """Tests fingerprints within 3 bits share a band, and bands fit an int column"""
+
+    fingerprint = title_fingerprint("Storm Babet: Flood warnings issued across Scotland")
+    near = fingerprint ^ (1 << 3) ^ (1 << 20) ^ (1 << 63)
+    near -= 1 << 64 if near >= 1 << 63 else 0
+
+    assert -(1 << 63) <= fingerprint < 1 << 63
+    assert title_distance(fingerprint, near) == 3
+    assert set(fingerprint_bands(fingerprint)) & set(fingerprint_bands(near))
+    assert all(0 <= band < 1 << 31 for band in fingerprint_bands(near))
+
+
+def test_unique_stories_merges_within_batch():
+    """Tests repeated urls are skipped and near-duplicate titles merged within one scrape"""
+
+    stories = [
+        {"url": "https://www.bbc.co.uk/news/1", "title": "Storm Babet: Flood warnings issued"},
+        {"url": "https://www.bbc.co.uk/news/1#top", "title": "Storm Babet: Flood warnings issued"},
+        {"url": "https://www.bbc.co.uk/news/topics/1", "title": "Storm Babet - flood warnings issued"},
+        {"url": "https://www.bbc.co.uk/news/2", "title": "Rail strike called off"}
+    ]
+
+    rows, merged = unique_stories(stories)
+
+    assert [row[2] for row in rows] == [
+        "https://bbc.co.uk/news/1", "https://bbc.co.uk/news/2"
+    ]
+    assert merged == 1
+
+
+@patch("ingest.extras.execute_values")
+def test_ingest_stories_single_upsert(mock_execute_values):
+    """Tests a batch is written in one statement and one commit, with counts"""
+
+    mock_connection = MagicMock()
+    mock_execute_values.return_value = [(1, 1, 1)]
+    stories = [
+        {"url": "https://www.bbc.co.uk/news/1", "title": "One"},
+        {"url": "https://www.bbc.co.uk/news/2", "title": "Two"},
+        {"url": "https://www.bbc.co.uk/news/3", "title": "Storm Babet: Flood warnings issued"},
+        {"url": "https://www.bbc.co.uk/news/1?utm_source=home", "title": "One again"}
+    ]
+
+    counts = ingest_stories(mock_connection, stories)
+    rows = mock_execute_values.call_args[0][2]
+    fingerprint = title_fingerprint("Storm Babet: Flood warnings issued")
+
+    assert counts == {"inserted": 1, "updated": 1, "merged": 1, "skipped": 1}
+    assert mock_execute_values.call_count == 1
+    assert "ON CONFLICT (canonical_url)" in mock_execute_values.call_args[0][1]
+    assert "stories.title_bands && batch.bands" in mock_execute_values.call_args[0][1]
+    assert rows == [
+        ("One", "https://www.bbc.co.uk/news/1", "https://bbc.co.uk/news/1", None, []),
+        ("Two", "https://www.bbc.co.uk/news/2", "https://bbc.co.uk/news/2", None, []),
+        ("Storm Babet: Flood warnings issued", "https://www.bbc.co.uk/news/3",
+         "https://bbc.co.uk/news/3", fingerprint, fingerprint_bands(fingerprint))
+    ]
+    assert mock_connection.commit.call_count == 1
+
+
+def test_ingest_nothing():
+    """Tests an empty scrape does not touch the database"""
+
+    mock_connection = MagicMock()
+
+    assert ingest_stories(mock_connection, []) == {
+        "inserted": 0, "updated": 0, "merged": 0, "skipped": 0
+    }
+    assert mock_connection.cursor.call_count == 0
@@ -0,0 +1,111 @@
+""" Tests for live story updates over Server-Sent Events"""
+import asyncio
+import json
+import os
+from itertools import islice
+from unittest.mock import MagicMock, patch
+import pytest
+
+from async_live_updates import AsyncSubscription
+from live_updates import Subscription, StoryChangeListener, CHANNEL, format_event, parse_notification
+from stories_functions import get_db_connection
+
+
+def test_notification_becomes_event():
+    """Tests a trigger's payload is sent on as an event named after its kind"""
+
+    payload = json.dumps({"event": "score", "id": 4, "score": 7, "upvotes": 8, "downvotes": 1})
+
+    assert format_event(*parse_notification(payload)) == f"event: score\ndata: {payload}\n\n"
+
+
+def test_listener_fans_out_to_every_subscriber():
+    """Tests one notification reaches all subscribers, and not those who left"""
+
+    listener = StoryChangeListener(MagicMock())
+    first = Subscription()
+    second = Subscription()
+    listener._subscribers.update({first, second})
+    listener.unsubscribe(second)
+
+    listener.publish("deleted", '{"event": "deleted", "id": 2}')
+
+    assert first.get(0) == ("deleted", '{"event": "deleted", "id": 2}')
+    assert second.get(0) is None
+    assert listener.stats() == {"subscribers": 1, "notifications": 1, "resets": 0, "reconnects": 0}
+
+
+def test_slow_subscriber_reset():
+    """Tests a subscriber too far behind is told to reload instead of queueing forever"""
+
+    subscription = Subscription(max_pending=2)
+
+    assert subscription.put("score", "1")
+    assert subscription.put("score", "2")
+    assert not subscription.put("score", "3")
+    assert subscription.get(0) == ("reset", "{}")
+    assert subscription.get(0) is None
+
+
+def test_async_subscription_waits_for_events():
+    """Tests the async subscription times out when idle and wakes when an event arrives"""
+
+    async def run():
+        subscription = AsyncSubscription()
+        idle = await subscription.get(0.01)
+        asyncio.get_running_loop().call_later(0.01, subscription.put, "added", "{}")
+        return idle, await subscription.get(1)
+
+    assert asyncio.run(run()) == (None, ("added", "{}"))
+
+
+@patch("api.heartbeat_seconds", return_value=0.01)
+@patch("api.get_story_listener")
+def test_stream_sends_events_then_keep_alive(mock_get_listener, mock_heartbeat, api_client):
+    """Tests the stream endpoint sends queued events, comments while idle,
+    and unsubscribes when the client goes away"""
+
+    subscription = Subscription()
+    subscription.put("edited", '{"event": "edited", "id": 1}')
+    mock_get_listener.return_value.subscribe.return_value = subscription
+
+    response = api_client.get("/stories/stream", buffered=False)
+    chunks = list(islice(response.response, 3))
+    response.close()
+
+    assert response.mimetype == "text/event-stream"
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert chunks == [
+        b"retry: 3000\n\n",
+        b'event: edited\ndata: {"event": "edited", "id": 1}\n\n',
+        b": keep-alive\n\n"
+    ]
+    mock_get_listener.return_value.unsubscribe.assert_called_once_with(subscription)
+
+
+def test_story_changes_notified():
+    """Checks adding, voting on and deleting a story each send a notification.
+    Skipped unless a database with the story_changes triggers is configured"""
+    if "DATABASE_NAME" not in os.environ:
+        pytest.skip("No database configured")
+    listening = get_db_connection()
+    writing = get_db_connection()
+    listening.autocommit = True
+    listening.cursor().execute(f"LISTEN {CHANNEL};")
+
+    cursor = writing.cursor()
+    cursor.execute("""INSERT INTO stories (title, url, created_at, updated_at)
+            VALUES ('Live update test', 'https://a.com/live', LOCALTIMESTAMP, LOCALTIMESTAMP)
+            RETURNING id;""")
+    story_id = cursor.fetchone()[0]
+    cursor.execute("UPDATE stories SET score = score + 1 WHERE id = %s;", (story_id, ))
+    cursor.execute("DELETE FROM stories WHERE id = %s;", (story_id, ))
+    writing.commit()
+
+    listening.poll()
+    events = [json.loads(notify.payload) for notify in listening.notifies
+              if json.loads(notify.payload)["id"] == story_id]
+    listening.close()
+    writing.close()
+
+    assert [event["event"] for event in events] == ["added", "score", "deleted"]
@@ -0,0 +1,87 @@
+""" Tests for request, query and scrape instrumentation"""
+import io
+import json
+from unittest.mock import patch
+from metrics import (
+Counter,
+Histogram,
+SlowQueryLog,
+params_shape,
+timed_query,
+current_query,
+record_query,
+QUERY_SECONDS,
+QUERY_ERRORS,
+QUERY_ROWS
+)
+
+
+def test_histogram_renders_cumulative_buckets():
+    """Tests each bucket counts every value at or below its bound"""
+
+    histogram = Histogram("test_seconds", "Test timings", ("route", ), buckets=(0.1, 1))
+    histogram.observe(0.05, route="/stories")
+    histogram.observe(0.5, route="/stories")
+    histogram.observe(5, route="/stories")
+
+    lines = histogram.render()
+
+    assert 'test_seconds_bucket{route="/stories",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{route="/stories",le="1"} 2' in lines
+    assert 'test_seconds_bucket{route="/stories",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{route="/stories"} 3' in lines
+    assert histogram.sum(route="/stories") == 5.55
+
+
+def test_counter_escapes_labels():
+    """Tests label values are escaped for the text format"""
+
+    counter = Counter("test_total", "Test count", ("query", ))
+    counter.inc(query='say "hi"')
+    counter.inc(2, query='say "hi"')
+
+    assert counter.value(query='say "hi"') == 3
+    assert 'test_total{query="say \\"hi\\""} 3' in counter.render()
+
+
+def test_slow_query_logged_without_values():
+    """Tests slow statements are logged with the shape of their parameters only"""
+
+    stream = io.StringIO()
+    slow_log = SlowQueryLog(threshold_ms=50, stream=stream)
+
+    assert not slow_log.record("find_story_with_id", "SELECT 1;", (3, ), 0.01, 1)
+    assert slow_log.record("find_story_with_id",
+                           "SELECT *\n  FROM stories WHERE id = %s;", ("secret", ), 0.2, 1)
+
+    entry = json.loads(stream.getvalue())
+    assert entry["statement"] == "SELECT * FROM stories WHERE id = %s;"
+    assert entry["params"] == ["str"]
+    assert entry["duration_ms"] == 200
+    assert "secret" not in stream.getvalue()
+
+
+def test_params_shape():
+    """Tests parameters are described by type"""
+
+    assert params_shape({"story_id": 1, "direction": "up"}) == {"story_id": "int", "direction": "str"}
+    assert params_shape(None) is None
+
+
+def test_timed_query_labels_statements():
+    """Tests statements run inside a timed_query function are recorded under its name"""
+
+    @timed_query
+    def load_test_rows():
+        assert current_query() == "load_test_rows"
+        record_query("SELECT 1;", None, 0.001, 4)
+        record_query("SELECT oops;", None, 0.001, failed=True)
+
+    before = QUERY_SECONDS.count(query="load_test_rows")
+    with patch("metrics.get_slow_query_log"):
+        load_test_rows()
+
+    assert current_query() == "other"
+    assert QUERY_SECONDS.count(query="load_test_rows") == before + 2
+    assert QUERY_ROWS.value(query="load_test_rows") >= 4
+    assert QUERY_ERRORS.value(query="load_test_rows") >= 1
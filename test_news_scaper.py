@@ -0,0 +1,85 @@
+""" Tests for the news scraper's parser backends"""
+from pathlib import Path
+import pytest
+from bs4 import BeautifulSoup
+from news_scaper import parse_stories_bs, available_backends, default_backend
+
+FIXTURES = sorted((Path(__file__).parent / "fixtures").glob("*.html"))
+DOMAIN = "https://www.bbc.co.uk"
+
+
+def parse_full_tree(html):
+    """Reference result: the whole document parsed with html.parser and selected"""
+
+    soup = BeautifulSoup(html, "html.parser")
+    anchors = soup.select(
+        "a.ssrcss-its5xf-PromoLink, a.ssrcss-1mrs5ns-PromoLink, a.gs-c-promo-heading")
+    return [{"url": DOMAIN + anchor.get('href'), "title": anchor.get_text()}
+            for anchor in anchors if anchor.get_text() and anchor.get('href')]
+
+
+@pytest.mark.parametrize("backend", available_backends())
+@pytest.mark.parametrize("fixture", FIXTURES, ids=lambda path: path.stem)
+def test_backends_match_full_parse(backend, fixture):
+    """Tests every backend finds exactly the stories a full parse finds"""
+
+    html = fixture.read_text(encoding="utf_8")
+
+    assert parse_stories_bs(DOMAIN, html, backend) == parse_full_tree(html)
+
+
+@pytest.mark.parametrize("backend", available_backends())
+def test_anchors_without_text_or_href_skipped(backend):
+    """Tests empty anchors are dropped without skipping the story after them"""
+
+    html = """<a class="gs-c-promo-heading" href="/news/1"></a>
+        <a class="gs-c-promo-heading" href="/news/2">Storm Babet</a>
+        <a class="gs-c-promo-heading">No link</a>
+        <a class="ssrcss-its5xf-PromoLink" href="/news/3"><span>Rail strike</span></a>
+        <a class="nav-link" href="/news/4">Not a story</a>"""
+
+    assert parse_stories_bs(DOMAIN, html, backend) == [
+        {"url": "https://www.bbc.co.uk/news/2", "title": "Storm Babet"},
+        {"url": "https://www.bbc.co.uk/news/3", "title": "Rail strike"}
+    ]
+
+
+@pytest.mark.parametrize("backend", available_backends())
+def test_relative_and_absolute_links_agree(backend):
+    """Tests links are resolved against the page url, whatever form they take"""
+
+    html = """<a class="gs-c-promo-heading" href="/news/1">Root relative</a>
+        <a class="gs-c-promo-heading" href="https://www.bbc.co.uk/news/1">Absolute</a>
+        <a class="gs-c-promo-heading" href="2">Relative</a>"""
+
+    assert [story["url"] for story in
+            parse_stories_bs("https://www.bbc.co.uk/news/topics/", html, backend)] == [
+        "https://www.bbc.co.uk/news/1",
+        "https://www.bbc.co.uk/news/1",
+        "https://www.bbc.co.uk/news/topics/2"
+    ]
+
+
+@pytest.mark.parametrize("backend", available_backends())
+def test_multi_class_anchors_found(backend):
+    """Tests anchors with several classes are found, classes match case-sensitively
+    and script or style text stays out of the title"""
+
+    html = """<a class="gs-c-promo-heading gs-o-faux-block-link__overlay-link" href="/news/1">
+        Storm Babet</a>
+        <a class="nw-o-link ssrcss-its5xf-PromoLink" href="/news/2">Rail strike<script>track()</script></a>
+        <a class="GS-C-PROMO-HEADING" href="/news/3">Wrong case</a>
+        <a class="ssrcss-1mrs5ns-PromoLink e1f5wbog0" href="/news/4"><style>p {}</style>Budget</a>"""
+
+    assert [story["title"].strip() for story in parse_stories_bs(DOMAIN, html, backend)] == [
+        "Storm Babet", "Rail strike", "Budget"
+    ]
+
+
+def test_unknown_parser_backend_rejected(monkeypatch):
+    """Tests a PARSER_BACKEND that is not installed is reported by name"""
+
+    monkeypatch.setenv("PARSER_BACKEND", "lmxl")
+
+    with pytest.raises(ValueError, match="lmxl"):
+        default_backend()
@@ -0,0 +1,89 @@
+""" Tests for the on-disk page cache"""
+import time
+from page_cache import PageCache
+
+
+def test_store_reports_changed_content(tmp_path):
+    """Tests storing identical content is reported as unchanged"""
+
+    cache = PageCache(tmp_path)
+
+    assert cache.store("https://www.bbc.co.uk/news", "<html>one</html>", '"v1"') is True
+    assert cache.store("https://www.bbc.co.uk/news", "<html>one</html>", '"v1"') is False
+    assert cache.store("https://www.bbc.co.uk/news", "<html>two</html>", '"v2"') is True
+    assert cache.get("https://www.bbc.co.uk/news") == "<html>two</html>"
+
+
+def test_conditional_headers(tmp_path):
+    """Tests the validators from the last response are sent back"""
+
+    cache = PageCache(tmp_path)
+    cache.store("https://www.bbc.co.uk/news", "<html></html>",
+                '"abc"', "Thu, 26 Oct 2023 12:46:00 GMT")
+
+    assert cache.conditional_headers("https://www.bbc.co.uk/news") == {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "Thu, 26 Oct 2023 12:46:00 GMT"
+    }
+    assert cache.conditional_headers("https://www.bbc.co.uk/sport") == {}
+
+
+def test_least_recently_used_evicted(tmp_path):
+    """Tests the least recently used page goes first when the cache is full"""
+
+    cache = PageCache(tmp_path, max_entries=2)
+    cache.store("https://www.bbc.co.uk/a", "a")
+    cache.store("https://www.bbc.co.uk/b", "b")
+    cache.get("https://www.bbc.co.uk/a")
+    cache.store("https://www.bbc.co.uk/c", "c")
+
+    assert cache.get("https://www.bbc.co.uk/a") == "a"
+    assert cache.get("https://www.bbc.co.uk/b") is None
+    assert cache.stats()["entries"] == 2
+    assert len(list(tmp_path.glob("*.html.gz"))) == 2
+
+
+def test_expired_pages_dropped(tmp_path):
+    """Tests pages older than the ttl are neither returned nor revalidated"""
+
+    cache = PageCache(tmp_path, ttl=0.01)
+    cache.store("https://www.bbc.co.uk/news", "<html></html>", '"abc"')
+    time.sleep(0.02)
+
+    assert cache.conditional_headers("https://www.bbc.co.uk/news") == {}
+    assert cache.get("https://www.bbc.co.uk/news") is None
+
+
+def test_index_survives_restart(tmp_path):
+    """Tests a new cache over the same directory sees earlier pages"""
+
+    PageCache(tmp_path).store("https://www.bbc.co.uk/news", "<html></html>", '"abc"')
+
+    assert PageCache(tmp_path).get("https://www.bbc.co.uk/news") == "<html></html>"
+
+
+def test_staged_page_cached_on_commit(tmp_path):
+    """Tests a staged page is neither returned nor revalidated until it is committed"""
+
+    cache = PageCache(tmp_path)
+
+    assert cache.stage("https://www.bbc.co.uk/news", "<html></html>", '"abc"') is True
+    assert cache.conditional_headers("https://www.bbc.co.uk/news") == {}
+    assert cache.get("https://www.bbc.co.uk/news") is None
+
+    cache.commit("https://www.bbc.co.uk/news")
+    assert cache.get("https://www.bbc.co.uk/news") == "<html></html>"
+    assert cache.stage("https://www.bbc.co.uk/news", "<html></html>", '"abc"') is False
+
+
+def test_shared_directory_keeps_entries(tmp_path):
+    """Tests caches in different processes over one directory keep each other's pages"""
+
+    first = PageCache(tmp_path)
+    second = PageCache(tmp_path)
+    first.store("https://www.bbc.co.uk/news", "news")
+    second.store("https://www.bbc.co.uk/sport", "sport")
+
+    reopened = PageCache(tmp_path)
+    assert reopened.get("https://www.bbc.co.uk/news") == "news"
+    assert reopened.get("https://www.bbc.co.uk/sport") == "sport"
@@ -0,0 +1,151 @@
+""" Tests for routing story reads to read replicas"""
+import os
+import time
+from unittest.mock import MagicMock, patch
+import pytest
+
+import db_pool
+from db_pool import checkout_replica, PoolTimeoutError
+from replicas import ReplicaHealth, reads_pinned_to_primary, STICKY_COOKIE, replica_dsns
+from response_cache import get_stories_cache
+from stories_functions import get_replica_connection, replica_lag
+
+
+def test_replicas_taken_in_turn_and_skipped_when_down():
+    """Tests replicas are offered round robin, and a failed one is left out until retry_after"""
+
+    health = ReplicaHealth(2, retry_after=60)
+
+    assert health.candidates() == [0, 1]
+    assert health.candidates() == [1, 0]
+
+    health.mark_down(1)
+
+    assert health.candidates() == [0]
+    assert health.stats()["replicas"][1]["up"] is False
+
+
+def test_lagging_or_unmeasured_replicas_not_used():
+    """Tests only replicas measured within max_lag take reads"""
+
+    health = ReplicaHealth(3, max_lag=5)
+    health.record_lag(0, 0.2)
+    health.record_lag(1, 30)
+    health.record_lag(2, None)
+
+    assert health.within_lag(0)
+    assert not health.within_lag(1)
+    assert not health.within_lag(2)
+    assert not health.lag_due(0)
+    assert health.stats()["lagging"] == 2
+
+
+def test_reads_pinned_after_write():
+    """Tests the sticky cookie keeps reads on the primary only until it expires"""
+
+    assert reads_pinned_to_primary({STICKY_COOKIE: str(time.time() + 5)})
+    assert not reads_pinned_to_primary({STICKY_COOKIE: str(time.time() - 5)})
+    assert not reads_pinned_to_primary({STICKY_COOKIE: "soon"})
+    assert not reads_pinned_to_primary({})
+
+
+def test_checkout_replica_falls_back_past_failures():
+    """Tests a replica that cannot be reached is marked down and the next one used"""
+
+    down_pool = MagicMock()
+    down_pool.checkout.side_effect = PoolTimeoutError("no connection")
+    up_pool = MagicMock()
+    health = ReplicaHealth(2)
+
+    with patch("db_pool.replica_lag", return_value=0.5) as mock_lag:
+        pool, connection = checkout_replica([down_pool, up_pool], health)
+
+    assert pool is up_pool
+    assert connection is up_pool.checkout.return_value
+    assert mock_lag.call_count == 1
+    assert health.candidates() == [1]
+
+
+def test_checkout_replica_none_when_all_lagging():
+    """Tests a replica too far behind is given back and the primary used instead"""
+
+    lagging_pool = MagicMock()
+    health = ReplicaHealth(1, max_lag=5)
+
+    with patch("db_pool.replica_lag", return_value=12.0):
+        assert checkout_replica([lagging_pool], health) == (None, None)
+
+    lagging_pool.checkin.assert_called_once_with(lagging_pool.checkout.return_value)
+
+
+@pytest.fixture()
+def two_replicas(monkeypatch):
+    """Configures two replicas for the duration of a test"""
+    monkeypatch.setenv("DATABASE_REPLICA_DSNS", "host=replica1 dbname=news, host=replica2 dbname=news")
+    monkeypatch.setattr(db_pool, "_replica_pools", None)
+    yield
+    monkeypatch.setattr(db_pool, "_replica_pools", None)
+
+
+def test_replica_dsns_split(two_replicas):
+    """Tests replica connection strings are read from the environment"""
+
+    assert replica_dsns() == ["host=replica1 dbname=news", "host=replica2 dbname=news"]
+    assert len(db_pool.get_replica_pools()) == 2
+
+
+@patch("api.make_new_story")
+@patch("api.get_db_connection")
+def test_write_sets_sticky_cookie(mock_get_db_connection, mock_make_new_story,
+                                  two_replicas, api_client):
+    """Tests a client that writes is told to read from the primary for a while"""
+
+    response = api_client.post("/stories", json={"url": "https://a.com", "title": "A"})
+
+    assert response.status_code == 201
+    assert STICKY_COOKIE in response.headers["Set-Cookie"]
+
+
+@patch("api.make_new_story")
+@patch("api.get_db_connection")
+def test_no_sticky_cookie_without_replicas(mock_get_db_connection, mock_make_new_story,
+                                           api_client):
+    """Tests nothing changes for clients when there are no replicas"""
+
+    response = api_client.post("/stories", json={"url": "https://a.com", "title": "A"})
+
+    assert "Set-Cookie" not in response.headers
+
+
+@patch("api.load_all_stories")
+@patch("api.get_db_connection")
+@patch("api.read_from_replica", return_value=True)
+@patch("api.get_read_replica_connection")
+def test_reads_use_replica_connection(mock_replica_connection, mock_read_from_replica,
+                                      mock_get_db_connection, mock_load_all_stories, api_client):
+    """Tests story reads go to the replica, and are not cached just after a write"""
+
+    mock_load_all_stories.return_value = [{"id": 1, "title": "A"}]
+    get_stories_cache().invalidate()
+
+    response = api_client.get("/stories")
+
+    assert response.status_code == 200
+    assert mock_load_all_stories.call_args[0][0] is mock_replica_connection.return_value
+    assert mock_get_db_connection.call_count == 0
+    assert get_stories_cache().stats()["entries"] == 0
+
+
+def test_two_local_instances():
+    """Checks a replica configured in DATABASE_REPLICA_DSNS can be reached and
+    reports its lag. Skipped unless both databases are configured"""
+    if "DATABASE_NAME" not in os.environ or not replica_dsns():
+        pytest.skip("No replica configured")
+    connection = get_replica_connection(replica_dsns()[0])
+    if connection is None:
+        pytest.skip("Replica unavailable")
+
+    lag = replica_lag(connection)
+    connection.close()
+
+    assert lag is None or lag >= 0
@@ -0,0 +1,53 @@
+""" Tests for the GET /stories response cache"""
+from response_cache import ResponseCache, FileVersion
+
+
+def test_cache_hit_returns_body_and_etag():
+    """Tests a stored body comes back with the etag it was given"""
+
+    cache = ResponseCache()
+    key = cache.key(("sort", "score"))
+    etag = cache.put(key, b'[{"id":1}]')
+
+    assert cache.get(key) == (b'[{"id":1}]', etag)
+    assert cache.stats()["hits"] == 1
+
+
+def test_invalidate_changes_keys():
+    """Tests responses cached before a write are not served after it"""
+
+    cache = ResponseCache()
+    key = cache.key(("sort", "score"))
+    cache.put(key, b"[]")
+
+    cache.invalidate()
+
+    assert cache.get(cache.key(("sort", "score"))) is None
+
+
+def test_least_recently_used_evicted():
+    """Tests the cache never holds more than max_entries responses"""
+
+    cache = ResponseCache(max_entries=2)
+    cache.put(("a", ), b"a")
+    cache.put(("b", ), b"b")
+    cache.get(("a", ))
+    cache.put(("c", ), b"c")
+
+    assert cache.get(("b", )) is None
+    assert cache.get(("a", ))[0] == b"a"
+    assert cache.stats()["entries"] == 2
+
+
+def test_file_version_shared_between_caches(tmp_path):
+    """Tests a write seen by one process's cache invalidates another's"""
+
+    version_file = tmp_path / "stories.version"
+    first = ResponseCache(version=FileVersion(version_file))
+    second = ResponseCache(version=FileVersion(version_file))
+    key = second.key(("sort", "title"))
+    second.put(key, b"[]")
+
+    first.invalidate()
+
+    assert second.key(("sort", "title")) != key
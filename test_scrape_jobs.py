@@ -0,0 +1,132 @@
+""" Tests for background scrape jobs"""
+from unittest.mock import MagicMock, patch
+import pytest
+from fetcher import FetchError
+from scrape_jobs import enqueue_scrape_job, claim_scrape_job, run_scrape_job
+
+
+def test_enqueue_scrape_job():
+    """Tests a job is queued and its id returned"""
+
+    mock_connection = MagicMock()
+    mock_cursor = mock_connection.cursor()
+    mock_cursor.fetchone.return_value = {"id": 7}
+
+    urls = ["https://www.bbc.co.uk/news"]
+    job_id = enqueue_scrape_job(mock_connection, urls)
+
+    assert job_id == 7
+    assert mock_cursor.execute.call_args[0][1] == (urls, )
+    assert mock_connection.commit.call_count == 1
+
+
+def test_claim_gives_up_on_jobs_out_of_attempts():
+    """Tests a lost job is only retried while it has attempts left, and failed after that"""
+
+    mock_connection = MagicMock()
+    mock_cursor = mock_connection.cursor()
+    mock_cursor.fetchone.return_value = None
+
+    claim_scrape_job(mock_connection, 600, 3)
+    query, params = mock_cursor.execute.call_args[0]
+
+    assert params == {"stale_after": 600, "max_attempts": 3}
+    assert "SET status = 'failed'" in query
+    assert "attempts >= %(max_attempts)s" in query
+    assert "attempts < %(max_attempts)s" in query
+
+
+def test_claim_skips_locked_jobs():
+    """Tests jobs are claimed without blocking on jobs other workers hold"""
+
+    mock_connection = MagicMock()
+    mock_cursor = mock_connection.cursor()
+    mock_cursor.fetchone.return_value = None
+
+    assert claim_scrape_job(mock_connection, 600) is None
+    assert "FOR UPDATE SKIP LOCKED" in mock_cursor.execute.call_args[0][0]
+    assert mock_connection.commit.call_count == 1
+
+
+@patch("scrape_jobs.ingest_stories")
+@patch("scrape_jobs.parse_stories_bs")
+def test_run_scrape_job_counts_failed_urls(mock_parse, mock_ingest):
+    """Tests a failing url is counted while the other urls are still scraped"""
+
+    def fetch_all(urls, failures):
+        failures[urls[1]] = FetchError("timed out")
+        yield urls[0], "<html></html>"
+
+    mock_fetcher = MagicMock()
+    mock_fetcher.fetch_all.side_effect = fetch_all
+    mock_parse.return_value = [
+        {"url": "https://www.bbc.co.uk/news/1", "title": "One"},
+        {"url": "https://www.bbc.co.uk/news/2", "title": "Two"},
+        {"url": "https://www.bbc.co.uk/news/3", "title": "Two again"}
+    ]
+    mock_ingest.return_value = {"inserted": 1, "updated": 0, "merged": 1, "skipped": 1}
+    job = {"urls": ["https://www.bbc.co.uk/news", "https://www.bbc.co.uk/sport"]}
+
+    results = run_scrape_job(MagicMock(), job, mock_fetcher)
+
+    assert results["status"] == "done"
+    assert results["stories_found"] == 3
+    assert results["stories_added"] == 1
+    assert results["stories_merged"] == 1
+    assert results["stories_skipped"] == 1
+    assert results["urls_failed"] == 1
+    assert "timed out" in results["error"]
+    assert mock_ingest.call_count == 1
+
+
+def test_run_scrape_job_fails_when_every_url_fails():
+    """Tests a job where no url could be fetched is marked as failed"""
+
+    def fetch_all(urls, failures):
+        failures[urls[0]] = FetchError("timed out")
+        yield from ()
+
+    mock_fetcher = MagicMock()
+    mock_fetcher.fetch_all.side_effect = fetch_all
+
+    results = run_scrape_job(MagicMock(), {"urls": ["https://www.bbc.co.uk/news"]}, mock_fetcher)
+
+    assert results["status"] == "failed"
+    assert results["stories_found"] == 0
+
+
+@patch("scrape_jobs.ingest_stories")
+@patch("scrape_jobs.parse_stories_bs")
+def test_run_scrape_job_skips_unchanged_pages(mock_parse, mock_ingest):
+    """Tests a page the cache shows is unchanged is neither parsed nor ingested"""
+
+    mock_fetcher = MagicMock()
+    mock_fetcher.fetch_all.return_value = iter([("https://www.bbc.co.uk/news", None)])
+
+    results = run_scrape_job(MagicMock(), {"urls": ["https://www.bbc.co.uk/news"]}, mock_fetcher)
+
+    assert results["status"] == "done"
+    assert results["urls_unchanged"] == 1
+    assert mock_parse.call_count == 0
+    assert mock_ingest.call_count == 0
+
+
+@patch("scrape_jobs.ingest_stories")
+@patch("scrape_jobs.parse_stories_bs")
+def test_page_cached_only_after_ingest(mock_parse, mock_ingest):
+    """Tests a page is committed to the cache once its stories are stored, and not if that fails"""
+
+    mock_fetcher = MagicMock()
+    mock_fetcher.fetch_all.side_effect = lambda urls, failures: iter([(urls[0], "<html></html>")])
+    mock_parse.return_value = [{"url": "https://www.bbc.co.uk/news/1", "title": "One"}]
+    mock_ingest.side_effect = RuntimeError("database went away")
+    job = {"urls": ["https://www.bbc.co.uk/news"]}
+
+    with pytest.raises(RuntimeError):
+        run_scrape_job(MagicMock(), job, mock_fetcher)
+    assert mock_fetcher.cache.commit.call_count == 0
+
+    mock_ingest.side_effect = None
+    mock_ingest.return_value = {"inserted": 1, "updated": 0, "merged": 0, "skipped": 0}
+    run_scrape_job(MagicMock(), job, mock_fetcher)
+    mock_fetcher.cache.commit.assert_called_once_with("https://www.bbc.co.uk/news")
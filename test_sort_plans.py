@@ -0,0 +1,102 @@
+""" Checks that every sort mode is read from an index rather than sorted.
+
+Needs a database with the current schema, configured by the same
+environment variables as the API; skipped when none is available. Seeds
+stories inside a transaction that is rolled back afterwards.
+"""
+import os
+import pytest
+from stories_functions import get_db_connection, sort_stories, load_stories_page, PAGE_SORT_KEYS
+
+SEED_ROWS = 20000
+
+
+class ExplainingCursor:
+    """Cursor that records the plan of each query before running it"""
+
+    def __init__(self, cursor, explain_cursor, plans: list):
+        self.cursor = cursor
+        self.explain_cursor = explain_cursor
+        self.plans = plans
+
+    def execute(self, query, params=None):
+        """Explains the query, then runs it"""
+        self.explain_cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+        self.plans.append(self.explain_cursor.fetchone()[0][0]["Plan"])
+        self.cursor.execute(query, params)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class ExplainingConnection:
+    """Connection whose cursors record query plans"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.plans = []
+
+    def cursor(self, **kwargs):
+        """Returns a cursor that explains what it runs"""
+        return ExplainingCursor(
+            self.connection.cursor(**kwargs), self.connection.cursor(), self.plans)
+
+
+def node_types(plan: dict) -> set:
+    """Every node type in a plan tree"""
+    types = {plan["Node Type"]}
+    for child in plan.get("Plans", []):
+        types |= node_types(child)
+    return types
+
+
+@pytest.fixture(scope="module")
+def seeded_connection():
+    """A database connection with extra stories that are rolled back afterwards"""
+    if "DATABASE_NAME" not in os.environ:
+        pytest.skip("No database configured")
+    connection = get_db_connection()
+    if connection is None:
+        pytest.skip("Database unavailable")
+
+    cursor = connection.cursor()
+    cursor.execute("""INSERT INTO stories (title, url, created_at, updated_at, score)
+            SELECT md5(n::text), 'https://example.com/' || n,
+            now() - n * interval '1 minute', now() - (n %% 977) * interval '1 minute', n %% 53
+            FROM generate_series(1, %s) AS n;""", (SEED_ROWS, ))
+    cursor.execute("ANALYZE stories;")
+    cursor.close()
+
+    yield connection
+
+    connection.rollback()
+    connection.close()
+
+
+@pytest.mark.parametrize("sort_type", sorted(PAGE_SORT_KEYS))
+@pytest.mark.parametrize("order", ["ascending", "descending"])
+def test_sort_uses_index(seeded_connection, sort_type, order):
+    """sort_stories with a limit reads the first rows from an index"""
+    connection = ExplainingConnection(seeded_connection)
+
+    stories = sort_stories(connection, sort_type, order, limit=20)
+
+    assert len(stories) == 20
+    types = node_types(connection.plans[0])
+    assert "Seq Scan" not in types
+    assert not {"Sort", "Incremental Sort"} & types
+
+
+@pytest.mark.parametrize("sort_type", sorted(PAGE_SORT_KEYS))
+@pytest.mark.parametrize("order", ["ascending", "descending"])
+def test_page_uses_index(seeded_connection, sort_type, order):
+    """load_stories_page seeks into an index for the first and later pages"""
+    connection = ExplainingConnection(seeded_connection)
+
+    _, next_cursor = load_stories_page(connection, sort_type, order, 20)
+    load_stories_page(connection, sort_type, order, 20, next_cursor)
+
+    for plan in connection.plans:
+        types = node_types(plan)
+        assert "Seq Scan" not in types
+        assert not {"Sort", "Incremental Sort"} & types
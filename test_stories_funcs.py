@@ -1,15 +1,29 @@
 """ Tests for functions in stories api"""
-from unittest.mock import MagicMock
+from datetime import date
+from unittest.mock import MagicMock, patch
+import pytest
 from stories_functions import (
 load_all_stories,
 update_stories,
 make_new_story,
 find_story_with_id,
 add_votes,
+add_vote_batch,
+apply_story_batch,
 delete_story,
 sort_stories,
 find_specific_story,
-count_votes
+count_votes,
+reconcile_story_scores,
+ensure_vote_partitions,
+compact_votes,
+load_stories_page,
+encode_cursor,
+decode_cursor,
+search_stories_page,
+build_prefix_query,
+stream_stories,
+refresh_trending
 )
 
 
@@ -59,13 +73,18 @@ def test_make_story():
     title = "goodstory"
     url = "www.goodstory.com"
 
-    mock_query = "INSERT INTO stories (title, url, created_at, updated_at)\
-        VALUES (%s, %s, current_timestamp, current_timestamp);"
-    make_new_story(mock_connection, url, title)
+    mock_query = "INSERT INTO stories (title, url, canonical_url, title_fingerprint, title_bands,\
+        created_at, updated_at)\
+        VALUES (%s, %s, %s, %s, %s::int[], current_timestamp, current_timestamp)\
+        ON CONFLICT (canonical_url) DO NOTHING\
+        RETURNING id;"
+    mock_connection.cursor().fetchone.return_value = {"id": 12}
+    story_id = make_new_story(mock_connection, url, title)
 
     assert mock_execute.call_count == 1
     assert mock_execute.call_args[0][0] == mock_query
-    assert mock_execute.call_args[0][1] == (title, url)
+    assert mock_execute.call_args[0][1] == (title, url, "https://goodstory.com/", None, [])
+    assert story_id == 12
     assert mock_commit.call_count == 1
     assert mock_close.call_count == 1
 
@@ -82,13 +101,14 @@ def test_update_story():
     url = "www.update.com"
 
     mock_query = """UPDATE stories
-        SET title = %s, url = %s, updated_at = current_timestamp 
+        SET title = %s, url = %s, canonical_url = %s, title_fingerprint = %s,
+        title_bands = %s::int[], updated_at = current_timestamp
         WHERE id = %s;"""
     update_stories(mock_connection, url, title, 2)
 
     assert mock_execute.call_count == 1
     assert mock_execute.call_args[0][0] == mock_query
-    assert mock_execute.call_args[0][1] == (title, url, 2)
+    assert mock_execute.call_args[0][1] == (title, url, "https://update.com/", None, [], 2)
     assert mock_commit.call_count == 1
     assert mock_close.call_count == 1
 
@@ -128,17 +148,89 @@ def test_make_vote():
 
     direction = "up"
 
-    mock_query = """INSERT INTO votes(direction, created_at, updated_at, story_id)
-            VALUES (%s, current_timestamp, current_timestamp, %s);"""
-    add_votes(mock_connection, direction, 56)
+    mock_connection.cursor().fetchone.return_value = {"score": 3}
+
+    assert add_votes(mock_connection, direction, 56) == 3
 
     assert mock_execute.call_count == 1
-    assert mock_execute.call_args[0][0] == mock_query
-    assert mock_execute.call_args[0][1] == (direction, 56)
+    assert "INSERT INTO votes" in mock_execute.call_args[0][0]
+    assert "UPDATE stories" in mock_execute.call_args[0][0]
+    assert mock_execute.call_args[0][1] == {
+        "direction": direction, "story_id": 56, "gravity": 1.8, "age_offset": 2.0}
     assert mock_commit.call_count == 1
     assert mock_close.call_count == 1
 
 
+def test_make_vote_refused():
+    """Tests that a refused downvote reports no new score"""
+
+    mock_connection = MagicMock()
+    mock_connection.cursor().fetchone.return_value = None
+
+    assert add_votes(mock_connection, "down", 56) is None
+    assert "score > 0" in mock_connection.cursor().execute.call_args[0][0]
+
+
+@patch("stories_functions.extras.execute_values")
+def test_add_vote_batch(mock_execute_values):
+    """Tests that buffered votes are written in one statement"""
+
+    mock_connection = MagicMock()
+    mock_execute_values.return_value = [(1, 5, 0, 5), (2, 1, 1, 3)]
+
+    added = add_vote_batch(mock_connection, {1: [5, 0], 2: [1, 1]})
+
+    assert added == 7
+    mock_execute_values.assert_called_once()
+    assert mock_execute_values.call_args[0][2] == [(1, 5, 0), (2, 1, 1)]
+    assert "FOR UPDATE" in mock_execute_values.call_args[0][1]
+    assert mock_connection.commit.call_count == 1
+
+
+@patch("stories_functions.extras.execute_values")
+def test_apply_story_batch(mock_execute_values):
+    """Tests a batch runs one statement per kind of change and commits once"""
+
+    mock_connection = MagicMock()
+    mock_cursor = mock_connection.cursor()
+    mock_cursor.fetchall.return_value = [(6, )]
+    mock_execute_values.side_effect = [
+        [(10, "https://a.com/1")],
+        [(3, True, True)],
+        [(3, 1, 0, 4)]
+    ]
+    plan = {
+        "create": [(0, "One", "https://a.com/1", "https://a.com/1", None, [])],
+        "edit": [(0, 3, "Three", "https://a.com/3", "https://a.com/3", None, [])],
+        "vote": [(0, 3, "up")],
+        "delete": [(0, 6), (1, 7)]
+    }
+
+    written = apply_story_batch(mock_connection, plan)
+
+    assert written == {
+        "created": {"https://a.com/1": 10},
+        "edited": {3: (True, True)},
+        "voted": {3: (1, 0, 4)},
+        "deleted": {6}
+    }
+    assert mock_execute_values.call_count == 3
+    assert mock_cursor.execute.call_args[0][1] == ([6, 7], )
+    assert mock_connection.commit.call_count == 1
+
+
+def test_delete_story_single_statement():
+    """Tests deleting a story leaves its votes to the cascading foreign keys"""
+
+    mock_connection = MagicMock()
+
+    delete_story(mock_connection, 4)
+
+    assert mock_connection.cursor().execute.call_args[0] == (
+        "DELETE FROM stories WHERE id = %s;", (4, ))
+    assert mock_connection.commit.call_count == 1
+
+
 def test_count_votes():
     """Tests if vote count changes correctly"""
 
@@ -162,3 +254,239 @@ def test_count_votes():
     assert result[0].get("score") == 4
     assert isinstance(result, list)
     assert mock_close.call_count == 1
+
+
+def test_reconcile_story_scores():
+    """Tests score counters are rebuilt and the number corrected is returned"""
+
+    mock_connection = MagicMock()
+    mock_cursor = mock_connection.cursor()
+    mock_cursor.rowcount = 3
+
+    result = reconcile_story_scores(mock_connection)
+
+    assert result == 3
+    assert "UPDATE stories" in mock_cursor.execute.call_args[0][0]
+    assert "FROM vote_rollups" in mock_cursor.execute.call_args[0][0]
+    assert mock_connection.commit.call_count == 1
+    assert mock_cursor.close.call_count == 1
+
+
+def test_ensure_vote_partitions_creates_missing_months():
+    """Tests partitions are created for missing months, skipping ones that
+    exist or whose votes are already in the default partition"""
+
+    mock_connection = MagicMock()
+    mock_cursor = mock_connection.cursor()
+    mock_cursor.fetchall.side_effect = [
+        [(date(2026, 10, 1), date(2026, 11, 1)), (date(2026, 11, 1), date(2026, 12, 1)),
+         (date(2026, 12, 1), date(2027, 1, 1))],
+        [("votes_default", ), ("votes_2026_10", )]
+    ]
+    mock_cursor.fetchone.side_effect = [(True, ), (False, )]
+
+    created = ensure_vote_partitions(mock_connection)
+
+    assert created == ["votes_2026_12"]
+    assert "CREATE TABLE votes_2026_12 PARTITION OF votes" in mock_cursor.execute.call_args[0][0]
+    assert mock_cursor.execute.call_args[0][1] == (date(2026, 12, 1), date(2027, 1, 1))
+    assert mock_connection.commit.call_count == 1
+
+
+def test_compact_votes_rolls_up_old_partitions():
+    """Tests partitions older than the cutoff are rolled up and dropped,
+    and old votes in the default partition rolled up and deleted"""
+
+    mock_connection = MagicMock()
+    mock_cursor = mock_connection.cursor()
+    mock_cursor.fetchone.side_effect = [(date(2026, 7, 1), ), (120, 2), (5, 0)]
+    mock_cursor.fetchall.return_value = [
+        ("votes_2026_06", ), ("votes_2026_07", ), ("votes_default", )
+    ]
+
+    compacted = compact_votes(mock_connection, 3)
+    statements = [call[0][0] for call in mock_cursor.execute.call_args_list]
+
+    assert compacted == {"partitions_dropped": 1, "votes_rolled_up": 125, "votes_discarded": 2}
+    assert statements.index("ALTER TABLE votes DETACH PARTITION votes_2026_06;") \
+        < statements.index("DROP TABLE votes_2026_06;")
+    assert not any("votes_2026_07" in statement for statement in statements)
+    assert "DELETE FROM votes_default WHERE created_at < %s;" in statements
+    assert sum("INSERT INTO vote_rollups" in statement for statement in statements) == 2
+    assert mock_connection.commit.call_count == 3
+
+
+def test_load_stories_page_returns_next_cursor():
+    """Tests an extra row is fetched to decide if there is a next page"""
+
+    mock_connection = MagicMock()
+    mock_fetch = mock_connection.cursor().fetchall
+    mock_fetch.return_value = [
+        {"id": 5, "score": 9, "sort_key": 9},
+        {"id": 3, "score": 7, "sort_key": 7},
+        {"id": 8, "score": 7, "sort_key": 7}
+    ]
+
+    stories, next_cursor = load_stories_page(mock_connection, "score", "descending", 2)
+
+    assert stories == [{"id": 5, "score": 9}, {"id": 3, "score": 7}]
+    assert next_cursor == encode_cursor("score", "descending", 7, 3)
+
+
+def test_load_stories_page_seeks_past_cursor():
+    """Tests the cursor position is used in the WHERE clause instead of an offset"""
+
+    mock_connection = MagicMock()
+    mock_execute = mock_connection.cursor().execute
+    mock_connection.cursor().fetchall.return_value = []
+
+    cursor = encode_cursor("created", "ascending", "2023-10-26T12:46:00", 41)
+    stories, next_cursor = load_stories_page(mock_connection, "created", None, 20, cursor)
+
+    assert stories == []
+    assert next_cursor is None
+    assert "(created_at, id) > (%s, %s)" in mock_execute.call_args[0][0]
+    assert mock_execute.call_args[0][1] == ("2023-10-26T12:46:00", 41, 21)
+
+
+def test_load_stories_page_rejects_bad_cursor():
+    """Tests a cursor for another sort order or an invalid token is refused"""
+
+    mock_connection = MagicMock()
+    title_cursor = encode_cursor("title", "ascending", "Bob", 1)
+
+    with pytest.raises(ValueError):
+        load_stories_page(mock_connection, "score", "ascending", 20, title_cursor)
+
+    with pytest.raises(ValueError):
+        load_stories_page(mock_connection, "score", "ascending", 20, "not-a-cursor")
+
+
+def test_search_uses_full_text_and_trigram_matching():
+    """Tests searches are ranked by relevance using the indexed expressions"""
+
+    mock_connection = MagicMock()
+    mock_execute = mock_connection.cursor().execute
+    mock_connection.cursor().fetchall.return_value = [{"id": 1, "title": "Storm Babet"}]
+
+    result = find_specific_story(mock_connection, "Storm", limit=10)
+    query, params = mock_execute.call_args[0]
+
+    assert result == [{"id": 1, "title": "Storm Babet"}]
+    assert "to_tsvector('english', title) @@ terms" in query
+    assert "ORDER BY ts_rank" in query
+    assert params == ("Storm", "%storm%", "storm", "storm", 10, 0)
+
+
+def test_search_stories_page_continues_from_cursor():
+    """Tests a search page fetches one extra row and its cursor leads on to the next page"""
+
+    mock_connection = MagicMock()
+    mock_execute = mock_connection.cursor().execute
+    mock_connection.cursor().fetchall.return_value = [{"id": 1}, {"id": 2}, {"id": 3}]
+
+    stories, next_cursor = search_stories_page(mock_connection, "storm", False, 2)
+    search_stories_page(mock_connection, "storm", False, 2, next_cursor)
+
+    assert stories == [{"id": 1}, {"id": 2}]
+    assert mock_execute.call_args[0][1][-2:] == (3, 2)
+    with pytest.raises(ValueError):
+        search_stories_page(mock_connection, "rain", False, 2, next_cursor)
+    with pytest.raises(ValueError):
+        search_stories_page(mock_connection, "storm", False, 2, encode_cursor("id", "ascending", 1, 1))
+
+
+def test_decode_cursor_checks_sort_key_type():
+    """Tests a forged cursor whose sort key cannot be compared with the column is refused"""
+
+    assert decode_cursor(encode_cursor("score", "ascending", 7, 3))[2] == 7
+    for sort_type, sort_key in (("score", "7"), ("id", True), ("created", "yesterday"),
+                                ("trending", "1.5"), ("title", 4)):
+        with pytest.raises(ValueError):
+            decode_cursor(encode_cursor(sort_type, "ascending", sort_key, 3))
+
+
+def test_build_prefix_query():
+    """Tests the last search word is matched as a prefix and symbols are dropped"""
+
+    assert build_prefix_query("Rishi Sun") == "rishi & sun:*"
+    assert build_prefix_query("it's & | !") == "it & s:*"
+    assert build_prefix_query("  ") == ""
+
+
+def test_sort_stories_by_score():
+    """Tests that sorting by score orders by the indexed column and id"""
+
+    mock_connection = MagicMock()
+    mock_execute = mock_connection.cursor().execute
+    mock_connection.cursor().fetchall.return_value = [{"id": 1, "score": 9}]
+
+    result = sort_stories(mock_connection, "score", "descending", limit=5)
+
+    assert result == [{"id": 1, "score": 9}]
+    assert "ORDER BY score DESC, id DESC" in mock_execute.call_args[0][0]
+    assert mock_execute.call_args[0][1] == (5, )
+
+
+def test_stream_stories_uses_server_side_cursor():
+    """Tests stories are streamed in batches from a named cursor that is closed afterwards"""
+
+    mock_connection = MagicMock()
+    mock_cursor = mock_connection.cursor.return_value
+    mock_cursor.__iter__.return_value = iter([{"id": 1}, {"id": 2}])
+
+    rows = stream_stories(mock_connection, "created", "descending", batch_size=50)
+
+    assert mock_connection.cursor.call_args[1]["name"] == "stream_stories"
+    assert mock_cursor.itersize == 50
+    assert "ORDER BY created_at DESC, id DESC" in mock_cursor.execute.call_args[0][0]
+    assert list(rows) == [{"id": 1}, {"id": 2}]
+    assert mock_cursor.close.call_count == 1
+
+
+def test_sort_trending_defaults_to_highest_first():
+    """Tests trending without an order lists the highest ranked stories first"""
+
+    mock_connection = MagicMock()
+    mock_execute = mock_connection.cursor().execute
+
+    sort_stories(mock_connection, "trending", None, limit=10)
+
+    assert "ORDER BY trending_score DESC, id DESC" in mock_execute.call_args[0][0]
+
+
+def test_refresh_trending_skips_when_locked():
+    """Tests a decay pass is skipped while another process is running one"""
+
+    mock_connection = MagicMock()
+    mock_cursor = mock_connection.cursor()
+    mock_cursor.fetchone.return_value = (False, )
+
+    assert refresh_trending(mock_connection, 72, 1.8, 2) is None
+    assert mock_cursor.execute.call_count == 1
+    assert mock_connection.rollback.call_count == 1
+
+
+@pytest.mark.parametrize("query_stories", [
+    load_all_stories,
+    lambda connection: find_story_with_id(connection, 2),
+    lambda connection: sort_stories(connection, "trending", None, 10),
+    lambda connection: stream_stories(connection, "title", None),
+    lambda connection: load_stories_page(connection, "trending", None, 10),
+    lambda connection: find_specific_story(connection, "sunak", limit=10)
+])
+def test_listing_rows_have_public_columns(query_stories):
+    """Tests a story row has exactly the public columns, without the ones
+    kept for deduplication and ranking"""
+
+    mock_connection = MagicMock()
+    mock_connection.cursor().fetchall.return_value = []
+    query_stories(mock_connection)
+
+    query = mock_connection.cursor().execute.call_args[0][0]
+    selected = query.split("SELECT ", 1)[1].split(" FROM ", 1)[0].split(",")
+    columns = {column.strip().removeprefix("stories.") for column in selected
+               if not column.endswith("AS sort_key")}
+
+    assert columns == {"id", "title", "url", "created_at", "updated_at", "score",
+                       "upvotes", "downvotes"}
@@ -0,0 +1,123 @@
+""" Tests for checking batches of story changes and reporting their results"""
+from unittest.mock import patch
+import pytest
+from story_batch import parse_batch, report_batch, BatchError, MAX_BATCH_SIZE
+
+
+@pytest.mark.parametrize("body", [
+    [],
+    {},
+    {"create": [], "rename": []},
+    {"delete": 4},
+    {"delete": list(range(MAX_BATCH_SIZE + 1))}
+])
+def test_malformed_batch_refused(body):
+    """Tests a batch that is not an object of lists, or is too big, is refused as a whole"""
+
+    with pytest.raises(BatchError):
+        parse_batch(body)
+
+
+def test_invalid_items_reported_and_left_out():
+    """Tests items that cannot be written get their own error and the rest are planned"""
+
+    plan, results = parse_batch({
+        "create": [{"url": "https://a.com/1", "title": "One"}, {"title": "No url"},
+                   {"url": "https://www.a.com/1/", "title": "Same url"}],
+        "edit": [{"id": 3, "url": "https://a.com/3", "title": "Three"},
+                 {"id": 3, "url": "https://a.com/4", "title": "Three again"},
+                 {"url": "https://a.com/5", "title": "No id"}],
+        "vote": [{"id": 3, "direction": "up"}, {"id": 3, "direction": "sideways"}],
+        "delete": [7, "8", True]
+    })
+
+    assert [row[0] for row in plan["create"]] == [0]
+    assert [row[:2] for row in plan["edit"]] == [(0, 3)]
+    assert plan["vote"] == [(0, 3, "up")]
+    assert plan["delete"] == [(0, 7)]
+    assert results == {
+        "create": [None, {"status": 400, "error": "missing url"},
+                   {"status": 409, "error": "Another story already has this url"}],
+        "edit": [None, {"status": 400, "error": "A story can only be edited once in a batch"},
+                 {"status": 400, "error": "missing id"}],
+        "vote": [None, {"status": 400, "error": "Direction must be up or down"}],
+        "delete": [None, {"status": 400, "error": "Story ids must be integers"},
+                   {"status": 400, "error": "Story ids must be integers"}]
+    }
+
+
+def test_ids_outside_int4_are_missing_stories():
+    """Tests ids no story can have are reported as missing rather than sent to Postgres"""
+
+    plan, results = parse_batch({
+        "edit": [{"id": 87687587567, "url": "https://a.com/1", "title": "One"}],
+        "vote": [{"id": 2 ** 31, "direction": "up"}],
+        "delete": [0, 2 ** 31 - 1]
+    })
+
+    assert plan["edit"] == plan["vote"] == []
+    assert plan["delete"] == [(1, 2 ** 31 - 1)]
+    assert results == {
+        "edit": [{"status": 404, "error": "There is no story with this id"}],
+        "vote": [{"status": 404, "error": "There is no story with this id"}],
+        "delete": [{"status": 404, "error": "There is no story with this id"}, None]
+    }
+
+
+def test_results_reported_per_item():
+    """Tests each written item's result comes from what the statements returned"""
+
+    plan, results = parse_batch({
+        "create": [{"url": "https://a.com/1", "title": "One"},
+                   {"url": "https://a.com/2", "title": "Two"}],
+        "edit": [{"id": 3, "url": "https://a.com/3", "title": "Three"},
+                 {"id": 4, "url": "https://a.com/4", "title": "Four"},
+                 {"id": 5, "url": "https://a.com/5", "title": "Five"}],
+        "vote": [{"id": 3, "direction": "down"}, {"id": 3, "direction": "down"},
+                 {"id": 9, "direction": "up"}],
+        "delete": [6, 7]
+    })
+    written = {
+        "created": {"https://a.com/1": 10},
+        "edited": {3: (True, True), 4: (True, False), 5: (False, False)},
+        "voted": {3: (0, 1, 0)},
+        "deleted": {6}
+    }
+
+    assert report_batch(plan, results, written) == {
+        "create": [{"status": 201, "id": 10},
+                   {"status": 409, "error": "Another story already has this url"}],
+        "edit": [{"status": 201, "id": 3},
+                 {"status": 409, "error": "Another story already has this url"},
+                 {"status": 404, "error": "There is no story with this id"}],
+        "vote": [{"status": 200, "score": 0},
+                 {"status": 400, "error": "Can't downvote for a story with points of 0"},
+                 {"status": 404, "error": "There is no story with this id"}],
+        "delete": [{"status": 200, "id": 6},
+                   {"status": 404, "error": "There is no story with this id"}]
+    }
+
+
+@patch("api.get_db_connection")
+@patch("api.find_story_with_id")
+@patch("api.update_stories")
+@patch("api.make_new_story")
+@patch("api.apply_story_batch")
+def test_statuses_match_single_item_endpoints(mock_batch, mock_new_story, mock_update,
+                                              mock_find_story, mock_database, api_client):
+    """Tests a batch edit and a batch create of a taken url report what PATCH and POST return"""
+
+    mock_new_story.return_value = None
+    mock_find_story.return_value = {"id": 3}
+    mock_batch.return_value = {"created": {}, "edited": {3: (True, True)},
+                               "voted": {}, "deleted": set()}
+    new_story = {"url": "https://a.com/2", "title": "Two"}
+    edit = {"url": "https://a.com/3", "title": "Three"}
+
+    created = api_client.post("/stories", json=new_story)
+    edited = api_client.patch("/stories/3", json=edit)
+    batch = api_client.post("/stories/batch", json={"create": [new_story],
+                                                    "edit": [{"id": 3, **edit}]}).json
+
+    assert batch["create"][0]["status"] == created.status_code == 409
+    assert batch["edit"][0]["status"] == edited.status_code == 201
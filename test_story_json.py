@@ -0,0 +1,157 @@
+""" Tests for compact story records and their column-at-a-time JSON encoding """
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+import pytest
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from story_records import RecordCursor, record_class, from_asyncpg
+from story_json import StoryJSONProvider, http_date
+from stories_functions import get_db_connection, load_all_stories, load_stories_page
+
+COLUMNS = ("title", "id", "url", "created_at", "score", "trending_score",
+           "canonical_url", "title_bands", "weight")
+FLASK_APP = Flask(__name__)
+
+
+def random_story(number: int) -> tuple:
+    """A row with awkward values in every column"""
+    created = datetime(2023, 1, 1) + timedelta(seconds=random.randrange(10 ** 9))
+    return (
+        random.choice(["Plain title", 'Quote " and \\ slash', "Café – naïve 😀", "\x00\n\t"]),
+        number,
+        f"https://example.com/{number}?q=%s",
+        created if number % 2 else created.replace(tzinfo=timezone(timedelta(hours=5))),
+        random.randint(-10 ** 20, 10 ** 20),
+        random.random() * 10 ** random.randint(-9, 20),
+        None if number % 3 == 0 else f"https://example.com/{number}",
+        [random.randint(0, 10 ** 6) for _ in range(number % 4)],
+        Decimal(number) / 7
+    )
+
+
+def test_records_read_like_dicts():
+    """Tests a record answers every way the dicts it replaces did"""
+
+    record = record_class(("id", "title"))((1, "A story"))
+
+    assert record["title"] == "A story"
+    assert dict(record) == {"id": 1, "title": "A story"}
+    assert record == {"id": 1, "title": "A story"}
+    assert record.get("score") is None
+    assert not hasattr(record, "__dict__")
+    assert type(record) is type(record_class(("id", "title"))((2, "Another")))
+
+
+def test_from_asyncpg_keeps_columns():
+    """Tests rows with keys, like asyncpg Records, become records"""
+
+    class Row(dict):
+        """Iterates values, as asyncpg Records do"""
+        def __iter__(self):
+            return iter(self.values())
+
+    assert from_asyncpg([Row(id=1, score=4), Row(id=2, score=5)]) == [
+        {"id": 1, "score": 4}, {"id": 2, "score": 5}]
+    assert from_asyncpg([]) == []
+
+
+def test_http_date_matches_werkzeug():
+    """Tests the timestamp formatter agrees with Flask's for naive and aware datetimes"""
+
+    for hours in (0, 5, -11):
+        moment = datetime(2024, 2, 29, 23, 59, 58, tzinfo=timezone(timedelta(hours=hours)))
+        assert http_date(moment) == DefaultJSONProvider.default(moment)
+    assert http_date(datetime(2023, 10, 19, 16, 48, 46)) == "Thu, 19 Oct 2023 16:48:46 GMT"
+
+
+@pytest.mark.parametrize("options", [
+    {"separators": (",", ":")},
+    {},
+    {"ensure_ascii": False},
+    {"sort_keys": False, "separators": (",", ":")}
+])
+def test_columnar_output_is_byte_identical(options):
+    """Tests lists of records encode exactly as Flask encodes the same rows as dicts"""
+
+    random.seed(25)
+    record = record_class(COLUMNS)
+    rows = [random_story(number) for number in range(500)]
+
+    fast = StoryJSONProvider(FLASK_APP).dumps([record(row) for row in rows], **options)
+    plain = DefaultJSONProvider(FLASK_APP).dumps(
+        [dict(zip(COLUMNS, row)) for row in rows], **options)
+
+    assert fast == plain
+
+
+def test_unusual_columns_fall_back_per_value():
+    """Tests mixed, non-finite and nested values are left to json"""
+
+    record = record_class(("value", "nested", "tags"))
+    records = [record((float("nan"), {"b": 1, "a": [2]}, ["x", 1])), record(("text", None, [])),
+               record((True, record_class(("x",))((1, )), None)), record((1.5, None, [2, True]))]
+    provider = StoryJSONProvider(FLASK_APP)
+
+    assert provider.dumps(records) == DefaultJSONProvider(FLASK_APP).dumps([
+        {"value": float("nan"), "nested": {"b": 1, "a": [2]}, "tags": ["x", 1]},
+        {"value": "text", "nested": None, "tags": []},
+        {"value": True, "nested": {"x": 1}, "tags": None},
+        {"value": 1.5, "nested": None, "tags": [2, True]}])
+    assert provider.encode_rows(records[1:2]) == ['{"nested": null, "tags": [], "value": "text"}']
+
+
+def test_response_and_stream_use_fast_path(api_client, monkeypatch):
+    """Tests the app encodes records through the provider"""
+
+    record = record_class(("id", "created_at"))
+    rows = [record((number, datetime(2023, 10, 19, 16, 48, 46))) for number in (1, 2, 3)]
+    monkeypatch.setattr("api.get_db_connection", lambda: None)
+    monkeypatch.setattr("api.load_all_stories", lambda _: rows[:1])
+    monkeypatch.setattr("api.stream_stories", lambda *args: iter(rows))
+    monkeypatch.setenv("STREAM_BATCH_SIZE", "2")
+
+    response = api_client.get("/stories")
+    streamed = api_client.get("/stories?stream=1")
+
+    assert response.get_data() == b'[{"created_at":"Thu, 19 Oct 2023 16:48:46 GMT","id":1}]\n'
+    assert streamed.get_data() == b"[" + b",".join(
+        b'{"created_at":"Thu, 19 Oct 2023 16:48:46 GMT","id":%d}' % number
+        for number in (1, 2, 3)) + b"]"
+
+
+def test_record_cursor_fetches_records():
+    """Checks RecordCursor returns records from plain and server-side cursors.
+    Skipped unless a database is configured"""
+    if "DATABASE_NAME" not in os.environ:
+        pytest.skip("No database configured")
+    connection = get_db_connection()
+
+    cursor = connection.cursor(cursor_factory=RecordCursor)
+    cursor.execute("SELECT 1 AS id, 'a' AS title UNION ALL SELECT 2, 'b' ORDER BY id;")
+    fetched = cursor.fetchall()
+    named = connection.cursor(name="records", cursor_factory=RecordCursor)
+    named.execute("SELECT generate_series(1, 3) AS id;")
+    streamed = list(named)
+    connection.close()
+
+    assert fetched == [{"id": 1, "title": "a"}, {"id": 2, "title": "b"}]
+    assert [row["id"] for row in streamed] == [1, 2, 3]
+
+
+def test_listing_rows_keep_internal_columns_out():
+    """Checks a listed story has exactly the public columns.
+    Skipped unless a database is configured"""
+    if "DATABASE_NAME" not in os.environ:
+        pytest.skip("No database configured")
+    connection = get_db_connection()
+
+    stories = load_all_stories(connection)
+    page, _ = load_stories_page(connection, "trending", None, 1)
+    connection.close()
+
+    for story in stories[:1] + page:
+        assert set(story) == {"id", "title", "url", "created_at", "updated_at", "score",
+                              "upvotes", "downvotes"}
@@ -0,0 +1,44 @@
+""" Tests for the trending decay refresher """
+from unittest.mock import MagicMock, patch
+from trending import TrendingRefresher
+
+
+@patch("trending.refresh_trending")
+def test_refresh_records_cost(mock_refresh):
+    """A pass reports how many stories it refreshed and how long it took"""
+
+    mock_refresh.return_value = 120
+    pool = MagicMock()
+    refresher = TrendingRefresher(pool, horizon_hours=24)
+
+    assert refresher.refresh() == 120
+    assert mock_refresh.call_args[0][1] == 24
+    assert pool.checkin.call_count == 1
+
+    stats = refresher.stats()
+    assert stats["refreshes"] == 1
+    assert stats["last_refreshed"] == 120
+    assert stats["last_duration_ms"] >= 0
+
+
+@patch("trending.refresh_trending")
+def test_refresh_skipped_while_locked(mock_refresh):
+    """A pass another process is already running is counted as skipped"""
+
+    mock_refresh.return_value = None
+    refresher = TrendingRefresher(MagicMock())
+
+    assert refresher.refresh() is None
+    assert refresher.stats()["skipped"] == 1
+    assert refresher.stats()["refreshes"] == 0
+
+
+@patch("trending.refresh_trending")
+def test_zero_interval_disables_thread(mock_refresh):
+    """With no interval the refresher never starts a background pass"""
+
+    refresher = TrendingRefresher(MagicMock(), interval=0)
+    refresher.start()
+    refresher.stop()
+
+    assert mock_refresh.call_count == 0
@@ -0,0 +1,55 @@
+""" Tests for the write-behind vote buffer """
+from unittest.mock import MagicMock, patch
+import psycopg2
+import pytest
+from vote_buffer import VoteBuffer
+
+
+@patch("vote_buffer.add_vote_batch")
+def test_flush_coalesces_votes(mock_batch):
+    """Votes are summed per story and written in one batch"""
+
+    mock_batch.return_value = 4
+    buffer = VoteBuffer(MagicMock())
+    buffer.add(1, "up")
+    buffer.add(1, "up")
+    buffer.add(1, "down")
+    buffer.add(2, "up")
+
+    assert buffer.flush() == 4
+    assert mock_batch.call_args[0][1] == {1: [2, 1], 2: [1, 0]}
+    assert buffer.stats()["pending_votes"] == 0
+    assert buffer.flush() == 0
+    assert mock_batch.call_count == 1
+
+
+@patch("vote_buffer.add_vote_batch")
+def test_failed_flush_keeps_votes(mock_batch):
+    """Votes that could not be written are retried on the next flush"""
+
+    mock_batch.side_effect = psycopg2.OperationalError("connection lost")
+    buffer = VoteBuffer(MagicMock())
+    buffer.add(1, "up")
+
+    with pytest.raises(psycopg2.OperationalError):
+        buffer.flush()
+    buffer.add(1, "up")
+
+    mock_batch.side_effect = None
+    mock_batch.return_value = 2
+    buffer.flush()
+
+    assert mock_batch.call_args[0][1] == {1: [2, 0]}
+
+
+@patch("vote_buffer.add_vote_batch")
+def test_full_buffer_flushes_early(mock_batch):
+    """Reaching the flush size writes the votes without waiting for the interval"""
+
+    buffer = VoteBuffer(MagicMock(), flush_interval=60, flush_size=3)
+    buffer.start()
+    for _ in range(3):
+        buffer.add(7, "up")
+    buffer.stop()
+
+    assert mock_batch.call_args_list[0][0][1] == {7: [3, 0]}
@@ -0,0 +1,121 @@
+"""Background decay of the trending rank behind sort=trending.
+
+Votes update a story's rank as they change its score, so a story only goes
+stale as it ages. Every TRENDING_REFRESH_INTERVAL seconds (default 60) one
+pass recomputes the rank of the stories created in the last
+TRENDING_HORIZON_HOURS hours (default 72) and drops older stories to 0.
+TRENDING_GRAVITY and TRENDING_AGE_OFFSET set how quickly ranks decay. Each
+pass is timed on /metrics and in stats().
+"""
+import atexit
+import threading
+import time
+from os import environ
+import psycopg2
+from db_pool import get_pool, PoolTimeoutError
+from metrics import TRENDING_REFRESH_SECONDS, TRENDING_REFRESHED_STORIES
+from stories_functions import refresh_trending, trending_settings
+
+
+class TrendingRefresher:
+    """Runs the trending decay pass on an interval in a background thread"""
+
+    def __init__(self, connection_pool, interval: float = 60, horizon_hours: float = 72):
+        self.connection_pool = connection_pool
+        self.interval = interval
+        self.horizon_hours = horizon_hours
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._stats = {
+            "refreshes": 0,
+            "skipped": 0,
+            "last_refreshed": None,
+            "last_duration_ms": None,
+            "total_duration_ms": 0.0
+        }
+
+    def refresh(self) -> int:
+        """Runs one decay pass, returning how many stories it refreshed,
+        or None if another process was already running one"""
+        started = time.perf_counter()
+        connection = self.connection_pool.checkout()
+        try:
+            refreshed = refresh_trending(
+                connection, self.horizon_hours, **trending_settings())
+        finally:
+            self.connection_pool.checkin(connection)
+        duration = time.perf_counter() - started
+
+        with self._lock:
+            if refreshed is None:
+                self._stats["skipped"] += 1
+                return None
+
+            self._stats["refreshes"] += 1
+            self._stats["last_refreshed"] = refreshed
+            self._stats["last_duration_ms"] = duration * 1000
+            self._stats["total_duration_ms"] += duration * 1000
+
+        TRENDING_REFRESH_SECONDS.observe(duration)
+        TRENDING_REFRESHED_STORIES.inc(refreshed)
+        return refreshed
+
+    def start(self) -> None:
+        """Starts the background refresher if it is not already running"""
+        with self._lock:
+            if self._thread or self.interval <= 0:
+                return
+
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._work, name="trending-refresher", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the refresher after any pass in progress"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+
+        self._stopping.set()
+        self._wake.set()
+        if thread:
+            thread.join()
+
+    def stats(self) -> dict:
+        """Returns how many passes have run and what the last one cost"""
+        with self._lock:
+            return dict(self._stats)
+
+    def _work(self) -> None:
+        """Refreshes straight away and then on every interval, until stopped"""
+        while not self._stopping.is_set():
+            try:
+                self.refresh()
+            except (psycopg2.Error, PoolTimeoutError) as err:
+                print("Error refreshing trending stories.", err)
+
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def get_trending_refresher() -> TrendingRefresher:
+    """Returns the process-wide trending refresher, started and configured from the environment"""
+    global _refresher
+
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = TrendingRefresher(
+                get_pool(),
+                interval=float(environ.get("TRENDING_REFRESH_INTERVAL", 60)),
+                horizon_hours=float(environ.get("TRENDING_HORIZON_HOURS", 72))
+            )
+            _refresher.start()
+            atexit.register(_refresher.stop)
+        return _refresher
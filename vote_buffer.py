@@ -0,0 +1,142 @@
+"""Write-behind buffer for votes, for bursts on popular stories.
+
+With VOTE_WRITE_BEHIND set, POST /stories/<id>/votes adds the vote to this
+buffer instead of writing it straight away. Votes are coalesced into an
+upvote and downvote count per story and flushed in one statement and commit
+when the buffer reaches VOTE_FLUSH_SIZE votes or every VOTE_FLUSH_INTERVAL
+seconds, whichever comes first. Votes still buffered when the process stops
+are flushed at exit; a hard crash loses at most one interval of votes.
+"""
+import atexit
+import threading
+from os import environ
+import psycopg2
+from db_pool import get_pool, PoolTimeoutError
+from stories_functions import add_vote_batch
+
+
+class VoteBuffer:
+    """Coalesces votes per story in memory and writes them in batches"""
+
+    def __init__(self, connection_pool, flush_interval: float = 0.5, flush_size: int = 1000):
+        self.connection_pool = connection_pool
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        self._pending = {}
+        self._pending_votes = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.flushed = 0
+
+    def add(self, story_id: int, direction: str) -> None:
+        """Buffers one vote, waking the flusher once the buffer is full"""
+        with self._lock:
+            tally = self._pending.setdefault(story_id, [0, 0])
+            tally[0 if direction == "up" else 1] += 1
+            self._pending_votes += 1
+            full = self._pending_votes >= self.flush_size
+
+        if full:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Writes every buffered vote, returning how many were added.
+        On a database error the votes are put back to be retried on the next flush"""
+        with self._flush_lock:
+            with self._lock:
+                tallies, self._pending = self._pending, {}
+                self._pending_votes = 0
+
+            if not tallies:
+                return 0
+
+            try:
+                connection = self.connection_pool.checkout()
+                try:
+                    added = add_vote_batch(connection, tallies)
+                finally:
+                    self.connection_pool.checkin(connection)
+            except (psycopg2.Error, PoolTimeoutError):
+                self._merge(tallies)
+                raise
+
+            self.flushed += added
+            return added
+
+    def start(self) -> None:
+        """Starts the background flusher if it is not already running"""
+        with self._lock:
+            if self._thread:
+                return
+
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._work, name="vote-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the flusher after writing any votes still buffered"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+
+        self._stopping.set()
+        self._wake.set()
+        if thread:
+            thread.join()
+        self.flush()
+
+    def stats(self) -> dict:
+        """Returns how many votes are waiting and how many have been written"""
+        with self._lock:
+            return {
+                "pending_votes": self._pending_votes,
+                "pending_stories": len(self._pending),
+                "flushed": self.flushed
+            }
+
+    def _merge(self, tallies: dict) -> None:
+        """Puts unwritten votes back into the buffer"""
+        with self._lock:
+            for story_id, (ups, downs) in tallies.items():
+                tally = self._pending.setdefault(story_id, [0, 0])
+                tally[0] += ups
+                tally[1] += downs
+                self._pending_votes += ups + downs
+
+    def _work(self) -> None:
+        """Flushes on every interval, or sooner when the buffer fills, until stopped"""
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except (psycopg2.Error, PoolTimeoutError) as err:
+                print("Error flushing votes.", err)
+
+
+_vote_buffer = None
+_vote_buffer_lock = threading.Lock()
+
+
+def write_behind_enabled() -> bool:
+    """Whether votes should go through the buffer rather than straight to the database"""
+    return environ.get("VOTE_WRITE_BEHIND", "").lower() in ("1", "true", "yes")
+
+
+def get_vote_buffer() -> VoteBuffer:
+    """Returns the process-wide vote buffer, started and configured from the environment"""
+    global _vote_buffer
+
+    with _vote_buffer_lock:
+        if _vote_buffer is None:
+            _vote_buffer = VoteBuffer(
+                get_pool(),
+                flush_interval=float(environ.get("VOTE_FLUSH_INTERVAL", 0.5)),
+                flush_size=int(environ.get("VOTE_FLUSH_SIZE", 1000))
+            )
+            _vote_buffer.start()
+            atexit.register(_vote_buffer.stop)
+        return _vote_buffer